@@ -0,0 +1,108 @@
+# bom_app/management/commands/benchmark.py
+
+import json, subprocess, time
+from io import StringIO
+import django
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from bom_app.utils.benchmark import run_benchmarks, dataset_summary, compare_results, query_plans
+
+
+class Command(BaseCommand):
+    help = ("Benchmark BOM explosion, routing, roll-up and simulation hot paths on generated datasets "
+            "and write the results as JSON")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='10,50',
+                            help='Comma-separated generate_data --items sizes to benchmark')
+        parser.add_argument('--profiles', default='',
+                            help='Comma-separated generate_data --profile catalogues to benchmark')
+        parser.add_argument('--current', action='store_true',
+                            help='Benchmark the configured database as it is instead of generated datasets')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='Timed runs per case')
+        parser.add_argument('--samples', type=int, default=5,
+                            help='Items sampled per case')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed for the datasets and the sampled items')
+        parser.add_argument('--explain', action='store_true',
+                            help='Include the query plans of the explosion and where-used queries')
+        parser.add_argument('--output', default=None,
+                            help='Write the JSON results to this file instead of stdout')
+        parser.add_argument('--compare', default=None,
+                            help='Earlier results file; fail if a case regressed')
+        parser.add_argument('--threshold', type=float, default=1.25,
+                            help='Mean latency ratio counted as a regression with --compare')
+
+    def handle(self, *args, **options):
+        started = time.time()
+        if options['current']:
+            datasets = {"current": self.benchmark(options)}
+        else:
+            datasets = self.benchmark_generated(options)
+
+        results = {
+            "meta": {
+                "commit": self.git_commit(),
+                "started": started,
+                "duration_sec": round(time.time() - started, 1),
+                "django": django.get_version(),
+                "database": connection.vendor,
+                "repeat": options['repeat'],
+                "samples": options['samples'],
+                "seed": options['seed'],
+            },
+            "datasets": datasets,
+        }
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+            self.stdout.write(self.style.SUCCESS(f"Benchmark results written to {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)
+            regressions = compare_results(baseline, results, options['threshold'])
+            if regressions:
+                raise CommandError("Regressions against {}:\n{}".format(options['compare'], "\n".join(regressions)))
+            self.stdout.write(self.style.SUCCESS(f"No regressions against {options['compare']}"))
+
+    def benchmark(self, options):
+        result = {
+            "rows": dataset_summary(),
+            "cases": run_benchmarks(options['repeat'], options['samples'], options['seed']),
+        }
+        if options['explain']:
+            result["plans"] = query_plans()
+        return result
+
+    def benchmark_generated(self, options):
+        """
+        Generate every dataset in a throwaway test database, so the
+        configured database is never wiped
+        """
+        specs = [('items', int(size)) for size in options['sizes'].split(',') if size.strip()]
+        specs += [('profile', name.strip()) for name in options['profiles'].split(',') if name.strip()]
+
+        datasets = {}
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for option, value in specs:
+                self.stderr.write(f"Benchmarking {option}={value}...")
+                call_command('generate_data', seed=options['seed'], stdout=StringIO(), **{option: value})
+                datasets[f"{option}={value}"] = self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        return datasets
+
+    def git_commit(self):
+        try:
+            return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                  check=True).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
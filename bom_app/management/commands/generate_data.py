@@ -1,12 +1,67 @@
 # bom_app/management/commands/generate_data.py
 
 import random, time
-from django.core.management.base import BaseCommand
+from collections import Counter, defaultdict
+from django.core.management.base import BaseCommand, CommandError
 from django.db import transaction
 from bom_app.models import (
     Item, BOM, BOMLine, WorkCenter, RoutingStep
 )
-import django.db.models as models
+from bom_app.signals import maintenance_suspended
+from bom_app.utils.top_level_index import rebuild_top_level_index
+from bom_app.utils.cost_rollup import compute_total_costs
+from bom_app.utils.explosion_cache import invalidate_all
+from bom_app.utils.bulk_load import (
+    BOM_MODELS, DEFAULT_BATCH_SIZE, RowWriter, bulk_insert, copy_supported, flush_bom_tables, reset_sequences
+)
+from bom_app.utils.synthetic_bom import PROFILES, FAN_OUT_DISTRIBUTIONS, COLUMNS, CatalogueGenerator, parse_range
+
+# Options that shape a --profile catalogue, with the argparse type of each
+PROFILE_OPTIONS = {
+    'products': int,
+    'depth': parse_range,
+    'fan_out': parse_range,
+    'fan_out_dist': str,
+    'subassembly_ratio': float,
+    'sharing': float,
+    'parts': int,
+    'work_centers': int,
+}
+
+class AssemblyPool:
+    """
+    Assemblies not used in any BOM yet, with constant-time removal and
+    sampling so large datasets don't rescan the pool for every product
+    """
+    def __init__(self, assemblies):
+        # Reversed so pop() hands out the lowest item numbers first
+        self.items = list(reversed(assemblies))
+        self.index = {item.id: i for i, item in enumerate(self.items)}
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item.id in self.index
+
+    def remove(self, item):
+        i = self.index.pop(item.id)
+        last = self.items.pop()
+        if last.id != item.id:
+            self.items[i] = last
+            self.index[last.id] = i
+
+    def pop(self):
+        item = self.items[-1]
+        self.remove(item)
+        return item
+
+    def sample(self, k):
+        return random.sample(self.items, k=min(k, len(self.items)))
+
+    def choice(self):
+        return random.choice(self.items)
+
 
 class Command(BaseCommand):
     help = "Generate synthetic parts, assemblies, BOMs, routings & costs"
@@ -14,9 +69,99 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--items', type=int, default=10, 
                             help='Number of final items per complexity type (simple, moderate, complex)')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                            help='Rows per INSERT statement')
+        parser.add_argument('--copy', action='store_true',
+                            help='Write rows with COPY (PostgreSQL only)')
+        parser.add_argument('--seed', type=int, default=None,
+                            help='Random seed, for a reproducible dataset')
+
+        profiles = parser.add_argument_group(
+            'catalogue profiles',
+            'Stream a deep/wide catalogue instead of the simple/moderate/complex dataset. '
+            'The options override the chosen profile.'
+        )
+        profiles.add_argument('--profile', choices=sorted(PROFILES), default=None,
+                              help='Catalogue profile to generate')
+        profiles.add_argument('--products', type=int, help='Number of top-level products')
+        profiles.add_argument('--depth', type=parse_range, help='Levels below each product, e.g. 8-12')
+        profiles.add_argument('--fan-out', type=parse_range, help='BOM lines per assembly, e.g. 2-12')
+        profiles.add_argument('--fan-out-dist', choices=FAN_OUT_DISTRIBUTIONS, help='Distribution of the fan-out')
+        profiles.add_argument('--subassembly-ratio', type=float,
+                              help='Chance that a BOM line is a sub-assembly')
+        profiles.add_argument('--sharing', type=float,
+                              help='Chance that a sub-assembly is shared with earlier products')
+        profiles.add_argument('--parts', type=int, help='Number of parts')
+        profiles.add_argument('--work-centers', type=int, help='Number of work centers')
 
     def handle(self, *args, **options):
-        random.seed(time.time())
+        if options['copy'] and not copy_supported():
+            raise CommandError("--copy needs a PostgreSQL database")
+        if options['profile']:
+            return self.generate_profile(options)
+        overrides = [name for name in PROFILE_OPTIONS if options.get(name) is not None]
+        if overrides:
+            raise CommandError(f"--{overrides[0].replace('_', '-')} needs --profile")
+
+        start = time.perf_counter()
+        # All rows are built in memory and written in one transaction; the
+        # index maintenance signals are suspended and the indexes rebuilt in
+        # one pass at the end instead.
+        with maintenance_suspended(), transaction.atomic():
+            rows = self.generate(*args, **options)
+            self.write(rows, options['batch_size'], options['copy'])
+            rebuild_top_level_index()
+            invalidate_all()
+
+        counts = ", ".join(f"{len(rows[model])} {model.__name__}" for model in BOM_MODELS)
+        self.stdout.write(f"Wrote {counts} in {time.perf_counter() - start:.1f}s")
+
+    def generate_profile(self, options):
+        """
+        Stream a catalogue profile straight into the database
+        """
+        profile = dict(PROFILES[options['profile']])
+        profile.update({name: options[name] for name in PROFILE_OPTIONS if options.get(name) is not None})
+        if profile['parts'] < 1 or profile['work_centers'] < 1:
+            raise CommandError("A catalogue needs at least one part and one work center")
+        self.stdout.write(f"Generating '{options['profile']}' catalogue: {profile}")
+
+        start = time.perf_counter()
+        writer = RowWriter(COLUMNS, batch_size=options['batch_size'], use_copy=options['copy'])
+        with maintenance_suspended(), transaction.atomic():
+            flush_bom_tables()
+            for model, row in CatalogueGenerator(profile, seed=options['seed']).rows():
+                writer.add(model, row)
+            writer.flush()
+            reset_sequences()
+            rebuild_top_level_index()
+            invalidate_all()
+
+        counts = ", ".join(f"{writer.counts[model]} {model.__name__}" for model in BOM_MODELS)
+        self.stdout.write(f"Wrote {counts} in {time.perf_counter() - start:.1f}s")
+
+    def write(self, rows, batch_size, use_copy):
+        """
+        Replace the BOM tables with the generated rows
+        """
+        self.stdout.write("Writing rows...")
+        flush_bom_tables()
+        for model in BOM_MODELS:
+            bulk_insert(model, rows[model], batch_size=batch_size, use_copy=use_copy)
+        reset_sequences()
+
+    def generate(self, *args, **options):
+        """
+        Build the dataset in memory. Returns a dict of model -> unsaved
+        instances with their primary keys already assigned.
+        """
+        random.seed(time.time() if options.get('seed') is None else options['seed'])
+        rows = {model: [] for model in BOM_MODELS}
+
+        def add(model, **fields):
+            obj = model(id=len(rows[model]) + 1, **fields)
+            rows[model].append(obj)
+            return obj
         
         # Get the configuration parameter
         items_per_type = options['items']
@@ -52,12 +197,7 @@ class Command(BaseCommand):
         self.stdout.write(f"Estimated parts needed: {num_parts}")
         self.stdout.write(f"Estimated assemblies needed: {total_assemblies_needed}")
 
-        # 1) Wipe out old data
-        Item.objects.all().delete()
-        BOM.objects.all().delete()
-        BOMLine.objects.all().delete()
-        WorkCenter.objects.all().delete()
-        RoutingStep.objects.all().delete()
+        # 1) Old data is wiped when the new rows are written
 
         # 2) Create WorkCenters
         wc_defs = [
@@ -70,7 +210,7 @@ class Command(BaseCommand):
         ]
         wcs = []
         for i,(name,cost) in enumerate(wc_defs, start=1):
-            wc = WorkCenter.objects.create(
+            wc = add(WorkCenter,
                 wc_no=f"WC{i:02d}", name=name,
                 cost_per_min=cost
             )
@@ -87,7 +227,7 @@ class Command(BaseCommand):
         parts = []
         for i in range(1, num_parts + 1):
             category = random.choice(part_categories)
-            p = Item.objects.create(
+            p = add(Item,
                 item_no=f"P{i:04d}",
                 description=f"{category['name']} {i:04d}",
                 item_type='P',
@@ -102,7 +242,7 @@ class Command(BaseCommand):
         
         # Create initial pool of assemblies
         for i in range(1, total_assemblies_needed + 1):
-            a = Item.objects.create(
+            a = add(Item,
                 item_no=f"A{next_assembly_num:03d}",
                 description=f"Assembly A{next_assembly_num:03d}",
                 item_type='A',
@@ -119,7 +259,7 @@ class Command(BaseCommand):
         def create_new_assembly():
             nonlocal next_assembly_num
             new_item_no = f"A{next_assembly_num:03d}"
-            new_sub = Item.objects.create(
+            new_sub = add(Item,
                 item_no=new_item_no,
                 description=f"Assembly {new_item_no}",
                 item_type='A',
@@ -131,7 +271,7 @@ class Command(BaseCommand):
             return new_sub
         
         # 4) Pick finished products for each complexity
-        available_assemblies = assemblies.copy()
+        available_assemblies = AssemblyPool(assemblies)
         
         # 5) Generate BOMs with enforced complexity rules
         self.stdout.write("Generating BOMs with enforced complexity rules...")
@@ -146,13 +286,13 @@ class Command(BaseCommand):
                 # Create more assemblies if needed
                 assembly = create_new_assembly()
             else:
-                assembly = available_assemblies.pop(0)
+                assembly = available_assemblies.pop()
                 
             simple_products.append(assembly)
             used_assemblies.add(assembly.item_no)
             
             # Create BOM with only parts (2-20 parts)
-            bom = BOM.objects.create(
+            bom = add(BOM,
                 bom_no=f"BOM_S{i+1}_{assembly.item_no}",  # Ensure uniqueness
                 parent=assembly,
                 depth=0,
@@ -166,7 +306,7 @@ class Command(BaseCommand):
             
             for comp in comps:
                 qty = random.randint(1, 10)
-                BOMLine.objects.create(
+                add(BOMLine,
                     bom=bom,
                     component=comp,
                     quantity=qty
@@ -179,13 +319,13 @@ class Command(BaseCommand):
                 # Create more assemblies if needed
                 assembly = create_new_assembly()
             else:
-                assembly = available_assemblies.pop(0)
+                assembly = available_assemblies.pop()
                 
             moderate_products.append(assembly)
             used_assemblies.add(assembly.item_no)
             
             # Create top-level BOM
-            bom = BOM.objects.create(
+            bom = add(BOM,
                 bom_no=f"BOM_M{i+1}_{assembly.item_no}",  # Ensure uniqueness
                 parent=assembly,
                 depth=0,
@@ -199,7 +339,7 @@ class Command(BaseCommand):
             
             for comp in part_comps:
                 qty = random.randint(1, 10)
-                BOMLine.objects.create(
+                add(BOMLine,
                     bom=bom,
                     component=comp,
                     quantity=qty
@@ -207,15 +347,11 @@ class Command(BaseCommand):
             
             # Add 1-3 sub-assemblies (must have at least 1)
             n_subs = random.randint(1, 3)
-            available_subs = [a for a in available_assemblies if a.item_no not in used_assemblies]
-            
-            if len(available_subs) < n_subs:
-                # Create more assemblies if needed
-                needed = n_subs - len(available_subs)
-                for _ in range(needed):
-                    available_subs.append(create_new_assembly())
+            sub_comps = available_assemblies.sample(n_subs)
             
-            sub_comps = random.sample(available_subs, k=n_subs)
+            # Create more assemblies if needed
+            while len(sub_comps) < n_subs:
+                sub_comps.append(create_new_assembly())
             
             for j, comp in enumerate(sub_comps):
                 used_assemblies.add(comp.item_no)
@@ -223,7 +359,7 @@ class Command(BaseCommand):
                     available_assemblies.remove(comp)
                 
                 qty = random.randint(1, 5)
-                BOMLine.objects.create(
+                add(BOMLine,
                     bom=bom,
                     component=comp,
                     quantity=qty
@@ -231,7 +367,7 @@ class Command(BaseCommand):
                 
                 # Create sub-assembly BOM (parts only) if it doesn't already have one
                 if comp.item_no not in items_with_boms:
-                    sub_bom = BOM.objects.create(
+                    sub_bom = add(BOM,
                         bom_no=f"BOM_M{i+1}_SUB{j+1}_{comp.item_no}",  # Ensure uniqueness
                         parent=comp,
                         depth=1,
@@ -245,7 +381,7 @@ class Command(BaseCommand):
                     
                     for sub_comp in sub_part_comps:
                         sub_qty = random.randint(1, 10)
-                        BOMLine.objects.create(
+                        add(BOMLine,
                             bom=sub_bom,
                             component=sub_comp,
                             quantity=sub_qty
@@ -258,13 +394,13 @@ class Command(BaseCommand):
                 # Create more assemblies if needed
                 assembly = create_new_assembly()
             else:
-                assembly = available_assemblies.pop(0)
+                assembly = available_assemblies.pop()
                 
             complex_products.append(assembly)
             used_assemblies.add(assembly.item_no)
             
             # Create top-level BOM
-            bom = BOM.objects.create(
+            bom = add(BOM,
                 bom_no=f"BOM_C{i+1}_{assembly.item_no}",  # Ensure uniqueness
                 parent=assembly,
                 depth=0,
@@ -278,7 +414,7 @@ class Command(BaseCommand):
             
             for comp in part_comps:
                 qty = random.randint(1, 10)
-                BOMLine.objects.create(
+                add(BOMLine,
                     bom=bom,
                     component=comp,
                     quantity=qty
@@ -286,15 +422,11 @@ class Command(BaseCommand):
             
             # Add 2-5 level-1 sub-assemblies (must have at least 2)
             n_subs = random.randint(2, 5)
-            available_subs = [a for a in available_assemblies if a.item_no not in used_assemblies]
+            level1_subs = available_assemblies.sample(n_subs)
             
-            if len(available_subs) < n_subs:
-                # Create more assemblies if needed
-                needed = n_subs - len(available_subs)
-                for _ in range(needed):
-                    available_subs.append(create_new_assembly())
-            
-            level1_subs = random.sample(available_subs, k=n_subs)
+            # Create more assemblies if needed
+            while len(level1_subs) < n_subs:
+                level1_subs.append(create_new_assembly())
             
             # We need at least one level-1 sub to have its own sub-assembly
             has_level2 = False
@@ -305,7 +437,7 @@ class Command(BaseCommand):
                     available_assemblies.remove(comp)
                 
                 qty = random.randint(1, 5)
-                BOMLine.objects.create(
+                add(BOMLine,
                     bom=bom,
                     component=comp,
                     quantity=qty
@@ -313,7 +445,7 @@ class Command(BaseCommand):
                 
                 # Create level-1 sub-assembly BOM if it doesn't already have one
                 if comp.item_no not in items_with_boms:
-                    sub_bom = BOM.objects.create(
+                    sub_bom = add(BOM,
                         bom_no=f"BOM_C{i+1}_L1_{j+1}_{comp.item_no}",  # Ensure uniqueness
                         parent=comp,
                         depth=1,
@@ -327,7 +459,7 @@ class Command(BaseCommand):
                     
                     for sub_comp in sub_part_comps:
                         sub_qty = random.randint(1, 10)
-                        BOMLine.objects.create(
+                        add(BOMLine,
                             bom=sub_bom,
                             component=sub_comp,
                             quantity=sub_qty
@@ -339,20 +471,18 @@ class Command(BaseCommand):
                     
                     if should_have_level2:
                         has_level2 = True
-                        available_level2_subs = [a for a in available_assemblies if a.item_no not in used_assemblies]
-                        
-                        if not available_level2_subs:
+                        if not available_assemblies:
                             # Create a new assembly if needed
                             level2_sub = create_new_assembly()
                         else:
-                            level2_sub = random.choice(available_level2_subs)
+                            level2_sub = available_assemblies.choice()
                             
                         used_assemblies.add(level2_sub.item_no)
                         if level2_sub in available_assemblies:
                             available_assemblies.remove(level2_sub)
                         
                         # Add level-2 sub to level-1 sub
-                        BOMLine.objects.create(
+                        add(BOMLine,
                             bom=sub_bom,
                             component=level2_sub,
                             quantity=random.randint(1, 3)
@@ -360,7 +490,7 @@ class Command(BaseCommand):
                         
                         # Create level-2 sub-assembly BOM if it doesn't already have one
                         if level2_sub.item_no not in items_with_boms:
-                            level2_bom = BOM.objects.create(
+                            level2_bom = add(BOM,
                                 bom_no=f"BOM_C{i+1}_L2_{j+1}_{level2_sub.item_no}",  # Ensure uniqueness
                                 parent=level2_sub,
                                 depth=2,
@@ -374,7 +504,7 @@ class Command(BaseCommand):
                             
                             for level2_comp in level2_part_comps:
                                 level2_qty = random.randint(1, 5)
-                                BOMLine.objects.create(
+                                add(BOMLine,
                                     bom=level2_bom,
                                     component=level2_comp,
                                     quantity=level2_qty
@@ -387,7 +517,7 @@ class Command(BaseCommand):
         
         for i, part in enumerate(manufacturing_parts):
             # Create a manufacturing BOM for the part with a unique bom_no
-            bom = BOM.objects.create(
+            bom = add(BOM,
                 bom_no=f"MFG_P{i+1}_{part.item_no}",  # Ensure uniqueness
                 parent=part,
                 depth=0,  # Manufacturing BOMs are always at depth 0
@@ -399,7 +529,8 @@ class Command(BaseCommand):
         welding_wc = next((wc for wc in wcs if wc.name == "Welding"), None)
         qc_wc = next((wc for wc in wcs if wc.name == "QC"), None)
 
-        for bom in BOM.objects.select_related('parent'):
+        line_counts = Counter(line.bom_id for line in rows[BOMLine])
+        for bom in rows[BOM]:
             total_proc = 0.0
             steps_created = []
             
@@ -414,7 +545,7 @@ class Command(BaseCommand):
                 for idx in range(num_steps):
                     wc = random.choice(available_wcs)
                     time_min = random.randint(3, 15)
-                    step = RoutingStep.objects.create(
+                    step = add(RoutingStep,
                         routing_no=f"RT_{bom.bom_no}",
                         bom=bom,
                         wc=wc,
@@ -426,7 +557,7 @@ class Command(BaseCommand):
                     
             else:  # Assembly
                 # Check if this assembly has components (in-house manufactured)
-                has_components = bom.lines.exists()
+                has_components = line_counts[bom.id] > 0
                 
                 if has_components:
                     # For assemblies, we need either Assembly or Welding (or both)
@@ -447,7 +578,7 @@ class Command(BaseCommand):
                     for idx in range(other_ops):
                         wc = random.choice(other_wcs)
                         time_min = random.randint(5, 15)
-                        step = RoutingStep.objects.create(
+                        step = add(RoutingStep,
                             routing_no=f"RT_{bom.bom_no}",
                             bom=bom,
                             wc=wc,
@@ -459,10 +590,10 @@ class Command(BaseCommand):
                     
                     # Add Welding if needed
                     if uses_welding and welding_wc:
-                        component_count = bom.lines.count()
+                        component_count = line_counts[bom.id]
                         welding_time = 5 + min(30, component_count * 1.5)  # Base 5 min + 1.5 min per component
                         
-                        step = RoutingStep.objects.create(
+                        step = add(RoutingStep,
                             routing_no=f"RT_{bom.bom_no}",
                             bom=bom,
                             wc=welding_wc,
@@ -474,10 +605,10 @@ class Command(BaseCommand):
                     
                     # Add Assembly if needed
                     if uses_assembly and assembly_wc:
-                        component_count = bom.lines.count()
+                        component_count = line_counts[bom.id]
                         assembly_time = 5 + min(40, component_count * 2)  # Base 5 min + 2 min per component
                         
-                        step = RoutingStep.objects.create(
+                        step = add(RoutingStep,
                             routing_no=f"RT_{bom.bom_no}",
                             bom=bom,
                             wc=assembly_wc,
@@ -490,7 +621,7 @@ class Command(BaseCommand):
                     # Add QC as final step for most assemblies
                     if qc_wc and random.random() < 0.7:
                         qc_time = 5 + min(15, component_count)  # Base 5 min + 1 min per component
-                        step = RoutingStep.objects.create(
+                        step = add(RoutingStep,
                             routing_no=f"RT_{bom.bom_no}",
                             bom=bom,
                             wc=qc_wc,
@@ -503,7 +634,7 @@ class Command(BaseCommand):
                     # Purchased assembly - just add QC
                     if qc_wc:
                         time_min = random.randint(3, 10)
-                        step = RoutingStep.objects.create(
+                        step = add(RoutingStep,
                             routing_no=f"RT_{bom.bom_no}",
                             bom=bom,
                             wc=qc_wc,
@@ -516,46 +647,16 @@ class Command(BaseCommand):
             # Store the routing/process cost on the parent item
             item = bom.parent
             item.process_cost = getattr(item, 'process_cost', 0.0) + total_proc
-            item.save(update_fields=['process_cost'])
-
 
-        # 8) Bottom‑up total cost roll‑up
-        with transaction.atomic():
-            # First, set total_cost = base_cost + process_cost for all parts
-            Item.objects.filter(item_type='P').update(
-                total_cost=models.F('base_cost') + models.F('process_cost')
-            )
-            
-            # Then do the assembly roll-up by depth
-            max_bom_depth = BOM.objects.aggregate(m=models.Max('depth'))['m'] or 0
-            for d in range(max_bom_depth, -1, -1):
-                # Get all BOMs at this depth
-                boms_at_d_ids = list(BOM.objects.filter(depth=d).values_list('id', flat=True))
-                
-                # Process in batches to avoid SQLite's "too many SQL variables" error
-                batch_size = 100  # Adjust this based on your needs
-                for i in range(0, len(boms_at_d_ids), batch_size):
-                    batch_ids = boms_at_d_ids[i:i+batch_size]
-                    
-                    # Process this batch
-                    boms_batch = BOM.objects.filter(id__in=batch_ids).select_related('parent')
-                    
-                    for bom in boms_batch:
-                        parent = bom.parent
-                        # Skip if this is a manufacturing BOM for a part (already handled above)
-                        if bom.complexity == "part":
-                            continue
-                        
-                        # Get all lines for this BOM
-                        lines = BOMLine.objects.filter(bom=bom).select_related('component')
-                        
-                        comp_cost = 0.0
-                        for line in lines:
-                            comp = line.component
-                            comp_cost += comp.total_cost * line.quantity
-                        
-                        # total_cost = base_cost + process_cost + component costs
-                        parent.total_cost = parent.base_cost + parent.process_cost + comp_cost
-                        parent.save(update_fields=['total_cost'])
+        # 8) Bottom‑up total cost roll‑up, before anything is written
+        costs = {item.id: (item.base_cost, item.process_cost) for item in rows[Item]}
+        boms = {bom.id: bom.parent_id for bom in rows[BOM]}
+        lines = defaultdict(list)
+        for line in rows[BOMLine]:
+            lines[boms[line.bom_id]].append((line.component_id, line.quantity))
+        totals = compute_total_costs(costs, lines)
+        for item in rows[Item]:
+            item.total_cost = totals[item.id]
 
-        self.stdout.write(self.style.SUCCESS(f"Data generation complete with {items_per_type} items of each complexity type."))
\ No newline at end of file
+        self.stdout.write(self.style.SUCCESS(f"Data generation complete with {items_per_type} items of each complexity type."))
+        return rows
\ No newline at end of file
@@ -0,0 +1,14 @@
+# bom_app/management/commands/rebuild_top_level_index.py
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from bom_app.utils.top_level_index import rebuild_top_level_index
+
+
+class Command(BaseCommand):
+    help = "Recompute Item.is_top_level for every item"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            count = rebuild_top_level_index()
+        self.stdout.write(self.style.SUCCESS(f"Top-level index rebuilt: {count} top-level assemblies."))
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.20 on 2025-05-12 09:41
+
+from django.db import migrations, models
+from django.db.models import Case, When, Value, Exists, OuterRef, Q
+
+
+def populate_is_top_level(apps, schema_editor):
+    Item = apps.get_model('bom_app', 'Item')
+    BOM = apps.get_model('bom_app', 'BOM')
+    BOMLine = apps.get_model('bom_app', 'BOMLine')
+    has_bom = Exists(BOM.objects.filter(parent=OuterRef('pk')))
+    is_component = Exists(BOMLine.objects.filter(component=OuterRef('pk')))
+    Item.objects.update(is_top_level=Case(
+        When(Q(item_type='A') & has_bom & ~is_component, then=Value(True)),
+        default=Value(False),
+    ))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom_app', '0002_item_process_cost'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='item',
+            name='is_top_level',
+            field=models.BooleanField(db_index=True, default=False),
+        ),
+        migrations.RunPython(populate_is_top_level, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,74 @@
+# Generated by Django 4.2.20 on 2026-10-17 04:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def check_one_bom_per_parent(apps, schema_editor):
+    BOM = apps.get_model('bom_app', 'BOM')
+    duplicates = list(
+        BOM.objects.values('parent__item_no').annotate(n=Count('id')).filter(n__gt=1)
+        .values_list('parent__item_no', flat=True)[:20]
+    )
+    if duplicates:
+        raise RuntimeError(
+            "Items with more than one BOM must be cleaned up before adding the "
+            f"bom_one_per_parent constraint: {', '.join(duplicates)}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom_app', '0003_item_is_top_level'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_one_bom_per_parent, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='bom',
+            index=models.Index(fields=['complexity', 'parent'], name='bom_complexity_parent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bomline',
+            index=models.Index(fields=['bom', 'id', 'component', 'quantity'], name='bomline_explode_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='bomline',
+            index=models.Index(fields=['component', 'bom', 'quantity'], name='bomline_where_used_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='item',
+            index=models.Index(fields=['item_type', 'item_no'], name='item_type_item_no_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routingstep',
+            index=models.Index(fields=['bom', 'step_no', 'wc', 'run_time_min'], name='routingstep_bom_step_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='bom',
+            constraint=models.UniqueConstraint(fields=('parent',), name='bom_one_per_parent'),
+        ),
+        # The plain foreign key indexes are covered by the indexes above
+        migrations.AlterField(
+            model_name='bom',
+            name='parent',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='booms', to='bom_app.item'),
+        ),
+        migrations.AlterField(
+            model_name='bomline',
+            name='bom',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='bom_app.bom'),
+        ),
+        migrations.AlterField(
+            model_name='bomline',
+            name='component',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='bom_app.item'),
+        ),
+        migrations.AlterField(
+            model_name='routingstep',
+            name='bom',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='routing', to='bom_app.bom'),
+        ),
+    ]
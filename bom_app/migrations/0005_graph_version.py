@@ -0,0 +1,27 @@
+# Generated by Django 4.2.20 on 2026-10-17 04:39
+
+import uuid
+from django.db import migrations, models
+
+
+def create_version_row(apps, schema_editor):
+    GraphVersion = apps.get_model('bom_app', 'GraphVersion')
+    GraphVersion.objects.create(pk=1, token=uuid.uuid4().hex)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bom_app', '0004_composite_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GraphVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=32)),
+            ],
+        ),
+        migrations.RunPython(create_version_row, migrations.RunPython.noop),
+    ]
@@ -10,6 +10,15 @@ class Item(models.Model):
     base_cost    = models.FloatField()
     process_cost = models.FloatField(default=0.0)   # <-- new
     total_cost   = models.FloatField()
+    # Assembly that has a BOM but is not a component of any other BOM.
+    # Maintained by bom_app.signals, rebuilt by `manage.py rebuild_top_level_index`
+    is_top_level = models.BooleanField(default=False, db_index=True)
+
+    class Meta:
+        indexes = [
+            # Parts / assemblies listed by item_no
+            models.Index(fields=['item_type', 'item_no'], name='item_type_item_no_idx'),
+        ]
 
     def __str__(self):
         return self.item_no
@@ -32,16 +41,25 @@ class Item(models.Model):
         return cost
     
     def update_total_cost(self):
-        """Update the total_cost field based on current calculations"""
-        self.total_cost = self.calculate_total_cost()
-        self.save(update_fields=['total_cost'])
+        """Update the total_cost field of this item and every assembly that uses it"""
+        from .utils.cost_rollup import rollup_costs
+        self.total_cost = rollup_costs([self.pk])[self.pk]
 
 class BOM(models.Model):
     bom_no   = models.CharField(max_length=15, unique=True)
-    parent   = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='booms')
+    # Indexed by the one-BOM-per-parent constraint
+    parent   = models.ForeignKey(Item, on_delete=models.CASCADE, related_name='booms', db_index=False)
     depth     = models.IntegerField()
     complexity= models.CharField(max_length=10)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['parent'], name='bom_one_per_parent'),
+        ]
+        indexes = [
+            models.Index(fields=['complexity', 'parent'], name='bom_complexity_parent_idx'),
+        ]
+
     def json_representation(self):
         """Return a JSON representation of the BOM"""
         return {
@@ -56,10 +74,19 @@ class BOM(models.Model):
         }
 
 class BOMLine(models.Model):
-    bom        = models.ForeignKey(BOM, on_delete=models.CASCADE, related_name='lines')
-    component  = models.ForeignKey(Item, on_delete=models.CASCADE)
+    # Both foreign keys are indexed by the composite indexes below
+    bom        = models.ForeignKey(BOM, on_delete=models.CASCADE, related_name='lines', db_index=False)
+    component  = models.ForeignKey(Item, on_delete=models.CASCADE, db_index=False)
     quantity   = models.IntegerField()
 
+    class Meta:
+        indexes = [
+            # Explosion: lines of a BOM in id order, with everything the BOM graph reads
+            models.Index(fields=['bom', 'id', 'component', 'quantity'], name='bomline_explode_idx'),
+            # Where-used: the BOMs using a component
+            models.Index(fields=['component', 'bom', 'quantity'], name='bomline_where_used_idx'),
+        ]
+
 class WorkCenter(models.Model):
     wc_no         = models.CharField(max_length=5, unique=True)
     name          = models.CharField(max_length=50)
@@ -67,7 +94,21 @@ class WorkCenter(models.Model):
 
 class RoutingStep(models.Model):
     routing_no     = models.CharField(max_length=20)
-    bom            = models.ForeignKey(BOM, on_delete=models.CASCADE, related_name='routing')
+    bom            = models.ForeignKey(BOM, on_delete=models.CASCADE, related_name='routing', db_index=False)
     wc             = models.ForeignKey(WorkCenter, on_delete=models.CASCADE)
     step_no        = models.IntegerField()
-    run_time_min   = models.IntegerField()
\ No newline at end of file
+    run_time_min   = models.IntegerField()
+
+    class Meta:
+        indexes = [
+            # Routing of a BOM in step order, with everything the BOM graph reads
+            models.Index(fields=['bom', 'step_no', 'wc', 'run_time_min'], name='routingstep_bom_step_idx'),
+        ]
+
+class GraphVersion(models.Model):
+    """
+    Single row holding a token that is replaced in the same transaction as
+    every change to items, BOMs, BOM lines, routing steps or work centers.
+    Graph snapshots (bom_app/utils/graph_snapshot.py) are tagged with it.
+    """
+    token = models.CharField(max_length=32)
@@ -21,4 +21,13 @@ class WorkCenterRoutingSerializer(serializers.Serializer):
     item_type = serializers.CharField()
     level = serializers.IntegerField()
     work_centers = serializers.DictField()
-    total_time = serializers.IntegerField()
\ No newline at end of file
+    total_time = serializers.IntegerField()
+
+
+class CostBreakdownRequestSerializer(serializers.Serializer):
+    item_nos = serializers.ListField(child=serializers.CharField(max_length=10), allow_empty=False, max_length=500)
+
+
+class BOMBatchRequestSerializer(serializers.Serializer):
+    item_nos = serializers.ListField(child=serializers.CharField(max_length=10), allow_empty=False, max_length=500)
+    format = serializers.ChoiceField(choices=['nested', 'normalized'], default='nested')
@@ -0,0 +1,178 @@
+# bom_app/signals.py
+import threading
+from contextlib import contextmanager
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Item, BOM, BOMLine, WorkCenter, RoutingStep
+from .utils.top_level_index import refresh_top_level
+from .utils.cost_rollup import rollup_costs, recalculate_process_costs, items_using_work_center
+from .utils.explosion_cache import invalidate_items, invalidate_all
+
+_state = threading.local()
+
+
+@contextmanager
+def maintenance_suspended():
+    """
+    Skip the incremental index and cost maintenance below, e.g. while
+    generate_data writes a whole dataset. Callers must rebuild afterwards.
+    """
+    depth = getattr(_state, 'suspended', 0)
+    _state.suspended = depth + 1
+    try:
+        yield
+    finally:
+        _state.suspended = depth
+
+
+def maintenance_active():
+    return not getattr(_state, 'suspended', 0)
+
+
+def _bom_parent_id(bom_id):
+    # The BOM may already be gone when lines are removed by a cascade
+    return BOM.objects.filter(id=bom_id).values_list('parent_id', flat=True).first()
+
+
+def _bom_parent_ids(instance, signal):
+    """
+    Parent of the BOM a line or routing step is on and, after a save that
+    moved it to another BOM, parent of the BOM it was on
+    """
+    bom_ids = {instance.bom_id}
+    previous = getattr(instance, '_previous_values', None)
+    if signal is post_save and previous is not None:
+        bom_ids.add(previous['bom_id'])
+    return [_bom_parent_id(bom_id) for bom_id in bom_ids]
+
+
+def _remember_previous(instance, fields):
+    instance._previous_values = None
+    if instance.pk and maintenance_active():
+        instance._previous_values = type(instance).objects.filter(pk=instance.pk).values(*fields).first()
+
+
+def _changed(instance, fields):
+    previous = getattr(instance, '_previous_values', None)
+    if previous is None:
+        return False
+    return any(previous[field] != getattr(instance, field) for field in fields)
+
+
+# --- Top-level index -------------------------------------------------------------
+
+# A line or step may be moved to another component or BOM; the receivers below
+# also update whatever it was attached to before
+BOM_LINE_FIELDS = ('component_id', 'bom_id')
+ROUTING_STEP_FIELDS = ('bom_id',)
+
+
+@receiver(pre_save, sender=BOMLine)
+def bom_line_before_save(sender, instance, **kwargs):
+    _remember_previous(instance, BOM_LINE_FIELDS)
+
+
+@receiver(pre_save, sender=RoutingStep)
+def routing_step_before_save(sender, instance, **kwargs):
+    _remember_previous(instance, ROUTING_STEP_FIELDS)
+
+
+@receiver([post_save, post_delete], sender=BOMLine)
+def bom_line_changed(sender, instance, signal, **kwargs):
+    # Being (or no longer being) a component decides whether an item is top-level;
+    # a line moved to another component may have left the old one unused
+    if maintenance_active():
+        item_ids = [instance.component_id]
+        previous = getattr(instance, '_previous_values', None)
+        if signal is post_save and previous is not None:
+            item_ids.append(previous['component_id'])
+        refresh_top_level(item_ids)
+
+
+@receiver([post_save, post_delete], sender=BOM)
+def bom_changed(sender, instance, **kwargs):
+    # Having a BOM is a precondition of being top-level
+    if maintenance_active():
+        refresh_top_level([instance.parent_id])
+
+
+# --- Cost roll-up ------------------------------------------------------------------
+
+ITEM_COST_FIELDS = ('base_cost', 'process_cost')
+WORK_CENTER_COST_FIELDS = ('cost_per_min',)
+
+
+@receiver(pre_save, sender=Item)
+def item_before_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or set(update_fields) & set(ITEM_COST_FIELDS):
+        _remember_previous(instance, ITEM_COST_FIELDS)
+
+
+@receiver(post_save, sender=Item)
+def item_cost_changed(sender, instance, **kwargs):
+    if maintenance_active() and _changed(instance, ITEM_COST_FIELDS):
+        rollup_costs([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=BOMLine)
+def bom_line_cost_changed(sender, instance, signal, **kwargs):
+    if maintenance_active():
+        rollup_costs(_bom_parent_ids(instance, signal))
+
+
+@receiver(pre_save, sender=WorkCenter)
+def work_center_before_save(sender, instance, **kwargs):
+    _remember_previous(instance, WORK_CENTER_COST_FIELDS)
+
+
+@receiver(post_save, sender=WorkCenter)
+def work_center_cost_changed(sender, instance, **kwargs):
+    if maintenance_active() and _changed(instance, WORK_CENTER_COST_FIELDS):
+        item_ids = items_using_work_center(instance.pk)
+        recalculate_process_costs(item_ids)
+        rollup_costs(item_ids)
+
+
+@receiver([post_save, post_delete], sender=RoutingStep)
+def routing_step_changed(sender, instance, signal, **kwargs):
+    if maintenance_active():
+        parent_ids = _bom_parent_ids(instance, signal)
+        recalculate_process_costs(parent_ids)
+        rollup_costs(parent_ids)
+
+
+# --- Explosion cache ---------------------------------------------------------------
+# Runs after the roll-up receivers above, so the new versions are handed out
+# once the totals of every affected assembly are updated.
+
+@receiver(post_save, sender=Item)
+def item_saved(sender, instance, **kwargs):
+    if maintenance_active():
+        invalidate_items([instance.pk])
+
+
+@receiver(post_delete, sender=Item)
+def item_deleted(sender, instance, **kwargs):
+    # Assemblies using the item lose their BOM lines first, which invalidates them
+    if maintenance_active():
+        invalidate_items([], item_nos=[instance.item_no])
+
+
+@receiver([post_save, post_delete], sender=BOM)
+def bom_explosion_changed(sender, instance, **kwargs):
+    if maintenance_active():
+        invalidate_items([instance.parent_id])
+
+
+@receiver([post_save, post_delete], sender=BOMLine)
+@receiver([post_save, post_delete], sender=RoutingStep)
+def bom_row_explosion_changed(sender, instance, signal, **kwargs):
+    if maintenance_active():
+        invalidate_items(_bom_parent_ids(instance, signal))
+
+
+@receiver([post_save, post_delete], sender=WorkCenter)
+def work_center_explosion_changed(sender, instance, **kwargs):
+    # Work centers appear in the routing data of every item
+    if maintenance_active():
+        invalidate_all()
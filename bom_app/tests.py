@@ -1,3 +1,804 @@
-from django.test import TestCase
+import json
+import os
+import tempfile
+from io import StringIO
 
-# Create your tests here.
+import numpy as np
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from django.test import TestCase, override_settings
+
+from .models import Item, BOM, BOMLine, WorkCenter, RoutingStep, GraphVersion
+from .views import build_tree, collect_routing_data, collect_routing_data_alternative, retrieve_top_level_item
+from .utils.top_level_index import top_level_items
+from .utils.cost_rollup import rollup_costs, rollup_all_costs
+from .utils.where_used import where_used
+from .utils.bom_graph import BOMGraph, assemble_tree, expanded_sizes, walk
+from .utils.explosion_cache import item_version
+from .utils.graph_snapshot import GraphSnapshot, graph_snapshot, load_graph
+from .utils.benchmark import run_benchmarks
+from .utils.query_plans import traversal_plans
+from bom_project.middleware import METRICS
+
+
+def make_item(item_no, item_type='P', base_cost=1.0, total_cost=None):
+    return Item.objects.create(
+        item_no=item_no,
+        description=f"Item {item_no}",
+        item_type=item_type,
+        base_cost=base_cost,
+        total_cost=base_cost if total_cost is None else total_cost,
+    )
+
+
+def make_bom(parent, lines, complexity='simple', depth=0):
+    bom = BOM.objects.create(
+        bom_no=f"BOM_{parent.item_no}",
+        parent=parent,
+        depth=depth,
+        complexity=complexity,
+    )
+    for component, quantity in lines:
+        BOMLine.objects.create(bom=bom, component=component, quantity=quantity)
+    return bom
+
+
+def make_chain(prefix, depth, uses=1):
+    """
+    Create a chain of assemblies `depth` levels deep ending in one part,
+    each using the one below it on `uses` BOM lines (so the expanded tree
+    has uses ** depth leaves). Returns the top-level assembly.
+    """
+    child = make_item(f"{prefix}P")
+    make_bom(child, [], complexity='part')
+    for level in range(depth, 0, -1):
+        parent = make_item(f"{prefix}{level}", item_type='A')
+        make_bom(parent, [(child, 2)] * uses, complexity='complex', depth=level - 1)
+        child = parent
+    return child
+
+
+class BuildTreeTests(TestCase):
+
+    def setUp(self):
+        self.p1 = make_item('P1', base_cost=1.5)
+        self.p2 = make_item('P2', base_cost=2.5)
+        make_bom(self.p1, [], complexity='part')
+        self.sub = make_item('A2', item_type='A', base_cost=3.0)
+        make_bom(self.sub, [(self.p2, 2)], complexity='moderate', depth=1)
+        self.top = make_item('A1', item_type='A', base_cost=4.0)
+        make_bom(self.top, [(self.p1, 3), (self.sub, 2)], complexity='moderate')
+
+    def test_tree_matches_nested_structure(self):
+        self.assertEqual(build_tree('A1'), {
+            'item_no': 'A1',
+            'description': 'Item A1',
+            'cost': 24.5,
+            'level': 0,
+            'children': [
+                {'item_no': 'P1', 'description': 'Item P1', 'cost': 1.5, 'level': 1, 'children': []},
+                {
+                    'item_no': 'A2',
+                    'description': 'Item A2',
+                    'cost': 8.0,
+                    'level': 1,
+                    'children': [
+                        {'item_no': 'P2', 'description': 'Item P2', 'cost': 2.5, 'level': 2, 'children': []},
+                    ],
+                },
+            ],
+        })
+
+    def test_limit_caps_nodes_in_depth_first_order(self):
+        tree = build_tree('A1', limit=3)
+        self.assertEqual([child['item_no'] for child in tree['children']], ['P1', 'A2'])
+        self.assertEqual(tree['children'][1]['children'], [])
+
+    def stream(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_json_stream_matches_build_tree(self):
+        response, body = self.stream('/api/bom/item/A1/stream/')
+        self.assertEqual(json.loads(body), build_tree('A1'))
+        self.assertEqual(response['X-Total-Nodes'], '4')
+        self.assertFalse(response.has_header('X-Next-Offset'))
+        _, body = self.stream('/api/bom/item/A1/stream/?limit=3')
+        self.assertEqual(json.loads(body), build_tree('A1', limit=3))
+
+    def test_ndjson_pages_cover_the_tree(self):
+        rows = []
+        url = '/api/bom/item/A1/stream/?format=ndjson&limit=3'
+        while url:
+            response, body = self.stream(url)
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            rows += [json.loads(line) for line in body.splitlines()]
+            next_offset = response.get('X-Next-Offset')
+            url = next_offset and f'/api/bom/item/A1/stream/?format=ndjson&limit=3&offset={next_offset}'
+        self.assertEqual([(row['node'], row['parent'], row['item_no'], row['quantity']) for row in rows],
+                         [(0, None, 'A1', 1), (1, 0, 'P1', 3), (2, 0, 'A2', 2), (3, 2, 'P2', 2)])
+
+    def test_stream_rejects_bad_parameters(self):
+        for query in ('format=xml', 'limit=x', 'offset=-1&format=ndjson', 'offset=2'):
+            self.assertEqual(self.client.get(f'/api/bom/item/A1/stream/?{query}').status_code, 400)
+        self.assertEqual(self.client.get('/api/bom/item/NOPE/stream/').status_code, 404)
+
+    def test_missing_item_raises(self):
+        with self.assertRaises(Item.DoesNotExist):
+            build_tree('NOPE')
+
+    def test_query_count_is_independent_of_depth(self):
+        shallow = make_chain('S', 2)
+        deep = make_chain('D', 10)
+        # The GraphVersion token checked by the explosion cache, then the graph
+        with self.assertNumQueries(3):
+            build_tree(shallow.item_no)
+        with self.assertNumQueries(3):
+            tree = build_tree(deep.item_no)
+        for _ in range(10):
+            tree = tree['children'][0]
+        self.assertEqual(tree['item_no'], 'DP')
+
+    def test_shared_sub_assemblies_are_built_once(self):
+        # 2 ** 40 leaves when expanded
+        self.assertFalse(BOMGraph.load(['A1']).repeats_sub_assemblies())
+        top = make_chain('X', 40, uses=2)
+        self.assertTrue(BOMGraph.load([top.item_no]).repeats_sub_assemblies())
+        with self.assertNumQueries(3):
+            tree = build_tree(top.item_no)
+        for level in range(1, 40):
+            first, second = tree['children']
+            self.assertIs(first, second)
+            self.assertEqual((first['level'], first['item_no']), (level, f"X{level + 1}"))
+            tree = first
+        self.assertEqual([leaf['item_no'] for leaf in tree['children']], ['XP', 'XP'])
+
+    def test_cyclic_bom_raises(self):
+        # bulk_create skips the roll-up signal, which would reject the cycle itself
+        BOMLine.objects.bulk_create([BOMLine(bom=self.sub.booms.get(), component=self.top, quantity=1)])
+        graph = BOMGraph.load(['A1'])
+        a1 = graph.ids['A1']
+        with self.assertRaises(ValueError):
+            expanded_sizes(graph, a1)
+        with self.assertRaises(ValueError):
+            list(walk(graph, a1))
+        with self.assertRaises(ValueError):
+            assemble_tree(graph, a1)
+
+    def test_batch_shares_one_load(self):
+        shared_user = make_item('A3', item_type='A')
+        make_bom(shared_user, [(self.sub, 1)])
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/bom/batch/', {'item_nos': ['A1', 'A3', 'NOPE']},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['missing'], ['NOPE'])
+        self.assertEqual(data['trees'], {'A1': build_tree('A1'), 'A3': build_tree('A3')})
+
+        response = self.client.post('/api/bom/batch/', {'item_nos': ['A1', 'A3', 'NOPE'], 'format': 'normalized'},
+                                    content_type='application/json')
+        data = response.json()
+        self.assertEqual(data['roots'], ['A1', 'A3'])
+        self.assertEqual(data['missing'], ['NOPE'])
+        self.assertEqual([node['item_no'] for node in data['nodes']], ['A1', 'P1', 'A2', 'P2', 'A3'])
+        self.assertEqual(
+            [(edge['parent'], edge['component'], edge['quantity']) for edge in data['edges']],
+            [('A1', 'P1', 3), ('A1', 'A2', 2), ('A2', 'P2', 2), ('A3', 'A2', 1)],
+        )
+
+        response = self.client.post('/api/bom/batch/', {'item_nos': [], 'format': 'flat'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(set(response.json()), {'item_nos', 'format'})
+
+    def test_load_binds_long_root_lists_as_one_parameter(self):
+        # More roots than SQLite allows host parameters in one statement
+        item_nos = [f"MISSING{n}" for n in range(40000)] + ['A1']
+        with self.assertNumQueries(2):
+            graph = BOMGraph.load(item_nos)
+        self.assertEqual(set(graph.ids), {'A1', 'A2', 'P1', 'P2'})
+
+
+class CollectRoutingDataTests(TestCase):
+
+    def setUp(self):
+        self.cut = WorkCenter.objects.create(wc_no='WC01', name='Cutting', cost_per_min=0.15)
+        self.asm = WorkCenter.objects.create(wc_no='WC02', name='Assembly', cost_per_min=0.4)
+        self.p1 = make_item('P1')
+        self.p2 = make_item('P2')
+        p1_bom = make_bom(self.p1, [], complexity='part')
+        self.top = make_item('A1', item_type='A')
+        top_bom = make_bom(self.top, [(self.p1, 3), (self.p2, 1)])
+        RoutingStep.objects.create(routing_no='RT_P1', bom=p1_bom, wc=self.cut, step_no=1, run_time_min=4)
+        RoutingStep.objects.create(routing_no='RT_A1', bom=top_bom, wc=self.cut, step_no=1, run_time_min=5)
+        RoutingStep.objects.create(routing_no='RT_A1', bom=top_bom, wc=self.asm, step_no=2, run_time_min=7)
+
+    def test_routing_data(self):
+        data = collect_routing_data('A1')
+        self.assertEqual(data['work_centers'], {'WC01': 5, 'WC02': 7})
+        self.assertEqual(data['total_time'], 12)
+        p1, p2 = data['children']
+        self.assertEqual((p1['item_no'], p1['level'], p1['work_centers'], p1['total_time']),
+                         ('P1', 1, {'WC01': 4, 'WC02': 0}, 4))
+        # P2 has no BOM, so it has no work center columns at all
+        self.assertEqual((p2['work_centers'], p2['total_time'], p2['children']), ({}, 0, []))
+
+    def test_alternative_wraps_children_with_quantity(self):
+        data = collect_routing_data_alternative('A1')
+        self.assertEqual([(c['quantity'], c['component']['item_no']) for c in data['children']],
+                         [(3, 'P1'), (1, 'P2')])
+        self.assertEqual(data['children'][0]['component'], collect_routing_data('A1')['children'][0])
+
+    def test_query_count_is_independent_of_depth(self):
+        deep = make_chain('D', 8)
+        with self.assertNumQueries(5):
+            collect_routing_data(deep.item_no)
+
+    def test_shared_sub_assemblies_are_built_once(self):
+        top = make_chain('X', 40, uses=2)
+        data = collect_routing_data(top.item_no)
+        wrapped = collect_routing_data_alternative(top.item_no)
+        for level in range(1, 40):
+            first, second = data['children']
+            self.assertIs(first, second)
+            self.assertEqual(first['extended_quantity'], 2 ** level)
+            self.assertIs(wrapped['children'][0]['component'], wrapped['children'][1]['component'])
+            data, wrapped = first, wrapped['children'][0]['component']
+
+    def test_work_center_rollup_uses_extended_quantities(self):
+        data = collect_routing_data('A1')
+        # A1's own 5 + 7 minutes, plus 3 x P1's 4 minutes at WC01
+        self.assertEqual((data['cumulative_work_centers'], data['cumulative_time']), ({'WC01': 17, 'WC02': 7}, 24))
+        p1, p2 = data['children']
+        self.assertEqual((p1['extended_quantity'], p1['cumulative_work_centers'], p1['cumulative_time']),
+                         (3, {'WC01': 4}, 4))
+        self.assertEqual((p2['cumulative_work_centers'], p2['cumulative_time']), ({}, 0))
+
+        # A shared sub-assembly counts once per use
+        top = make_item('A5', item_type='A')
+        make_bom(top, [(self.top, 2), (self.p1, 1)])
+        self.assertEqual(collect_routing_data('A5')['cumulative_work_centers'], {'WC01': 38, 'WC02': 14})
+        data = self.client.get('/api/bom-routing/item/A5/indented/').json()
+        self.assertEqual(data['cumulative_work_centers'], {'WC01': 38, 'WC02': 14})
+        self.assertEqual([row['extended_time'] for row in data['rows']], [0, 24, 24, 0, 4])
+
+    def test_indented_rows(self):
+        data = self.client.get('/api/bom-routing/item/A1/indented/').json()
+        self.assertEqual((data['total_rows'], data['next_offset']), (3, None))
+        self.assertEqual([wc['wc_no'] for wc in data['work_centers']], ['WC01', 'WC02'])
+        top, p1, p2 = data['rows']
+        self.assertEqual((top['path'], top['work_centers'], top['total_time']), ('A1', {'WC01': 5, 'WC02': 7}, 12))
+        self.assertEqual((p1['path'], p1['level'], p1['extended_quantity'], p1['last_child'], p1['work_centers']),
+                         ('A1/P1', 1, 3, False, {'WC01': 4}))
+        self.assertEqual((p2['parent'], p2['last_child'], p2['extended_cost']), (0, True, p2['unit_cost']))
+
+    def test_indented_formats_and_pages(self):
+        url = '/api/bom-routing/item/A1/indented/'
+        page = self.client.get(url, {'format': 'columns', 'offset': 1, 'limit': 1}).json()
+        self.assertEqual((page['next_offset'], page['columns']['item_no'], page['columns']['WC01']), (2, ['P1'], [4]))
+        response = self.client.get(url, {'format': 'csv', 'offset': 1})
+        lines = b"".join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[-2:], ['WC01', 'WC02'])
+        self.assertEqual([line.split(',')[4] for line in lines[1:]], ['P1', 'P2'])
+        self.assertEqual(response['X-Total-Rows'], '3')
+        self.assertEqual(self.client.get(url, {'limit': 10 ** 6}).status_code, 400)
+        self.assertEqual(self.client.get('/api/bom-routing/item/NOPE/indented/', {'format': 'csv'}).status_code, 404)
+
+
+class TopLevelIndexTests(TestCase):
+
+    def setUp(self):
+        self.part = make_item('P1')
+        self.sub = make_item('A2', item_type='A')
+        make_bom(self.sub, [(self.part, 1)], complexity='moderate', depth=1)
+        self.top = make_item('A1', item_type='A')
+        self.top_bom = make_bom(self.top, [(self.sub, 2)], complexity='moderate')
+
+    def flags(self):
+        return dict(Item.objects.values_list('item_no', 'is_top_level'))
+
+    def test_signals_maintain_flag(self):
+        self.assertEqual(self.flags(), {'P1': False, 'A1': True, 'A2': False})
+        # Removing the only line that uses A2 promotes it to top-level
+        self.top_bom.lines.get(component=self.sub).delete()
+        self.assertTrue(Item.objects.get(item_no='A2').is_top_level)
+        # Using A1 inside another BOM demotes it
+        other = make_item('A3', item_type='A')
+        make_bom(other, [(self.top, 1)], complexity='complex')
+        self.assertEqual(self.flags(), {'P1': False, 'A1': False, 'A2': True, 'A3': True})
+
+    def test_moving_a_line_refreshes_both_components(self):
+        other = make_item('A4', item_type='A')
+        make_bom(other, [(self.part, 1)], complexity='moderate', depth=1)
+        line = self.top_bom.lines.get(component=self.sub)
+        line.component = other
+        line.save()
+        self.assertEqual(self.flags(), {'P1': False, 'A1': True, 'A2': True, 'A4': False})
+
+    def test_lookup_by_complexity(self):
+        self.assertEqual(list(top_level_items('moderate').values_list('item_no', flat=True)), ['A1'])
+        self.assertEqual(retrieve_top_level_item('moderate'), 'A1')
+        self.assertIsNone(retrieve_top_level_item('complex'))
+        with self.assertNumQueries(1):
+            retrieve_top_level_item('moderate')
+
+    def test_rebuild_command(self):
+        Item.objects.update(is_top_level=False)
+        call_command('rebuild_top_level_index', stdout=StringIO())
+        self.assertEqual(self.flags(), {'P1': False, 'A1': True, 'A2': False})
+
+
+class CostRollupTests(TestCase):
+
+    def setUp(self):
+        self.wc = WorkCenter.objects.create(wc_no='WC01', name='Assembly', cost_per_min=0.5)
+        self.fastener = make_item('P1', base_cost=1.0)
+        self.other = make_item('P2', base_cost=2.0)
+        self.sub = make_item('A2', item_type='A', base_cost=3.0)
+        sub_bom = make_bom(self.sub, [(self.fastener, 2)], complexity='moderate', depth=1)
+        self.top = make_item('A1', item_type='A', base_cost=4.0)
+        make_bom(self.top, [(self.sub, 3), (self.other, 1)], complexity='moderate')
+        self.unrelated = make_item('A3', item_type='A', base_cost=5.0)
+        make_bom(self.unrelated, [(self.other, 4)], complexity='simple')
+        RoutingStep.objects.create(routing_no='RT_A2', bom=sub_bom, wc=self.wc, step_no=1, run_time_min=10)
+
+    def totals(self):
+        return dict(Item.objects.values_list('item_no', 'total_cost'))
+
+    def test_rollup_all_costs(self):
+        rollup_all_costs()
+        # A2 = 3 + process 0.5 * 10 + 2 * 1
+        self.assertEqual(self.totals(), {'P1': 1.0, 'P2': 2.0, 'A2': 10.0, 'A1': 36.0, 'A3': 13.0})
+
+    def test_part_price_change_touches_only_ancestors(self):
+        rollup_all_costs()
+        Item.objects.filter(item_no='A3').update(total_cost=-1.0)
+        self.fastener.base_cost = 2.0
+        self.fastener.save()
+        totals = self.totals()
+        self.assertEqual((totals['P1'], totals['A2'], totals['A1']), (2.0, 12.0, 42.0))
+        # A3 does not use P1, so its (deliberately stale) total is left alone
+        self.assertEqual(totals['A3'], -1.0)
+
+    def test_rollup_query_count_is_bounded(self):
+        # Two reads plus one bulk update, however deep the where-used graph is
+        with self.assertNumQueries(3):
+            rollup_costs([self.fastener.pk])
+
+    def test_quantity_change_rolls_up(self):
+        rollup_all_costs()
+        line = BOMLine.objects.get(bom__parent=self.top, component=self.sub)
+        line.quantity = 1
+        line.save()
+        self.assertEqual(self.totals()['A1'], 16.0)
+
+    def test_moving_lines_and_steps_updates_both_assemblies(self):
+        rollup_all_costs()
+        line = BOMLine.objects.get(bom__parent=self.top, component=self.other)
+        line.bom = self.unrelated.booms.get()
+        line.save()
+        totals = self.totals()
+        self.assertEqual((totals['A1'], totals['A3']), (34.0, 15.0))
+
+        step = RoutingStep.objects.get()
+        step.bom = self.unrelated.booms.get()
+        step.save()
+        totals = self.totals()
+        # A2 loses its 5.0 of process cost, three times over in A1
+        self.assertEqual((totals['A2'], totals['A1'], totals['A3']), (5.0, 19.0, 20.0))
+
+    def test_work_center_rate_change_updates_process_cost(self):
+        rollup_all_costs()
+        self.wc.cost_per_min = 1.0
+        self.wc.save()
+        sub = Item.objects.get(item_no='A2')
+        self.assertEqual((sub.process_cost, sub.total_cost), (10.0, 15.0))
+        self.assertEqual(self.totals()['A1'], 51.0)
+
+    def test_update_total_cost_propagates(self):
+        Item.objects.filter(item_no__in=['A2', 'A1']).update(total_cost=0.0)
+        self.sub.refresh_from_db()
+        self.sub.update_total_cost()
+        self.assertEqual(self.sub.total_cost, 10.0)
+        self.assertEqual(self.totals()['A1'], 36.0)
+
+    def test_cost_breakdown(self):
+        rollup_all_costs()
+        breakdown = self.client.get('/api/cost-breakdown/A1/').json()
+        # 4 + 3 * (3 + 2 * 1) + 2 of material, 3 * 10 minutes at 0.5 of process
+        self.assertEqual((breakdown['material_cost'], breakdown['process_cost']), (21.0, 15.0))
+        self.assertEqual((breakdown['total_cost'], breakdown['stored_total_cost']), (36.0, 36.0))
+        self.assertEqual(breakdown['work_centers'], {'WC01': {'minutes': 30.0, 'cost': 15.0}})
+        self.assertEqual([(level['material_cost'], level['process_cost']) for level in breakdown['levels']],
+                         [(4.0, 0.0), (11.0, 15.0), (6.0, 0.0)])
+        self.assertEqual(self.client.get('/api/cost-breakdown/NOPE/').status_code, 404)
+
+    def test_cost_breakdown_batch_shares_one_load(self):
+        with self.assertNumQueries(4):
+            response = self.client.post('/api/cost-breakdown/', {'item_nos': ['A1', 'A3', 'A2', 'NOPE']},
+                                        content_type='application/json')
+        data = response.json()
+        self.assertEqual(data['missing'], ['NOPE'])
+        self.assertEqual({item_no: b['total_cost'] for item_no, b in data['breakdowns'].items()},
+                         {'A1': 36.0, 'A3': 13.0, 'A2': 10.0})
+        self.assertEqual(self.client.post('/api/cost-breakdown/', {'item_nos': []},
+                                          content_type='application/json').status_code, 400)
+
+
+class ExplosionCacheTests(TestCase):
+
+    def setUp(self):
+        self.wc = WorkCenter.objects.create(wc_no='WC01', name='Cutting', cost_per_min=0.5)
+        self.part = make_item('P1', base_cost=2.0)
+        self.sub = make_item('A2', item_type='A')
+        self.sub_bom = make_bom(self.sub, [(self.part, 2)], complexity='moderate', depth=1)
+        self.top = make_item('A1', item_type='A')
+        make_bom(self.top, [(self.sub, 2)], complexity='moderate')
+
+    def test_repeated_explosion_is_served_from_cache(self):
+        tree = build_tree('A1')
+        routing = collect_routing_data('A1')
+        # Only the GraphVersion token, once per lookup
+        with self.assertNumQueries(2):
+            self.assertEqual(build_tree('A1'), tree)
+            self.assertEqual(collect_routing_data('A1'), routing)
+
+    def test_bom_line_change_invalidates_ancestors(self):
+        build_tree('A1')
+        version = item_version('A1')
+        BOMLine.objects.create(bom=self.sub_bom, component=make_item('P2'), quantity=1)
+        self.assertNotEqual(item_version('A1'), version)
+        self.assertEqual([c['item_no'] for c in build_tree('A1')['children'][0]['children']], ['P1', 'P2'])
+
+    def test_moved_rows_invalidate_the_old_parent(self):
+        other = make_item('A3', item_type='A')
+        other_bom = make_bom(other, [])
+        step = RoutingStep.objects.create(routing_no='RT_A2', bom=self.sub_bom, wc=self.wc, step_no=1,
+                                          run_time_min=5)
+        self.assertEqual(collect_routing_data('A2')['work_centers'], {'WC01': 5})
+        self.assertEqual([c['item_no'] for c in build_tree('A2')['children']], ['P1'])
+        versions = item_version('A1'), item_version('A2')
+        step.bom = other_bom
+        step.save()
+        line = self.sub_bom.lines.get()
+        line.bom = other_bom
+        line.save()
+        self.assertNotEqual((item_version('A1'), item_version('A2')), versions)
+        self.assertEqual(collect_routing_data('A2')['total_time'], 0)
+        self.assertEqual(build_tree('A2')['children'], [])
+        self.assertEqual([c['item_no'] for c in build_tree('A3')['children']], ['P1'])
+
+    def test_cost_change_invalidates_ancestors(self):
+        self.assertEqual(build_tree('A1')['cost'], 11.0)
+        self.part.base_cost = 3.0
+        self.part.save()
+        self.assertEqual(build_tree('A1')['cost'], 15.0)
+
+    def test_changes_made_by_other_processes_are_seen(self):
+        build_tree('A1')
+        version = item_version('A1')
+        # Another process's signal handlers only reach its own cache and the
+        # GraphVersion token in the database
+        Item.objects.filter(pk=self.part.pk).update(description='Renamed')
+        GraphVersion.objects.update(token='changed-elsewhere')
+        self.assertNotEqual(item_version('A1'), version)
+        self.assertEqual(build_tree('A1')['children'][0]['children'][0]['description'], 'Renamed')
+
+    def test_unrelated_change_keeps_entries(self):
+        build_tree('A1')
+        version = item_version('A1')
+        make_bom(make_item('A3', item_type='A'), [(make_item('P3'), 1)])
+        self.assertEqual(item_version('A1'), version)
+
+    def test_work_center_change_invalidates_routing(self):
+        RoutingStep.objects.create(routing_no='RT_A1', bom=self.top.booms.get(), wc=self.wc,
+                                   step_no=1, run_time_min=5)
+        collect_routing_data('A1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.wc.wc_no = 'WC09'
+            self.wc.save()
+        self.assertEqual(collect_routing_data('A1')['work_centers'], {'WC09': 5})
+
+    def test_item_endpoints_support_conditional_get(self):
+        for url in ('/api/bom/item/A1/', '/api/bom-routing/item/A1/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response['ETag']
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+            self.part.base_cost = 5.0
+            self.part.save()
+            changed = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(changed.status_code, 200)
+            self.assertNotEqual(changed['ETag'], etag)
+        self.assertEqual(self.client.get('/api/bom/item/A1/').json(), build_tree('A1'))
+        self.assertEqual(self.client.get('/api/bom/item/X9/').status_code, 404)
+
+    def test_unknown_item_gets_no_etag(self):
+        for url in ('/api/bom/item/X9/', '/api/bom-routing/item/X9/', '/api/cost-breakdown/X9/'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 404)
+            self.assertFalse(response.has_header('ETag'))
+            self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH='*').status_code, 404)
+
+    def test_deleted_item_is_not_served(self):
+        build_tree('A1')
+        self.top.delete()
+        with self.assertRaises(Item.DoesNotExist):
+            build_tree('A1')
+
+
+@override_settings(BOM_EXPLOSION_CACHE={'ENABLED': False})
+class GraphSnapshotTests(TestCase):
+
+    def setUp(self):
+        call_command('generate_data', items=2, seed=2, stdout=StringIO())
+        self.item_nos = list(top_level_items().values_list('item_no', flat=True))
+
+    def assertGraphsEqual(self, graph, expected):
+        self.assertEqual(graph.items, expected.items)
+        self.assertEqual(graph.children, expected.children)
+        self.assertEqual(graph.routing, expected.routing)
+        self.assertEqual(graph.cost_per_min, expected.cost_per_min)
+
+    def test_subgraph_matches_database_load(self):
+        with override_settings(BOM_GRAPH_SNAPSHOT={'ENABLED': True}):
+            for item_no in self.item_nos:
+                self.assertGraphsEqual(load_graph([item_no], routing=True), BOMGraph.load([item_no], routing=True))
+            self.assertGraphsEqual(load_graph(self.item_nos + ['NOPE']), BOMGraph.load(self.item_nos))
+            self.assertEqual(load_graph(['NOPE']).items, {})
+            trees = [build_tree(item_no) for item_no in self.item_nos]
+        self.assertEqual(trees, [build_tree(item_no) for item_no in self.item_nos])
+
+    def test_changes_replace_the_snapshot(self):
+        with override_settings(BOM_GRAPH_SNAPSHOT={'ENABLED': True}):
+            snapshot = graph_snapshot()
+            self.assertIs(graph_snapshot(), snapshot)
+            line = BOMLine.objects.filter(bom__parent__item_no=self.item_nos[0]).first()
+            line.quantity += 5
+            line.save()
+            graph = load_graph(self.item_nos[:1])
+        self.assertIsNot(graph_snapshot(), snapshot)
+        self.assertIn((line.component_id, line.quantity), graph.children[line.bom.parent_id])
+
+    @override_settings(BOM_EXPLOSION_CACHE={'ENABLED': True, 'SUBTREE_ENTRIES': 100},
+                       BOM_GRAPH_SNAPSHOT={'ENABLED': True})
+    def test_sub_assembly_subtrees_are_shared_across_requests(self):
+        part = make_item('SP')
+        sub = make_item('SA', item_type='A')
+        make_bom(sub, [(part, 2)])
+        # Each product uses SA twice; tree-shaped graphs are not memoized at all
+        for item_no, lines in (('S1', [(sub, 1), (sub, 2)]), ('S2', [(part, 1), (sub, 1), (sub, 1)]),
+                               ('S3', [(sub, 3), (sub, 1)])):
+            make_bom(make_item(item_no, item_type='A'), lines)
+        self.assertIs(build_tree('S1')['children'][0], build_tree('S3')['children'][0])
+        # Routing subtrees also depend on the extended quantity
+        self.assertIs(collect_routing_data('S1')['children'][0], collect_routing_data('S2')['children'][1])
+        self.assertIsNot(collect_routing_data('S1')['children'][0], collect_routing_data('S3')['children'][0])
+
+        shared = build_tree('S2')['children'][1]
+        line = BOMLine.objects.get(bom__parent=sub)
+        line.quantity = 5
+        line.save()
+        self.assertIsNot(build_tree('S1')['children'][0], shared)
+        self.assertIs(build_tree('S1')['children'][0], build_tree('S2')['children'][1])
+
+    def test_saved_snapshot_is_shared_through_memory_mapped_files(self):
+        with tempfile.TemporaryDirectory() as path, \
+                override_settings(BOM_GRAPH_SNAPSHOT={'ENABLED': True, 'PATH': path}):
+            snapshot = graph_snapshot()
+            self.assertIsInstance(snapshot.child_index, np.memmap)
+            opened = GraphSnapshot.open(path, snapshot.version)
+            self.assertGraphsEqual(opened.subgraph(self.item_nos, routing=True),
+                                   BOMGraph.load(self.item_nos, routing=True))
+
+            WorkCenter.objects.update(cost_per_min=2.0)
+            WorkCenter.objects.first().save()
+            self.assertEqual(graph_snapshot().wc_cost_per_min.tolist(), [2.0] * WorkCenter.objects.count())
+            self.assertEqual(os.listdir(path), [f"graph-1-{graph_snapshot().version}"])
+
+
+class WhereUsedTests(TestCase):
+
+    def setUp(self):
+        self.part = make_item('P1')
+        self.shared = make_item('A3', item_type='A')
+        make_bom(self.shared, [(self.part, 2)], complexity='complex', depth=1)
+        self.top = make_item('A1', item_type='A')
+        make_bom(self.top, [(self.shared, 3), (self.part, 1)], complexity='complex')
+        self.other = make_item('A2', item_type='A')
+        make_bom(self.other, [(self.shared, 5)], complexity='moderate')
+
+    def test_paths_and_extended_quantities(self):
+        result = where_used(self.part)
+        self.assertEqual(result['item_no'], 'P1')
+        self.assertFalse(result['truncated'])
+        a1, a2 = result['top_level']
+        self.assertEqual((a1['item_no'], a1['total_quantity']), ('A1', 7))
+        self.assertCountEqual(a1['paths'], [
+            {'path': ['A1', 'A3', 'P1'], 'quantity': 6},
+            {'path': ['A1', 'P1'], 'quantity': 1},
+        ])
+        self.assertEqual((a2['item_no'], a2['total_quantity']), ('A2', 10))
+        self.assertEqual(a2['paths'], [{'path': ['A2', 'A3', 'P1'], 'quantity': 10}])
+
+    def test_max_paths_truncates_but_keeps_totals(self):
+        result = where_used(self.part, max_paths=1)
+        self.assertTrue(result['truncated'])
+        self.assertEqual(sum(len(top['paths']) for top in result['top_level']), 1)
+        self.assertEqual([top['total_quantity'] for top in result['top_level']], [7, 10])
+
+    def test_query_count_is_independent_of_depth(self):
+        deep = make_chain('D', 10)
+        part = Item.objects.get(item_no='DP')
+        with self.assertNumQueries(2):
+            result = where_used(part)
+        self.assertEqual([top['item_no'] for top in result['top_level']], [deep.item_no])
+        self.assertEqual(result['top_level'][0]['total_quantity'], 2 ** 10)
+
+    def test_cyclic_bom_raises(self):
+        BOMLine.objects.bulk_create([BOMLine(bom=self.part.booms.create(bom_no='BOM_P1', depth=2, complexity='part'),
+                                             component=self.top, quantity=1)])
+        with self.assertRaises(ValueError):
+            where_used(self.part)
+
+    def test_endpoint(self):
+        response = self.client.get('/api/where-used/A3/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([top['item_no'] for top in response.json()['top_level']], ['A1', 'A2'])
+        response = self.client.get('/api/where-used/NOPE/')
+        self.assertEqual(response.status_code, 404)
+
+
+class GenerateDataTests(TestCase):
+
+    def test_bulk_generation(self):
+        make_item('OLD1')
+        call_command('generate_data', items=3, seed=5, batch_size=50, stdout=StringIO())
+
+        self.assertFalse(Item.objects.filter(item_no='OLD1').exists())
+        self.assertEqual(top_level_items().count(), 9)
+        for complexity in ('simple', 'moderate', 'complex'):
+            self.assertEqual(top_level_items(complexity).count(), 3)
+        for item in top_level_items('simple'):
+            lines = BOMLine.objects.filter(bom__parent=item)
+            self.assertGreaterEqual(lines.count(), 2)
+            self.assertFalse(lines.filter(component__item_type='A').exists())
+        for item in top_level_items('moderate'):
+            self.assertTrue(BOMLine.objects.filter(bom__parent=item, component__item_type='A').exists())
+        for item in top_level_items('complex'):
+            subs = BOMLine.objects.filter(bom__parent=item, component__item_type='A').values('component')
+            self.assertTrue(BOMLine.objects.filter(bom__parent__in=subs, component__item_type='A').exists())
+
+        # Totals were rolled up before the rows were written
+        stored = dict(Item.objects.values_list('id', 'total_cost'))
+        for item_id, total in rollup_all_costs().items():
+            self.assertAlmostEqual(stored[item_id], total)
+        # Sequences continue after the explicit ids
+        self.assertGreater(make_item('NEW1').pk, max(stored))
+
+    def test_copy_needs_postgres(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_data', items=1, copy=True, stdout=StringIO())
+
+    def test_profile_catalogue(self):
+        call_command('generate_data', profile='small', products=12, depth=(3, 5), parts=40, sharing=0.5,
+                     seed=3, batch_size=25, stdout=StringIO())
+
+        self.assertEqual(WorkCenter.objects.count(), 6)
+        self.assertEqual(Item.objects.filter(item_type='P').count(), 40)
+        self.assertEqual(top_level_items('complex').count(), 12)
+        # Every product reaches three to five levels down
+        product_nos = list(top_level_items().values_list('item_no', flat=True))
+        graph = BOMGraph.load(product_nos)
+
+        def height(item_id):
+            lines = graph.children.get(item_id)
+            return 1 + max(height(component_id) for component_id, _ in lines) if lines else 0
+
+        for item_no in product_nos:
+            self.assertIn(height(graph.ids[item_no]), (3, 4, 5))
+        # Shared sub-assemblies are used by more than one product
+        self.assertTrue(Item.objects.filter(item_type='A', is_top_level=False).annotate(
+            uses=Count('bomline')).filter(uses__gt=1).exists())
+
+        stored = dict(Item.objects.values_list('id', 'total_cost'))
+        for item_id, total in rollup_all_costs().items():
+            self.assertAlmostEqual(stored[item_id], total)
+
+    def test_profile_options_need_profile(self):
+        with self.assertRaises(CommandError):
+            call_command('generate_data', depth=(2, 3), stdout=StringIO())
+
+
+class BenchmarkTests(TestCase):
+
+    def setUp(self):
+        call_command('generate_data', items=2, seed=2, stdout=StringIO())
+
+    def test_query_budgets(self):
+        results = run_benchmarks(repeat=1, samples=2, seed=0)
+        budgets = {
+            # The GraphVersion token checked by the explosion cache, then the graph
+            'build_tree[complex]': 3,
+            # Only the graph version token
+            'build_tree[complex,snapshot]': 1,
+            'collect_routing_data[complex,snapshot]': 1,
+            'collect_routing_data[complex]': 5,
+            'retrieve_top_level_item[complex]': 1,
+            'where_used[part]': 2,
+            # Two reads and one update, plus the savepoint statements of the rollback
+            'rollup_costs[part]': 6,
+        }
+        for name, budget in budgets.items():
+            self.assertLessEqual(results[name]['queries'], budget, name)
+        for result in results.values():
+            self.assertEqual(result['runs'], 1)
+            self.assertGreater(result['peak_memory_kib'], 0)
+        self.assertIn('GET /simulation/sw-case/all/', results)
+
+    def test_command_output_and_compare(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            baseline = os.path.join(tmp, 'baseline.json')
+            call_command('benchmark', current=True, repeat=1, samples=1, output=baseline, stdout=StringIO())
+            with open(baseline) as f:
+                data = json.load(f)
+            self.assertEqual(set(data['datasets']), {'current'})
+            self.assertEqual(data['datasets']['current']['rows']['Item'], Item.objects.count())
+
+            # A baseline that claims zero queries everywhere makes every case a regression
+            for case in data['datasets']['current']['cases'].values():
+                case['queries'] = 0
+            with open(baseline, 'w') as f:
+                json.dump(data, f)
+            with self.assertRaises(CommandError):
+                call_command('benchmark', current=True, repeat=1, samples=1, compare=baseline,
+                             threshold=1000, stdout=StringIO())
+
+    def test_traversal_queries_use_covering_indexes(self):
+        item = Item.objects.filter(item_type='A', booms__complexity='complex').first()
+        plans = traversal_plans(item.item_no)
+        self.assertEqual(set(plans), {'explosion', 'where_used'})
+        for statements in plans.values():
+            self.assertTrue(statements)
+            for statement in statements:
+                self.assertTrue(statement['plan'])
+                self.assertTrue(statement['covered'], statement)
+
+    def test_one_bom_per_parent(self):
+        bom = BOM.objects.first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            BOM.objects.create(bom_no=f"{bom.bom_no}_2", parent=bom.parent, complexity=bom.complexity)
+
+
+# Production samples a small fraction of requests; instrument every one here
+@override_settings(REQUEST_INSTRUMENTATION={'SAMPLE_RATE': 1.0})
+class InstrumentationTests(TestCase):
+
+    def setUp(self):
+        METRICS.reset()
+        part = make_item('P1')
+        make_bom(make_item('A1', item_type='A'), [(part, 2)])
+
+    def test_server_timing_and_metrics(self):
+        response = self.client.get('/api/where-used/P1/')
+        timing = response['Server-Timing']
+        for metric in ('db;dur=', 'serialization;dur=', 'python;dur=', 'total;dur='):
+            self.assertIn(metric, timing)
+        # Item lookup plus the two where-used queries
+        self.assertIn('desc="3 queries"', timing)
+
+        metrics = self.client.get('/metrics').content.decode()
+        labels = 'view="api/where-used/<str:item_no>/",method="GET"'
+        self.assertIn(f'http_requests_sampled_total{{{labels},status="200"}} 1', metrics)
+        self.assertIn(f'http_request_db_queries_total{{{labels}}} 3', metrics)
+        self.assertIn(f'http_request_duration_seconds_count{{{labels}}} 1', metrics)
+
+    @override_settings(REQUEST_INSTRUMENTATION={'SAMPLE_RATE': 0.0})
+    def test_unsampled_requests_are_not_instrumented(self):
+        response = self.client.get('/api/where-used/P1/')
+        self.assertNotIn('Server-Timing', response)
+        self.assertNotIn('where-used', self.client.get('/metrics').content.decode())
@@ -1,9 +1,23 @@
 from django.urls import path
-from .views import bom_tree, tree_view, bom_routing_table, routing_table_view
+from .views import (
+    bom_tree, bom_tree_for_item, bom_tree_stream, tree_view, bom_routing_table, bom_routing_table_for_item,
+    bom_routing_indented, bom_routing_indented_for_item, routing_table_view, item_where_used,
+    item_cost_breakdown, cost_breakdown_batch, bom_tree_batch,
+)
 
 urlpatterns = [
+    path('api/bom/item/<str:item_no>/', bom_tree_for_item, name='bom_tree_for_item'),
+    path('api/bom/item/<str:item_no>/stream/', bom_tree_stream, name='bom_tree_stream'),
+    path('api/bom/batch/', bom_tree_batch, name='bom_tree_batch'),
     path('api/bom/<str:complexity>/', bom_tree),
     path('', tree_view, name='tree_view'),
+    path('api/bom-routing/item/<str:item_no>/', bom_routing_table_for_item, name='bom_routing_table_for_item'),
+    path('api/bom-routing/item/<str:item_no>/indented/', bom_routing_indented_for_item,
+         name='bom_routing_indented_for_item'),
     path('api/bom-routing/<str:complexity>/', bom_routing_table, name='bom_routing_table'),
+    path('api/bom-routing/<str:complexity>/indented/', bom_routing_indented, name='bom_routing_indented'),
     path('bom-routing/', routing_table_view, name='routing_table_view'),
+    path('api/where-used/<str:item_no>/', item_where_used, name='item_where_used'),
+    path('api/cost-breakdown/', cost_breakdown_batch, name='cost_breakdown_batch'),
+    path('api/cost-breakdown/<str:item_no>/', item_cost_breakdown, name='item_cost_breakdown'),
 ]
\ No newline at end of file
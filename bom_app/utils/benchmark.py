@@ -0,0 +1,235 @@
+import itertools
+import os
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from django.db import connection, reset_queries, transaction
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from bom_app.models import Item, BOM, BOMLine, WorkCenter, RoutingStep
+from bom_app.views import build_tree, collect_routing_data, retrieve_top_level_item
+from bom_app.utils.top_level_index import top_level_items
+from bom_app.utils.cost_rollup import rollup_costs, rollup_all_costs
+from bom_app.utils.where_used import where_used
+from bom_app.utils.query_plans import traversal_plans
+from bom_app.utils.graph_snapshot import GraphSnapshot, graph_snapshot, graph_version
+
+# --- Benchmark harness -------------------------------------------------------------
+# Every case is a no-argument callable. It is run once under tracemalloc and
+# CaptureQueriesContext for the query count and peak memory, then `repeat` more
+# times for latency. Cases that write (the cost roll-ups) run in a rolled-back
+# transaction. Case names are stable so result files can be diffed between commits.
+# The explosion cases run with the explosion cache (warm after the first pass over
+# the sample), as "uncached" with it bypassed, and as "snapshot" with it bypassed
+# and the subgraph taken from the shared graph snapshot, which is built up front.
+# -------------------------------------------------------------------------------------
+
+COMPLEXITIES = ('simple', 'moderate', 'complex')
+
+# Cases that touch every item run fewer times
+SLOW_CASE_REPEAT = 2
+
+
+def measure(func, repeat):
+    """
+    Latency (ms), query count and peak traced memory (KiB) of func
+    """
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    query_count = len(queries)
+
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    reset_queries()
+
+    return {
+        "runs": repeat,
+        "queries": query_count,
+        "peak_memory_kib": round(peak / 1024, 1),
+        "latency_ms": {
+            "mean": round(float(np.mean(timings)), 3),
+            "p50": round(float(np.percentile(timings, 50)), 3),
+            "p95": round(float(np.percentile(timings, 95)), 3),
+            "min": round(float(np.min(timings)), 3),
+            "max": round(float(np.max(timings)), 3),
+        },
+    }
+
+
+def cycle_calls(func, args):
+    """
+    Callable running func on the next of args on every call
+    """
+    args = itertools.cycle(args)
+    return lambda: func(next(args))
+
+
+def rolled_back(func):
+    def run():
+        with transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+    return run
+
+
+def uncached(func):
+    """
+    func with the BOM explosion cache bypassed
+    """
+    def run():
+        with override_settings(BOM_EXPLOSION_CACHE={'ENABLED': False}):
+            func()
+    return run
+
+
+def with_snapshot(func):
+    """
+    func reading the shared graph snapshot, with the BOM explosion cache bypassed
+    """
+    def run():
+        with override_settings(BOM_EXPLOSION_CACHE={'ENABLED': False}, BOM_GRAPH_SNAPSHOT={'ENABLED': True}):
+            func()
+    return run
+
+
+def get_ok(client, url):
+    def run():
+        response = client.get(url)
+        if response.status_code != 200:
+            raise AssertionError(f"GET {url} returned {response.status_code}")
+    return run
+
+
+def post_ok(client, url, data):
+    def run():
+        response = client.post(url, data, content_type='application/json')
+        if response.status_code != 200:
+            raise AssertionError(f"POST {url} returned {response.status_code}")
+    return run
+
+
+def dataset_summary():
+    return {model.__name__: model.objects.count() for model in (Item, BOM, BOMLine, WorkCenter, RoutingStep)}
+
+
+def benchmark_cases(samples=5, seed=0):
+    """
+    (name, callable, repeat or None) for every benchmarked hot path.
+    Items are sampled reproducibly from seed.
+    """
+    rng = np.random.default_rng(seed)
+    client = Client(HTTP_HOST='localhost')
+    graph_snapshot()
+    cases = [("build_graph_snapshot", lambda: GraphSnapshot.build(graph_version()), SLOW_CASE_REPEAT)]
+
+    for complexity in COMPLEXITIES:
+        item_nos = list(top_level_items(complexity).order_by('item_no').values_list('item_no', flat=True))
+        if not item_nos:
+            continue
+        sample = rng.choice(item_nos, size=min(samples, len(item_nos)), replace=False).tolist()
+        cases += [
+            (f"build_tree[{complexity}]", cycle_calls(build_tree, sample), None),
+            (f"collect_routing_data[{complexity}]", cycle_calls(collect_routing_data, sample), None),
+            (f"build_tree[{complexity},uncached]", uncached(cycle_calls(build_tree, sample)), None),
+            (f"collect_routing_data[{complexity},uncached]",
+             uncached(cycle_calls(collect_routing_data, sample)), None),
+            (f"build_tree[{complexity},snapshot]", with_snapshot(cycle_calls(build_tree, sample)), None),
+            (f"collect_routing_data[{complexity},snapshot]",
+             with_snapshot(cycle_calls(collect_routing_data, sample)), None),
+            (f"GET /api/bom/item/[{complexity}]",
+             cycle_calls(lambda item_no: get_ok(client, f"/api/bom/item/{item_no}/")(), sample), None),
+            (f"POST /api/bom/batch/[{complexity}]",
+             post_ok(client, "/api/bom/batch/", {"item_nos": sample}), None),
+            (f"POST /api/bom/batch/[{complexity},normalized]",
+             post_ok(client, "/api/bom/batch/", {"item_nos": sample, "format": "normalized"}), None),
+            (f"GET /simulation/base-case/item/[{complexity}]",
+             cycle_calls(lambda item_no: get_ok(client, f"/simulation/base-case/item/{item_no}/?seed={seed}")(),
+                         sample), None),
+            (f"retrieve_top_level_item[{complexity}]",
+             lambda complexity=complexity: retrieve_top_level_item(complexity, rng=rng), None),
+            (f"GET /simulation/base-case/{complexity}/",
+             get_ok(client, f"/simulation/base-case/{complexity}/?seed={seed}"), None),
+            (f"GET /simulation/base-case/view/{complexity}/",
+             get_ok(client, f"/simulation/base-case/view/{complexity}/?seed={seed}"), None),
+            (f"GET /simulation/base-case/top-level-by-complexity/{complexity}/",
+             get_ok(client, f"/simulation/base-case/top-level-by-complexity/{complexity}/?seed={seed}"), None),
+        ]
+        if complexity == 'complex':
+            cases.append(("GET /simulation/base-case-test/", get_ok(client, f"/simulation/base-case-test/?seed={seed}"), None))
+
+    parts = list(Item.objects.filter(item_type='P').order_by('item_no'))
+    if parts:
+        sample = [parts[i] for i in rng.choice(len(parts), size=min(samples, len(parts)), replace=False)]
+        cases += [
+            ("where_used[part]", cycle_calls(where_used, sample), None),
+            ("rollup_costs[part]", rolled_back(cycle_calls(lambda item: rollup_costs([item.pk]), sample)), None),
+        ]
+
+    if top_level_items().exists():
+        cases += [
+            ("rollup_all_costs", rolled_back(rollup_all_costs), SLOW_CASE_REPEAT),
+            ("GET /simulation/base-case/all/", get_ok(client, f"/simulation/base-case/all/?seed={seed}"), SLOW_CASE_REPEAT),
+            ("GET /simulation/sw-case/all/", get_ok(client, f"/simulation/sw-case/all/?seed={seed}"), SLOW_CASE_REPEAT),
+        ]
+    return cases
+
+
+def run_benchmarks(repeat=5, samples=5, seed=0):
+    """
+    Measure every case against the current database. Returns a dict of
+    case name -> measurements.
+    """
+    results = {}
+    working_dir = os.getcwd()
+    # The "all" simulation endpoints write a results file to the working directory
+    with tempfile.TemporaryDirectory() as scratch_dir:
+        os.chdir(scratch_dir)
+        try:
+            for name, func, case_repeat in benchmark_cases(samples, seed):
+                results[name] = measure(func, min(case_repeat or repeat, repeat))
+        finally:
+            os.chdir(working_dir)
+    return results
+
+
+def query_plans():
+    """
+    Plans of the traversal queries for the first complex top-level item
+    (or the first top-level item when there is none)
+    """
+    for complexity in ('complex', None):
+        item_no = top_level_items(complexity).order_by('item_no').values_list('item_no', flat=True).first()
+        if item_no:
+            return {"item_no": item_no, "queries": traversal_plans(item_no)}
+    return {}
+
+
+def compare_results(baseline, current, threshold=1.25):
+    """
+    Cases whose mean latency grew by more than threshold times, or whose
+    query count grew, between two result files. Returns a list of messages.
+    """
+    regressions = []
+    for dataset, data in current["datasets"].items():
+        base_cases = baseline.get("datasets", {}).get(dataset, {}).get("cases", {})
+        for name, result in data["cases"].items():
+            base = base_cases.get(name)
+            if base is None:
+                continue
+            ratio = result["latency_ms"]["mean"] / max(base["latency_ms"]["mean"], 1e-6)
+            if ratio > threshold:
+                regressions.append(f"{dataset} {name}: mean latency {base['latency_ms']['mean']} -> "
+                                   f"{result['latency_ms']['mean']} ms ({ratio:.2f}x)")
+            if result["queries"] > base["queries"]:
+                regressions.append(f"{dataset} {name}: queries {base['queries']} -> {result['queries']}")
+    return regressions
@@ -0,0 +1,490 @@
+import numpy as np
+from django.db import connection
+from bom_app.models import Item, BOM, BOMLine, WorkCenter, RoutingStep
+from bom_app.utils.sql_lists import in_values
+
+# --- In-memory BOM subgraph -------------------------------------------------
+# Loads every item reachable from a set of root items with one recursive CTE,
+# so the number of queries does not depend on the depth or width of the BOM.
+# -----------------------------------------------------------------------------
+
+
+def _reachable_cte(item_nos):
+    """
+    Build the WITH RECURSIVE clause listing the ids of all items reachable
+    from the given root item_nos (roots included). Returns (sql, params).
+    """
+    item_table = Item._meta.db_table
+    bom_table = BOM._meta.db_table
+    line_table = BOMLine._meta.db_table
+    roots, params = in_values('item_no', item_nos)
+    return f"""
+        WITH RECURSIVE reach(item_id) AS (
+            SELECT id FROM {item_table} WHERE {roots}
+            UNION
+            SELECT l.component_id
+            FROM {line_table} l
+            JOIN {bom_table} b ON b.id = l.bom_id
+            JOIN reach r ON b.parent_id = r.item_id
+        )
+    """, params
+
+
+def where_used_cte(item_ids):
+    """
+    Build the WITH RECURSIVE clause listing the given item ids and every
+    assembly that uses one of them, directly or indirectly.
+    Returns (sql, params).
+    """
+    bom_table = BOM._meta.db_table
+    line_table = BOMLine._meta.db_table
+    seeds, params = in_values('id', item_ids)
+    return f"""
+        WITH RECURSIVE up(item_id) AS (
+            SELECT id FROM {Item._meta.db_table} WHERE {seeds}
+            UNION
+            SELECT b.parent_id
+            FROM {line_table} l
+            JOIN {bom_table} b ON b.id = l.bom_id
+            JOIN up u ON l.component_id = u.item_id
+        )
+    """, params
+
+
+class BOMGraph:
+    """
+    Adjacency map of a BOM subgraph.
+
+    items:    item id -> dict with item_no, description, item_type and costs
+    ids:      item_no -> item id
+    children: item id -> list of (component id, quantity) in BOM line order,
+              present only for items that have a BOM
+    routing:  item id -> list of (wc_no, run_time_min) in step order
+              (only filled when loaded with routing=True)
+    work_centers: all wc_no values, used as the column set of routing data
+    cost_per_min: wc_no -> cost_per_min of every work center
+    version:  GraphVersion token the data was read at, when known (graphs cut
+              out of the graph snapshot); None for graphs loaded directly
+    """
+
+    def __init__(self, items, children, routing=None, work_centers=None, cost_per_min=None, version=None):
+        self.items = items
+        self.children = children
+        self.routing = routing or {}
+        self.work_centers = work_centers or []
+        self.cost_per_min = cost_per_min or {}
+        self.version = version
+        self.ids = {item['item_no']: item_id for item_id, item in items.items()}
+        self._repeats_sub_assemblies = None
+
+    def has_bom(self, item_id):
+        return item_id in self.children
+
+    def repeats_sub_assemblies(self):
+        """
+        Whether sub-assemblies (items with BOM lines) are used on enough BOM
+        lines that assembling each distinct subtree once pays off: the nodes
+        saved by their repeated uses, counted one level deep as a lower
+        bound, reach half the number of items in the graph
+        """
+        if self._repeats_sub_assemblies is None:
+            seen = set()
+            saved = 0
+            for lines in self.children.values():
+                for component_id, _ in lines:
+                    below = self.children.get(component_id)
+                    if not below:
+                        continue
+                    if component_id in seen:
+                        saved += 1 + len(below)
+                    else:
+                        seen.add(component_id)
+            self._repeats_sub_assemblies = 2 * saved >= len(self.items)
+        return self._repeats_sub_assemblies
+
+    @classmethod
+    def load(cls, item_nos, routing=False):
+        """
+        Load the subgraph reachable from the given item_nos in two queries,
+        plus two more for routing steps and work centers when routing=True.
+        """
+        item_nos = list(item_nos)
+        if not item_nos:
+            return cls({}, {})
+
+        cte, params = _reachable_cte(item_nos)
+        item_table = Item._meta.db_table
+        bom_table = BOM._meta.db_table
+        line_table = BOMLine._meta.db_table
+
+        items = {}
+        children = {}
+        with connection.cursor() as cursor:
+            cursor.execute(cte + f"""
+                SELECT i.id, i.item_no, i.description, i.item_type,
+                       i.base_cost, i.process_cost, i.total_cost
+                FROM reach r JOIN {item_table} i ON i.id = r.item_id
+            """, params)
+            for item_id, item_no, description, item_type, base_cost, process_cost, total_cost in cursor.fetchall():
+                items[item_id] = {
+                    'item_no': item_no,
+                    'description': description,
+                    'item_type': item_type,
+                    'base_cost': base_cost,
+                    'process_cost': process_cost,
+                    'total_cost': total_cost,
+                }
+
+            # LEFT JOIN so BOMs without lines (e.g. manufacturing BOMs of parts)
+            # are still recorded. The bom_one_per_parent constraint allows one
+            # BOM per parent; should there be more, only the first is used.
+            # Lines are read in id order from bomline_explode_idx.
+            cursor.execute(cte + f"""
+                SELECT b.parent_id, b.id, l.component_id, l.quantity
+                FROM reach r
+                JOIN {bom_table} b ON b.parent_id = r.item_id
+                LEFT JOIN {line_table} l ON l.bom_id = b.id
+                ORDER BY b.id, l.id
+            """, params)
+            bom_of_parent = {}
+            for parent_id, bom_id, component_id, quantity in cursor.fetchall():
+                if bom_of_parent.setdefault(parent_id, bom_id) != bom_id:
+                    continue
+                lines = children.setdefault(parent_id, [])
+                if component_id is not None:
+                    lines.append((component_id, quantity))
+
+            if not routing:
+                return cls(items, children)
+
+            step_table = RoutingStep._meta.db_table
+            wc_table = WorkCenter._meta.db_table
+            # Steps are read per reached BOM from routingstep_bom_step_idx, in step order
+            cursor.execute(cte + f"""
+                SELECT b.parent_id, b.id, w.wc_no, s.run_time_min
+                FROM reach r
+                JOIN {bom_table} b ON b.parent_id = r.item_id
+                JOIN {step_table} s ON s.bom_id = b.id
+                JOIN {wc_table} w ON w.id = s.wc_id
+                ORDER BY b.id, s.step_no
+            """, params)
+            steps = {}
+            for parent_id, bom_id, wc_no, run_time_min in cursor.fetchall():
+                if bom_of_parent.get(parent_id) == bom_id:
+                    steps.setdefault(parent_id, []).append((wc_no, run_time_min))
+
+        cost_per_min = dict(WorkCenter.objects.order_by('id').values_list('wc_no', 'cost_per_min'))
+        return cls(items, children, steps, list(cost_per_min), cost_per_min)
+
+
+def bottom_up(graph, item_id, compute, results=None):
+    """
+    Evaluate compute(item id, results) for item_id and every item below it,
+    components before the assemblies using them, each item once however
+    often it is used. results maps the item ids done so far to their values;
+    pass the same dict for several roots to share the work between them.
+    Raises ValueError when the BOM below item_id contains a cycle.
+    """
+    results = {} if results is None else results
+    expanded = set()
+    stack = [item_id]
+    while stack:
+        current = stack[-1]
+        if current in results:
+            stack.pop()
+            continue
+        pending = [component_id for component_id, _ in graph.children.get(current, [])
+                   if component_id not in results]
+        if pending:
+            # Everything pushed above an item is done before it is on top
+            # again, unless one of its components leads back to it
+            if current in expanded:
+                raise ValueError("BOM structure contains a cycle")
+            expanded.add(current)
+            stack.extend(pending)
+        else:
+            results[current] = compute(current, results)
+            stack.pop()
+    return results
+
+
+def check_acyclic(graph, item_id):
+    """
+    Raise ValueError when the BOM below item_id contains a cycle
+    """
+    bottom_up(graph, item_id, lambda node_id, results: None)
+
+
+def shared_subtrees(root, expand, build, memo=None):
+    """
+    Assemble a nested structure bottom-up, each distinct sub-assembly once.
+    expand(key) lists the (edge, child key) pairs below key, and
+    build(key, [(edge, child value)]) makes the value of key. The values of
+    keys with children are stored in memo (anything with get and item
+    assignment) and reused wherever their key appears again, so a
+    sub-assembly used many times is built once and its value shared;
+    values must not be modified. Leaves are simply built per use.
+    """
+    memo = {} if memo is None else memo
+    value = memo.get(root)
+    if value is not None:
+        return value
+    frames = [(root, None, iter(expand(root)), [])]
+    while True:
+        key, edge, lines, values = frames[-1]
+        for child_edge, child_key in lines:
+            child_lines = expand(child_key)
+            if not child_lines:
+                values.append((child_edge, build(child_key, [])))
+                continue
+            child = memo.get(child_key)
+            if child is None:
+                frames.append((child_key, child_edge, iter(child_lines), []))
+                break
+            values.append((child_edge, child))
+        else:
+            frames.pop()
+            value = memo[key] = build(key, values)
+            if not frames:
+                return value
+            frames[-1][3].append((edge, value))
+
+
+def expanded_sizes(graph, item_id):
+    """
+    Number of nodes in the expanded tree of item_id and of every item
+    below it (shared sub-assemblies count once per use)
+    """
+    return bottom_up(graph, item_id, lambda node_id, sizes: 1 + sum(
+        sizes[component_id] for component_id, _ in graph.children.get(node_id, [])
+    ))
+
+
+def work_center_rollup(graph, item_id):
+    """
+    Routing minutes per work center needed to build one unit of item_id and
+    of every item below it, components included: own routing minutes plus
+    the roll-up of each component times its BOM line quantity. Returns
+    item id -> int array with one column per graph.work_centers entry.
+    """
+    columns = {wc_no: column for column, wc_no in enumerate(graph.work_centers)}
+
+    def compute(node_id, totals):
+        minutes = np.zeros(len(columns), dtype=np.int64)
+        for wc_no, run_time_min in graph.routing.get(node_id, []):
+            minutes[columns[wc_no]] += run_time_min
+        for component_id, quantity in graph.children.get(node_id, []):
+            minutes += quantity * totals[component_id]
+        return minutes
+
+    return bottom_up(graph, item_id, compute)
+
+
+def walk(graph, item_id, offset=0, limit=None, sizes=None):
+    """
+    Depth-first pre-order walk of the expanded BOM tree of item_id, yielding
+    (index, parent index, item id, quantity, depth) for the nodes with
+    offset <= index < offset + limit. The root has index 0, parent None and
+    quantity 1. Memory is bounded by the depth of the tree; subtrees lying
+    entirely before offset are skipped using expanded_sizes. Raises
+    ValueError on reaching an item that is already on the current path.
+    """
+    end = float('inf') if limit is None else offset + limit
+    if end <= 0:
+        return
+    if offset and sizes is None:
+        sizes = expanded_sizes(graph, item_id)
+    if offset == 0:
+        yield 0, None, item_id, 1, 0
+
+    index = 1
+    path = [item_id]
+    on_path = {item_id}
+    stack = [(0, iter(graph.children.get(item_id, [])), 0)]
+    while stack:
+        parent_index, lines, depth = stack[-1]
+        for component_id, quantity in lines:
+            if index >= end:
+                return
+            if component_id in on_path:
+                raise ValueError("BOM structure contains a cycle")
+            if index < offset and index + sizes[component_id] <= offset:
+                index += sizes[component_id]
+                continue
+            if index >= offset:
+                yield index, parent_index, component_id, quantity, depth + 1
+            stack.append((index, iter(graph.children.get(component_id, [])), depth + 1))
+            path.append(component_id)
+            on_path.add(component_id)
+            index += 1
+            break
+        else:
+            stack.pop()
+            on_path.discard(path.pop())
+
+
+def tree_node(graph, item_id, level):
+    item = graph.items[item_id]
+    return {
+        'item_no': item['item_no'],
+        'description': item['description'],
+        'cost': float(item['total_cost']),
+        'level': level,
+        'children': []
+    }
+
+
+def assemble_tree(graph, item_id, level=0, limit=None, memo=None):
+    """
+    Build the nested BOM tree dict for item_id from a loaded BOMGraph.
+    With limit only the first `limit` nodes in depth-first order are
+    included; expanded_sizes gives the full node count.
+
+    Complete trees of graphs that repeat sub-assemblies (see
+    BOMGraph.repeats_sub_assemblies) are assembled with shared_subtrees
+    keyed by (item id, level): every use of a sub-assembly at the same level
+    is the same dict, so the work grows with the number of distinct
+    sub-assemblies rather than the size of the expanded tree. memo (see
+    shared_subtrees) can be passed to share subtrees between several calls.
+    Other graphs are walked, which is cheaper when there is little to share.
+    Raises ValueError when the BOM contains a cycle.
+    """
+    if limit is None and graph.repeats_sub_assemblies():
+        check_acyclic(graph, item_id)
+        def expand(key):
+            lines = graph.children.get(key[0])
+            if not lines:
+                return ()
+            child_level = key[1] + 1
+            return [(quantity, (component_id, child_level)) for component_id, quantity in lines]
+
+        def build(key, children):
+            node = tree_node(graph, *key)
+            if children:
+                node['children'] = [child for _, child in children]
+            return node
+
+        return shared_subtrees((item_id, level), expand, build, memo)
+
+    nodes = {}
+    for index, parent_index, node_id, _, depth in walk(graph, item_id, limit=limit):
+        node = nodes[index] = tree_node(graph, node_id, level + depth)
+        if parent_index is not None:
+            nodes[parent_index]['children'].append(node)
+    return nodes.get(0)
+
+
+def normalized_explosion(graph, item_ids):
+    """
+    The explosions of item_ids without repeated subtrees: one node per
+    distinct item reachable from them and one edge per BOM line of those
+    items, both in depth-first order of first appearance. An edge names
+    its parent and component by item_no; the edges of one parent are in
+    BOM line order.
+    """
+    nodes = []
+    edges = []
+    seen = set()
+    stack = list(reversed(item_ids))
+    while stack:
+        item_id = stack.pop()
+        if item_id in seen:
+            continue
+        seen.add(item_id)
+        item = graph.items[item_id]
+        nodes.append({
+            'item_no': item['item_no'],
+            'description': item['description'],
+            'item_type': item['item_type'],
+            'cost': float(item['total_cost']),
+        })
+        lines = graph.children.get(item_id, [])
+        for component_id, quantity in lines:
+            edges.append({
+                'parent': item['item_no'],
+                'component': graph.items[component_id]['item_no'],
+                'quantity': quantity,
+            })
+        stack.extend(component_id for component_id, _ in reversed(lines))
+    return {'nodes': nodes, 'edges': edges}
+
+
+def routing_node(graph, item_id, level):
+    item = graph.items[item_id]
+    data = {
+        'item_no': item['item_no'],
+        'description': item['description'],
+        'item_type': item['item_type'],
+        'level': level,
+        'work_centers': {},
+        'total_time': 0,
+        'children': []
+    }
+    # Parts without a BOM only get the basic data
+    if not graph.has_bom(item_id):
+        return data
+
+    for wc_no in graph.work_centers:
+        data['work_centers'][wc_no] = 0
+    for wc_no, run_time_min in graph.routing.get(item_id, []):
+        data['work_centers'][wc_no] = run_time_min
+        data['total_time'] += run_time_min
+    return data
+
+
+def assemble_routing(graph, item_id, level=0, limit=None, wrap_children=False, memo=None):
+    """
+    Build the nested routing data for item_id from a BOMGraph loaded with
+    routing=True, limited like assemble_tree. With wrap_children each child
+    is returned as {'quantity': ..., 'component': ...} instead of the bare node.
+
+    Besides its own routing, every node carries its extended_quantity (units
+    per one root item) and the cumulative_work_centers / cumulative_time
+    needed to build one unit of it including its components (see
+    work_center_rollup). The root's cumulative figures are the workload of
+    one finished product.
+
+    Complete routing trees share subtrees like assemble_tree; as the
+    extended quantity depends on the path, they are keyed by (item id,
+    level, extended quantity).
+    """
+    # Per item rather than per node, as shared sub-assemblies repeat
+    cumulative = {
+        node_id: {wc_no: minutes for wc_no, minutes in zip(graph.work_centers, totals.tolist()) if minutes}
+        for node_id, totals in work_center_rollup(graph, item_id).items()
+    }
+    if limit is None and graph.repeats_sub_assemblies():
+        def expand(key):
+            node_id, node_level, extended = key
+            lines = graph.children.get(node_id)
+            if not lines:
+                return ()
+            return [(quantity, (component_id, node_level + 1, extended * quantity))
+                    for component_id, quantity in lines]
+
+        def build(key, children):
+            node_id, node_level, extended = key
+            node = routing_node(graph, node_id, node_level)
+            node['extended_quantity'] = extended
+            node['cumulative_work_centers'] = dict(cumulative[node_id])
+            node['cumulative_time'] = sum(cumulative[node_id].values())
+            node['children'] = [
+                {'quantity': quantity, 'component': child} if wrap_children else child
+                for quantity, child in children
+            ]
+            return node
+
+        return shared_subtrees((item_id, level, 1), expand, build, memo)
+
+    nodes = {}
+    extended = {}
+    for index, parent_index, node_id, quantity, depth in walk(graph, item_id, limit=limit):
+        node = nodes[index] = routing_node(graph, node_id, level + depth)
+        extended[index] = quantity if parent_index is None else extended[parent_index] * quantity
+        node['extended_quantity'] = extended[index]
+        node['cumulative_work_centers'] = dict(cumulative[node_id])
+        node['cumulative_time'] = sum(cumulative[node_id].values())
+        if parent_index is not None:
+            child = {'quantity': quantity, 'component': node} if wrap_children else node
+            nodes[parent_index]['children'].append(child)
+    return nodes.get(0)
@@ -0,0 +1,82 @@
+import json
+from bom_app.utils.bom_graph import walk, tree_node
+
+# --- Streaming BOM explosion -------------------------------------------------------
+# Serializes the expanded BOM tree of an item while walking it depth-first, so the
+# response never exists as one nested dict or one string. Only the loaded BOMGraph
+# (one entry per distinct item) and the walk stack are held in memory.
+#
+#   json    the nested build_tree document, written node by node
+#   ndjson  one flat row per node, with the pre-order index of the node and of
+#           its parent, so clients can page with offset / limit and rebuild the tree
+# -------------------------------------------------------------------------------------
+
+CHUNK_SIZE = 64 * 1024
+
+# Compact, like the DRF JSON renderer
+SEPARATORS = (',', ':')
+
+
+def _chunked(parts, size=CHUNK_SIZE):
+    """
+    Join string parts into byte chunks of about size bytes
+    """
+    buffer = []
+    length = 0
+    for part in parts:
+        buffer.append(part)
+        length += len(part)
+        if length >= size:
+            yield "".join(buffer).encode()
+            buffer = []
+            length = 0
+    if buffer:
+        yield "".join(buffer).encode()
+
+
+def tree_rows(graph, item_id, offset=0, limit=None, sizes=None):
+    """
+    Flat rows of the expanded tree of item_id in depth-first order
+    """
+    for index, parent_index, node_id, quantity, depth in walk(graph, item_id, offset, limit, sizes):
+        item = graph.items[node_id]
+        yield {
+            'node': index,
+            'parent': parent_index,
+            'item_no': item['item_no'],
+            'description': item['description'],
+            'cost': float(item['total_cost']),
+            'quantity': quantity,
+            'level': depth,
+        }
+
+
+def stream_ndjson(graph, item_id, offset=0, limit=None, sizes=None):
+    """
+    tree_rows as newline-delimited JSON byte chunks
+    """
+    return _chunked(json.dumps(row, separators=SEPARATORS) + "\n" for row in tree_rows(graph, item_id, offset, limit, sizes))
+
+
+def _nested_json_parts(graph, item_id, limit):
+    previous_depth = None
+    for _, _, node_id, _, depth in walk(graph, item_id, limit=limit):
+        node = json.dumps(tree_node(graph, node_id, depth), separators=SEPARATORS)
+        # Leave the children list open: drop the closing ']}' of '"children":[]}'
+        opening = node[:-2]
+        if previous_depth is None or depth > previous_depth:
+            yield opening
+        else:
+            # Close the previous node and any subtrees finished with it
+            yield "]}" * (previous_depth - depth + 1) + "," + opening
+        previous_depth = depth
+    if previous_depth is not None:
+        yield "]}" * (previous_depth + 1)
+
+
+def stream_tree_json(graph, item_id, limit=None):
+    """
+    The build_tree document of item_id as JSON byte chunks, limited to the
+    first `limit` nodes in depth-first order
+    """
+    return _chunked(_nested_json_parts(graph, item_id, limit))
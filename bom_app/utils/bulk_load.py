@@ -0,0 +1,120 @@
+import csv
+import io
+from django.core.management.color import no_style
+from django.db import connection
+from bom_app.models import Item, BOM, BOMLine, WorkCenter, RoutingStep
+
+# --- Bulk loading of BOM data -------------------------------------------------------
+# Used by generate_data: the BOM tables are emptied, rows are built with explicit
+# primary keys (so foreign keys can be set without reading ids back) and written
+# in batches with bulk_create / executemany, or with COPY on PostgreSQL.
+# Sequences are moved past the inserted ids afterwards.
+# -------------------------------------------------------------------------------------
+
+# Referenced tables first
+BOM_MODELS = [WorkCenter, Item, BOM, BOMLine, RoutingStep]
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def copy_supported():
+    return connection.vendor == 'postgresql'
+
+
+def flush_bom_tables():
+    """
+    Delete every row of the BOM tables and reset their sequences, without
+    collecting cascades and delete signals row by row
+    """
+    tables = [model._meta.db_table for model in BOM_MODELS]
+    connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, reset_sequences=True))
+
+
+def reset_sequences(models=BOM_MODELS):
+    """
+    Point the id sequences past the explicitly inserted primary keys
+    """
+    statements = connection.ops.sequence_reset_sql(no_style(), models)
+    if statements:
+        with connection.cursor() as cursor:
+            for sql in statements:
+                cursor.execute(sql)
+
+
+def copy_rows(model, columns, rows):
+    """
+    Write value tuples (in the order of columns) with PostgreSQL COPY,
+    using psycopg 3 or psycopg2
+    """
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+
+    quote = connection.ops.quote_name
+    db_columns = [model._meta.get_field(name).column for name in columns]
+    sql = (f"COPY {quote(model._meta.db_table)} ({', '.join(quote(column) for column in db_columns)}) "
+           f"FROM STDIN WITH (FORMAT csv)")
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, 'copy_expert'):
+            buffer.seek(0)
+            raw_cursor.copy_expert(sql, buffer)
+        else:
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+def insert_rows(model, columns, rows, use_copy=False):
+    """
+    Write value tuples (in the order of columns) with one executemany,
+    or with COPY
+    """
+    if use_copy:
+        copy_rows(model, columns, rows)
+        return
+    quote = connection.ops.quote_name
+    db_columns = [model._meta.get_field(name).column for name in columns]
+    sql = (f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(column) for column in db_columns)}) "
+           f"VALUES ({', '.join(['%s'] * len(columns))})")
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+
+
+def bulk_insert(model, objs, batch_size=DEFAULT_BATCH_SIZE, use_copy=False):
+    """
+    Insert model instances that already carry their primary keys
+    """
+    if not objs:
+        return
+    if use_copy:
+        fields = [field.attname for field in model._meta.concrete_fields]
+        copy_rows(model, fields, [[getattr(obj, field) for field in fields] for obj in objs])
+    else:
+        model.objects.bulk_create(objs, batch_size=batch_size)
+
+
+class RowWriter:
+    """
+    Buffers value tuples per model and writes them in batches, so a
+    generator can stream millions of rows without building model instances.
+    columns maps each model to the field names of its tuples.
+    """
+    def __init__(self, columns, batch_size=DEFAULT_BATCH_SIZE, use_copy=False):
+        self.columns = columns
+        self.batch_size = batch_size
+        self.use_copy = use_copy
+        self.buffers = {model: [] for model in columns}
+        self.counts = dict.fromkeys(columns, 0)
+
+    def add(self, model, row):
+        buffer = self.buffers[model]
+        buffer.append(row)
+        if len(buffer) >= self.batch_size:
+            self.flush(model)
+
+    def flush(self, model=None):
+        for model in [model] if model else self.buffers:
+            rows = self.buffers[model]
+            if rows:
+                insert_rows(model, self.columns[model], rows, self.use_copy)
+                self.counts[model] += len(rows)
+                rows.clear()
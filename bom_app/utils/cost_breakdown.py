@@ -0,0 +1,87 @@
+import numpy as np
+from bom_app.utils.bom_graph import bottom_up
+from bom_app.utils.graph_snapshot import load_graph
+
+# --- Cost breakdown ----------------------------------------------------------------
+# Splits the cost of one unit of an item into
+#
+#   material     base_cost of the item and of every component, times quantities
+#   process      run_time_min * cost_per_min of every routing step, per work center
+#   levels       material and process cost per level below the item (0 = the item)
+#
+# computed from routing steps, work center rates and BOM quantities rather than the
+# stored process_cost / total_cost. Each distinct item is evaluated once, bottom-up,
+# as numpy vectors: one row per level, with the material cost and the minutes per
+# work center as columns. Breakdowns of several items share one preloaded BOMGraph
+# and the per-item results, so common sub-assemblies are not recomputed.
+# -------------------------------------------------------------------------------------
+
+
+class CostBreakdowns:
+    """
+    Cost breakdowns of items of a BOMGraph loaded with routing=True
+    """
+    def __init__(self, graph):
+        self.graph = graph
+        self.columns = {wc_no: 1 + column for column, wc_no in enumerate(graph.work_centers)}
+        self.rates = np.array([graph.cost_per_min[wc_no] for wc_no in graph.work_centers], dtype=float)
+        self.results = {}
+
+    def _compute(self, item_id, results):
+        """
+        (levels x (1 + work centers)) array for one unit of item_id: material
+        cost in column 0, routing minutes per work center after it
+        """
+        lines = self.graph.children.get(item_id, [])
+        depth = 1 + max((len(results[component_id]) for component_id, _ in lines), default=0)
+        table = np.zeros((depth, 1 + len(self.columns)))
+        table[0, 0] = self.graph.items[item_id]['base_cost']
+        for wc_no, run_time_min in self.graph.routing.get(item_id, []):
+            table[0, self.columns[wc_no]] += run_time_min
+        for component_id, quantity in lines:
+            component = results[component_id]
+            table[1:1 + len(component)] += quantity * component
+        return table
+
+    def table(self, item_id):
+        return bottom_up(self.graph, item_id, self._compute, self.results)[item_id]
+
+    def breakdown(self, item_id):
+        """
+        Breakdown dict for one unit of item_id
+        """
+        table = self.table(item_id)
+        material = table[:, 0]
+        minutes = table[:, 1:]
+        process = minutes @ self.rates
+        wc_minutes = minutes.sum(axis=0)
+        item = self.graph.items[item_id]
+        return {
+            'item_no': item['item_no'],
+            'description': item['description'],
+            'total_cost': float(material.sum() + process.sum()),
+            'stored_total_cost': float(item['total_cost']),
+            'material_cost': float(material.sum()),
+            'process_cost': float(process.sum()),
+            'work_centers': {
+                wc_no: {'minutes': float(wc_minutes[column - 1]),
+                        'cost': float(wc_minutes[column - 1] * self.rates[column - 1])}
+                for wc_no, column in self.columns.items() if wc_minutes[column - 1]
+            },
+            'levels': [
+                {'level': level, 'material_cost': float(material[level]), 'process_cost': float(process[level])}
+                for level in range(len(table))
+            ],
+        }
+
+
+def cost_breakdowns(item_nos):
+    """
+    Breakdowns of the given items from one shared graph load. Returns
+    (item_no -> breakdown, list of item_nos that do not exist).
+    """
+    item_nos = list(dict.fromkeys(str(item_no) for item_no in item_nos))
+    graph = load_graph(item_nos, routing=True)
+    breakdowns = CostBreakdowns(graph)
+    found = {item_no: breakdowns.breakdown(graph.ids[item_no]) for item_no in item_nos if item_no in graph.ids}
+    return found, [item_no for item_no in item_nos if item_no not in found]
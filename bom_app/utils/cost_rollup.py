@@ -0,0 +1,165 @@
+from collections import defaultdict
+from django.db import connection
+from bom_app.models import Item, BOM, BOMLine, RoutingStep
+from bom_app.utils.bom_graph import where_used_cte
+from bom_app.utils.explosion_cache import invalidate_all
+
+# --- Cost roll-up engine --------------------------------------------------------
+# total_cost = base_cost + process_cost + sum(component.total_cost * quantity)
+# process_cost = sum(run_time_min * cost_per_min) over the item's routing steps
+#
+# When an item's own cost changes only the item and its ancestors (where-used
+# graph) need new totals. They are recomputed children-first and written with
+# one bulk_update.
+# ---------------------------------------------------------------------------------
+
+UPDATE_BATCH_SIZE = 500
+
+
+def _topological_order(item_ids, lines):
+    """
+    Order item_ids so every component comes before the assemblies using it.
+    lines maps parent id -> list of (component id, quantity).
+    """
+    item_ids = set(item_ids)
+    pending = {item_id: 0 for item_id in item_ids}
+    users = defaultdict(list)
+    for parent_id, components in lines.items():
+        if parent_id not in item_ids:
+            continue
+        for component_id, _ in components:
+            if component_id in item_ids:
+                pending[parent_id] += 1
+                users[component_id].append(parent_id)
+
+    order = [item_id for item_id, count in pending.items() if count == 0]
+    for item_id in order:
+        for parent_id in users[item_id]:
+            pending[parent_id] -= 1
+            if pending[parent_id] == 0:
+                order.append(parent_id)
+    if len(order) != len(item_ids):
+        raise ValueError("BOM structure contains a cycle")
+    return order
+
+
+def _compute_totals(costs, order, lines, component_totals):
+    """
+    total_cost for the items in order.
+    costs maps item id -> (base_cost, process_cost); component_totals holds the
+    stored total_cost of components outside the recomputed set.
+    """
+    totals = {}
+    for item_id in order:
+        base_cost, process_cost = costs[item_id]
+        total = base_cost + process_cost
+        for component_id, quantity in lines.get(item_id, []):
+            component_total = totals.get(component_id, component_totals.get(component_id))
+            total += component_total * quantity
+        totals[item_id] = total
+    return totals
+
+
+def _write_totals(costs, order, lines, component_totals):
+    """
+    Recompute total_cost for the items in order and bulk-update them
+    """
+    totals = _compute_totals(costs, order, lines, component_totals)
+    Item.objects.bulk_update(
+        [Item(id=item_id, total_cost=total) for item_id, total in totals.items()],
+        ['total_cost'],
+        batch_size=UPDATE_BATCH_SIZE,
+    )
+    return totals
+
+
+def rollup_costs(item_ids):
+    """
+    Recompute total_cost for the given items and all of their ancestors.
+    Returns a dict of item id -> new total_cost.
+    """
+    item_ids = list({item_id for item_id in item_ids if item_id is not None})
+    if not item_ids:
+        return {}
+
+    cte, params = where_used_cte(item_ids)
+    with connection.cursor() as cursor:
+        cursor.execute(cte + f"""
+            SELECT i.id, i.base_cost, i.process_cost
+            FROM up u JOIN {Item._meta.db_table} i ON i.id = u.item_id
+        """, params)
+        costs = {item_id: (base_cost, process_cost) for item_id, base_cost, process_cost in cursor.fetchall()}
+
+        cursor.execute(cte + f"""
+            SELECT b.parent_id, l.component_id, l.quantity, c.total_cost
+            FROM up u
+            JOIN {BOM._meta.db_table} b ON b.parent_id = u.item_id
+            JOIN {BOMLine._meta.db_table} l ON l.bom_id = b.id
+            JOIN {Item._meta.db_table} c ON c.id = l.component_id
+        """, params)
+        lines = defaultdict(list)
+        component_totals = {}
+        for parent_id, component_id, quantity, component_total in cursor.fetchall():
+            lines[parent_id].append((component_id, quantity))
+            component_totals[component_id] = component_total
+
+    order = _topological_order(costs, lines)
+    return _write_totals(costs, order, lines, component_totals)
+
+
+def rollup_all_costs():
+    """
+    Recompute total_cost for every item in the database
+    """
+    costs = {
+        item_id: (base_cost, process_cost)
+        for item_id, base_cost, process_cost in Item.objects.values_list('id', 'base_cost', 'process_cost')
+    }
+    lines = defaultdict(list)
+    for parent_id, component_id, quantity in BOMLine.objects.values_list('bom__parent_id', 'component_id', 'quantity'):
+        lines[parent_id].append((component_id, quantity))
+
+    order = _topological_order(costs, lines)
+    totals = _write_totals(costs, order, lines, {})
+    invalidate_all()
+    return totals
+
+
+def compute_total_costs(costs, lines):
+    """
+    total_cost for a complete set of items held in memory, e.g. before they
+    are inserted. costs maps item id -> (base_cost, process_cost), lines maps
+    parent id -> list of (component id, quantity).
+    """
+    return _compute_totals(costs, _topological_order(costs, lines), lines, {})
+
+
+def recalculate_process_costs(item_ids):
+    """
+    Recompute process_cost from the routing steps of the given items' BOMs.
+    Returns a dict of item id -> new process_cost.
+    """
+    item_ids = {item_id for item_id in item_ids if item_id is not None}
+    if not item_ids:
+        return {}
+
+    process_costs = dict.fromkeys(item_ids, 0.0)
+    steps = RoutingStep.objects.filter(bom__parent_id__in=item_ids).values_list(
+        'bom__parent_id', 'run_time_min', 'wc__cost_per_min'
+    )
+    for parent_id, run_time_min, cost_per_min in steps:
+        process_costs[parent_id] += run_time_min * cost_per_min
+
+    Item.objects.bulk_update(
+        [Item(id=item_id, process_cost=cost) for item_id, cost in process_costs.items()],
+        ['process_cost'],
+        batch_size=UPDATE_BATCH_SIZE,
+    )
+    return process_costs
+
+
+def items_using_work_center(wc_id):
+    """
+    Ids of items whose routing has a step at the given work center
+    """
+    return set(RoutingStep.objects.filter(wc_id=wc_id).values_list('bom__parent_id', flat=True))
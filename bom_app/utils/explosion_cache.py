@@ -0,0 +1,242 @@
+import threading
+import uuid
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+from bom_app.models import Item
+from bom_app.utils.bom_graph import where_used_cte
+from bom_app.utils.graph_snapshot import bump_graph_version, graph_version
+
+# --- BOM explosion cache ------------------------------------------------------------
+# Exploded trees and routing data are cached per item_no under a key that embeds
+# a version token of the item and a global generation token:
+#
+#   bom:<kind>:<item_no>:<params>:<generation>.<version>
+#
+# Nothing is ever deleted. When an item, its BOM, BOM lines or routing steps
+# change, the signal handlers give that item and every assembly using it a new
+# version token, so their old entries are no longer addressed and age out of the
+# cache's LRU. Work center changes and bulk rewrites (generate_data, full cost
+# roll-ups) replace the generation token, orphaning every entry at once.
+#
+# Tokens are random rather than counters, so a token evicted from the cache is
+# simply re-created and can never resurrect an old entry. The cache is the CACHES
+# alias named by BOM_EXPLOSION_CACHE["ALIAS"]; a local-memory cache is per
+# process, so deployments with several workers should point it at a shared
+# backend (file-based, Redis, memcached) for invalidation to reach every worker.
+#
+# Django cache backends pickle every value, and unpickling a large tree costs
+# milliseconds. The last LOCAL_ENTRIES results are therefore also kept unpickled
+# in a per-process LRU under the same versioned keys; a hit then only reads the
+# version tokens from the cache and the GraphVersion token from the database (one
+# single-row query, see below). Cached results are shared and must not be mutated.
+#
+# Both invalidation functions also replace the GraphVersion token in the database,
+# which tags the shared graph snapshot (bom_app/utils/graph_snapshot.py), and record
+# the new token in the cache. Changes made by other processes (another worker with
+# its own local-memory cache, generate_data, a shell) only reach the database, so
+# item_version compares the recorded token with the database's on every lookup and
+# replaces the generation token when they differ: nothing cached before a change the
+# cache did not see is ever served.
+#
+# Below whole results, subtree_memo shares the subtrees of sub-assemblies between
+# the explosions of one request (see bom_graph.shared_subtrees). For graphs cut out
+# of the snapshot, sub-assembly subtrees are also kept in a per-process LRU of
+# SUBTREE_ENTRIES entries keyed by the graph's GraphVersion token, so a sub-assembly
+# used by many products is assembled once per version rather than once per product;
+# a change replaces the token and with it every key.
+# -------------------------------------------------------------------------------------
+
+GENERATION_KEY = 'bom:generation'
+GRAPH_VERSION_KEY = 'bom:graph-version'
+
+
+def explosion_cache_settings():
+    config = getattr(settings, 'BOM_EXPLOSION_CACHE', {})
+    return config.get('ALIAS', 'bom'), config.get('ENABLED', True), config.get('LOCAL_ENTRIES', 256)
+
+
+def subtree_entries():
+    config = getattr(settings, 'BOM_EXPLOSION_CACHE', {})
+    return config.get('SUBTREE_ENTRIES', 10000) if config.get('ENABLED', True) else 0
+
+
+class LocalLRU:
+    """
+    Small thread-safe LRU mapping of unpickled results
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, max_entries):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+_local = LocalLRU()
+_subtrees = LocalLRU()
+
+
+class SubtreeMemo:
+    """
+    Memo for bom_graph.shared_subtrees: a dict for this request backed by
+    the process-wide subtree LRU
+    """
+    def __init__(self, kind, version, max_entries):
+        self.prefix = (kind, version)
+        self.max_entries = max_entries
+        self.entries = {}
+
+    def get(self, key):
+        value = self.entries.get(key)
+        if value is None:
+            value = _subtrees.get((self.prefix, key))
+            if value is not None:
+                self.entries[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self.entries[key] = value
+        _subtrees.set((self.prefix, key), value, self.max_entries)
+
+
+def subtree_memo(kind, graph):
+    """
+    Memo for the explosions of kind from graph within one request; shared
+    across requests when graph is versioned (cut out of the snapshot)
+    """
+    max_entries = subtree_entries()
+    if graph.version is None or not max_entries:
+        return {}
+    return SubtreeMemo(kind, graph.version, max_entries)
+
+
+def explosion_cache():
+    return caches[explosion_cache_settings()[0]]
+
+
+def _version_key(item_no):
+    return f"bom:version:{item_no}"
+
+
+def _new_token():
+    return uuid.uuid4().hex[:16]
+
+
+def item_version(item_no, current=None):
+    """
+    Current "<generation>.<version>" token of item_no's explosion; changes
+    whenever anything in the item's BOM subtree does. current is the
+    GraphVersion token when the caller has already read it.
+    """
+    cache = explosion_cache()
+    keys = [GENERATION_KEY, _version_key(item_no)]
+    tokens = cache.get_many([GRAPH_VERSION_KEY, *keys])
+    missing = {key: _new_token() for key in keys if key not in tokens}
+    current = graph_version() if current is None else current
+    if tokens.get(GRAPH_VERSION_KEY) != current:
+        # Changed behind the cache's back: start a new generation
+        missing[GENERATION_KEY] = _new_token()
+        missing[GRAPH_VERSION_KEY] = current
+    if missing:
+        cache.set_many(missing, timeout=None)
+        tokens.update(missing)
+    return f"{tokens[GENERATION_KEY]}.{tokens[keys[1]]}"
+
+
+def explosion_etag(kind, item_no, *params, items=Item.objects):
+    """
+    ETag value for a representation of item_no's explosion; params are
+    whatever else the representation depends on. None when item_no is not
+    in items, so a 404 carries no validator. Costs two indexed queries: the
+    existence check and the GraphVersion token read by item_version.
+    """
+    item_no = str(item_no)
+    if not items.filter(item_no=item_no).exists():
+        return None
+    return "-".join([kind, *map(str, params), item_version(item_no)])
+
+
+def cached_explosion(kind, item_no, params, load, current=None):
+    """
+    Return load() for item_no from the cache, computing and storing it on a
+    miss. params is a string of the arguments the result depends on, and
+    current the GraphVersion token if already read (see item_version).
+    The key is taken before loading, so a result computed while the item
+    changes is stored under the version that is about to be replaced.
+    """
+    _, enabled, local_entries = explosion_cache_settings()
+    if not enabled:
+        return load()
+    item_no = str(item_no)
+    key = f"bom:{kind}:{item_no}:{params}:{item_version(item_no, current)}"
+    data = _local.get(key)
+    if data is not None:
+        return data
+    cache = explosion_cache()
+    data = cache.get(key)
+    if data is None:
+        data = load()
+        cache.set(key, data, timeout=None)
+    if local_entries:
+        _local.set(key, data, local_entries)
+    return data
+
+
+def _bump_versions(item_nos, token):
+    tokens = {_version_key(item_no): _new_token() for item_no in item_nos}
+    explosion_cache().set_many({GRAPH_VERSION_KEY: token, **tokens}, timeout=None)
+
+
+def _bump_generation(token):
+    explosion_cache().set_many({GRAPH_VERSION_KEY: token, GENERATION_KEY: _new_token()}, timeout=None)
+
+
+def invalidate_items(item_ids, item_nos=()):
+    """
+    Give the given items and every assembly using them a new version.
+    item_nos are bumped as well, for items that no longer exist.
+    The versions are replaced right away and again once the transaction
+    commits, so nothing read before the commit outlives it.
+    """
+    item_ids = [item_id for item_id in set(item_ids) if item_id is not None]
+    item_nos = set(item_nos)
+    if item_ids:
+        cte, params = where_used_cte(item_ids)
+        with connection.cursor() as cursor:
+            cursor.execute(cte + f"""
+                SELECT i.item_no FROM up JOIN {Item._meta.db_table} i ON i.id = up.item_id
+            """, params)
+            item_nos.update(row[0] for row in cursor.fetchall())
+    if not item_nos:
+        return
+    token = bump_graph_version()
+    _bump_versions(item_nos, token)
+    transaction.on_commit(lambda: _bump_versions(item_nos, token))
+
+
+def invalidate_all():
+    """
+    Orphan every cached explosion, now and after the transaction commits
+    """
+    token = bump_graph_version()
+    _local.clear()
+    _subtrees.clear()
+    _bump_generation(token)
+    transaction.on_commit(lambda: _bump_generation(token))
@@ -0,0 +1,335 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from bom_app.models import Item, BOM, BOMLine, WorkCenter, RoutingStep, GraphVersion
+from bom_app.utils.bom_graph import BOMGraph
+
+# --- BOM graph snapshot ---------------------------------------------------------------
+# The whole BOM graph as flat numpy arrays, one row per item in id order:
+#
+#   item_id, item_no, description, item_type     item columns
+#   base_cost, process_cost, total_cost          float64
+#   item_no_order                                argsort of item_no, for item_no lookups
+#   has_bom                                      whether the item has a BOM
+#   child_ptr          (n + 1,)  CSR offsets: the BOM lines of row i are
+#   child_index, child_quantity  child_index[child_ptr[i]:child_ptr[i + 1]] (component
+#                                rows) and the matching quantities, in line id order
+#   step_ptr           (n + 1,)  CSR offsets of the routing steps, in step order:
+#   step_wc, step_minutes        work center rows and run_time_min
+#   wc_no, wc_cost_per_min       work centers in id order
+#
+# A snapshot is tagged with the GraphVersion token it was read at. Every change to the
+# BOM data replaces the token in the same transaction (explosion_cache.invalidate_items
+# and invalidate_all), and the next request after it builds a new snapshot, reading
+# every item, BOM line and routing step once. With BOM_GRAPH_SNAPSHOT["PATH"] set, the
+# arrays are saved there as .npy files and memory-mapped: all worker processes share
+# one copy through the page cache, and a worker finding the current version already
+# saved maps it instead of building its own.
+#
+# subgraph() cuts the part reachable from some items out of the snapshot with a
+# vectorized breadth-first walk and returns it as a BOMGraph, so the tree, routing,
+# cost breakdown and simulation code runs on it unchanged and without the recursive
+# CTE queries; only the GraphVersion token is read per request. The BOMGraph carries
+# the token as its version, which keys explosion_cache.subtree_memo.
+# -------------------------------------------------------------------------------------
+
+VERSION_ROW = 1
+
+# Bumped whenever the set or meaning of the arrays changes
+FORMAT = 1
+
+ARRAYS = (
+    'item_id', 'item_no', 'item_no_order', 'description', 'item_type',
+    'base_cost', 'process_cost', 'total_cost', 'has_bom',
+    'child_ptr', 'child_index', 'child_quantity',
+    'step_ptr', 'step_wc', 'step_minutes',
+    'wc_no', 'wc_cost_per_min',
+)
+
+
+def snapshot_settings():
+    config = getattr(settings, 'BOM_GRAPH_SNAPSHOT', {})
+    return config.get('ENABLED', False), config.get('PATH')
+
+
+def graph_version():
+    """
+    Current GraphVersion token
+    """
+    return GraphVersion.objects.filter(pk=VERSION_ROW).values_list('token', flat=True).first() or ''
+
+
+def bump_graph_version():
+    """
+    Give the BOM data a new GraphVersion token, as part of the current transaction,
+    and return it. Tokens are random, so a rolled-back change never leaves a token
+    that a later change could reuse.
+    """
+    token = uuid.uuid4().hex
+    if not GraphVersion.objects.filter(pk=VERSION_ROW).update(token=token):
+        GraphVersion.objects.create(pk=VERSION_ROW, token=token)
+    return token
+
+
+def _rows(item_id, ids):
+    return np.searchsorted(item_id, np.asarray(ids, dtype=np.int64))
+
+
+def _csr(rows, n, *columns):
+    """
+    CSR offsets for entries belonging to rows 0..n-1, and the columns
+    ordered by row (entries of one row keep their order)
+    """
+    order = np.argsort(rows, kind='stable')
+    ptr = np.zeros(n + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=n), out=ptr[1:])
+    return (ptr, *(column[order] for column in columns))
+
+
+def _ranges(ptr, rows):
+    """
+    Positions ptr[row]..ptr[row + 1]-1 of every row, concatenated
+    """
+    starts = ptr[rows]
+    counts = ptr[rows + 1] - starts
+    offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return offsets + np.arange(counts.sum(), dtype=np.int64)
+
+
+def _owners(ptr, rows, item_id):
+    """
+    Item id owning each position listed by _ranges(ptr, rows)
+    """
+    return np.repeat(item_id[rows], ptr[rows + 1] - ptr[rows])
+
+
+def _directory_name(version):
+    return f"graph-{FORMAT}-{version}"
+
+
+class GraphSnapshot:
+    """
+    Array-backed copy of the whole BOM graph, see the module comment
+    """
+    def __init__(self, version, arrays):
+        self.version = version
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    @classmethod
+    def build(cls, version):
+        """
+        Read the BOM graph from the database in five queries
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT id, item_no, description, item_type, base_cost, process_cost, total_cost
+                FROM {Item._meta.db_table} ORDER BY id
+            """)
+            items = list(zip(*cursor.fetchall())) or [()] * 7
+            cursor.execute(f"SELECT id, parent_id FROM {BOM._meta.db_table} ORDER BY id")
+            boms = list(zip(*cursor.fetchall())) or [()] * 2
+            cursor.execute(f"""
+                SELECT bom_id, component_id, quantity FROM {BOMLine._meta.db_table} ORDER BY bom_id, id
+            """)
+            lines = list(zip(*cursor.fetchall())) or [()] * 3
+            cursor.execute(f"""
+                SELECT bom_id, wc_id, run_time_min FROM {RoutingStep._meta.db_table} ORDER BY bom_id, step_no
+            """)
+            steps = list(zip(*cursor.fetchall())) or [()] * 3
+            cursor.execute(f"SELECT id, wc_no, cost_per_min FROM {WorkCenter._meta.db_table} ORDER BY id")
+            work_centers = list(zip(*cursor.fetchall())) or [()] * 3
+
+        item_id = np.array(items[0], dtype=np.int64)
+        item_no = np.array(items[1], dtype=str)
+        n = len(item_id)
+
+        # Only the first BOM of a parent is used, as in BOMGraph.load
+        bom_id = np.array(boms[0], dtype=np.int64)
+        bom_parent = _rows(item_id, boms[1])
+        _, first = np.unique(bom_parent, return_index=True)
+        bom_row = np.full(len(bom_id), -1, dtype=np.int64)
+        bom_row[first] = bom_parent[first]
+        has_bom = np.zeros(n, dtype=bool)
+        has_bom[bom_parent[first]] = True
+
+        line_parent = bom_row[np.searchsorted(bom_id, np.array(lines[0], dtype=np.int64))]
+        used = line_parent >= 0
+        child_ptr, child_index, child_quantity = _csr(
+            line_parent[used], n,
+            _rows(item_id, lines[1])[used].astype(np.int32),
+            np.array(lines[2], dtype=np.int64)[used],
+        )
+
+        wc_id = np.array(work_centers[0], dtype=np.int64)
+        step_parent = bom_row[np.searchsorted(bom_id, np.array(steps[0], dtype=np.int64))]
+        used = step_parent >= 0
+        step_ptr, step_wc, step_minutes = _csr(
+            step_parent[used], n,
+            np.searchsorted(wc_id, np.array(steps[1], dtype=np.int64))[used].astype(np.int32),
+            np.array(steps[2], dtype=np.int64)[used],
+        )
+
+        return cls(version, {
+            'item_id': item_id,
+            'item_no': item_no,
+            'item_no_order': np.argsort(item_no, kind='stable'),
+            'description': np.array(items[2], dtype=str),
+            'item_type': np.array(items[3], dtype=str),
+            'base_cost': np.array(items[4], dtype=float),
+            'process_cost': np.array(items[5], dtype=float),
+            'total_cost': np.array(items[6], dtype=float),
+            'has_bom': has_bom,
+            'child_ptr': child_ptr,
+            'child_index': child_index,
+            'child_quantity': child_quantity,
+            'step_ptr': step_ptr,
+            'step_wc': step_wc,
+            'step_minutes': step_minutes,
+            'wc_no': np.array(work_centers[1], dtype=str),
+            'wc_cost_per_min': np.array(work_centers[2], dtype=float),
+        })
+
+    def save(self, directory):
+        """
+        Write the arrays as .npy files to a new subdirectory of directory,
+        named after the version, and remove the ones of other versions.
+        Processes that still map an older version keep reading it.
+        """
+        os.makedirs(directory, exist_ok=True)
+        name = _directory_name(self.version)
+        target = os.path.join(directory, name)
+        if not os.path.isdir(target):
+            scratch = tempfile.mkdtemp(prefix='.building-', dir=directory)
+            try:
+                for array in ARRAYS:
+                    np.save(os.path.join(scratch, f"{array}.npy"), getattr(self, array))
+                os.rename(scratch, target)
+            except OSError:
+                # Another process saved the same version first
+                shutil.rmtree(scratch, ignore_errors=True)
+                if not os.path.isdir(target):
+                    raise
+        for entry in os.listdir(directory):
+            if entry.startswith(f"graph-{FORMAT}-") and entry != name:
+                shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+    @classmethod
+    def open(cls, directory, version):
+        """
+        Memory-map the snapshot saved for version, or None when there is none
+        """
+        path = os.path.join(directory, _directory_name(version))
+        try:
+            return cls(version, {
+                array: np.load(os.path.join(path, f"{array}.npy"), mmap_mode='r') for array in ARRAYS
+            })
+        except FileNotFoundError:
+            return None
+
+    def rows_of(self, item_nos):
+        """
+        Rows of the given item_nos, leaving out those that do not exist
+        """
+        keys = np.array([str(item_no) for item_no in item_nos], dtype=str)
+        if not len(keys) or not len(self.item_no):
+            return np.zeros(0, dtype=np.int64)
+        positions = np.searchsorted(self.item_no, keys, sorter=self.item_no_order)
+        rows = self.item_no_order[np.minimum(positions, len(self.item_no) - 1)]
+        return np.unique(rows[self.item_no[rows] == keys])
+
+    def subgraph(self, item_nos, routing=False):
+        """
+        BOMGraph of the items reachable from item_nos, as BOMGraph.load
+        returns it, cut out with a breadth-first walk over the CSR arrays
+        """
+        reached = np.zeros(len(self.item_id), dtype=bool)
+        frontier = self.rows_of(item_nos)
+        reached[frontier] = True
+        while len(frontier):
+            components = self.child_index[_ranges(self.child_ptr, frontier)]
+            frontier = np.unique(components[~reached[components]])
+            reached[frontier] = True
+        rows = np.flatnonzero(reached)
+
+        item_ids = self.item_id[rows].tolist()
+        items = {
+            item_id: {
+                'item_no': item_no,
+                'description': description,
+                'item_type': item_type,
+                'base_cost': base_cost,
+                'process_cost': process_cost,
+                'total_cost': total_cost,
+            }
+            for item_id, item_no, description, item_type, base_cost, process_cost, total_cost in zip(
+                item_ids, self.item_no[rows].tolist(), self.description[rows].tolist(),
+                self.item_type[rows].tolist(), self.base_cost[rows].tolist(),
+                self.process_cost[rows].tolist(), self.total_cost[rows].tolist(),
+            )
+        }
+
+        parents = rows[self.has_bom[rows]]
+        children = {item_id: [] for item_id in self.item_id[parents].tolist()}
+        lines = _ranges(self.child_ptr, parents)
+        for parent_id, component_id, quantity in zip(
+            _owners(self.child_ptr, parents, self.item_id).tolist(),
+            self.item_id[self.child_index[lines]].tolist(),
+            self.child_quantity[lines].tolist(),
+        ):
+            children[parent_id].append((component_id, quantity))
+        if not routing:
+            return BOMGraph(items, children, version=self.version)
+
+        steps = {}
+        positions = _ranges(self.step_ptr, parents)
+        for parent_id, wc_no, run_time_min in zip(
+            _owners(self.step_ptr, parents, self.item_id).tolist(),
+            self.wc_no[self.step_wc[positions]].tolist(),
+            self.step_minutes[positions].tolist(),
+        ):
+            steps.setdefault(parent_id, []).append((wc_no, run_time_min))
+        work_centers = self.wc_no.tolist()
+        cost_per_min = dict(zip(work_centers, self.wc_cost_per_min.tolist()))
+        return BOMGraph(items, children, steps, work_centers, cost_per_min, version=self.version)
+
+
+_lock = threading.Lock()
+_snapshot = None
+
+
+def graph_snapshot():
+    """
+    GraphSnapshot at the current GraphVersion: this process's copy while it
+    is current, else the one saved under PATH, else a new one built from
+    the database (and saved under PATH)
+    """
+    global _snapshot
+    version = graph_version()
+    with _lock:
+        if _snapshot is None or _snapshot.version != version:
+            _, path = snapshot_settings()
+            snapshot = GraphSnapshot.open(path, version) if path else None
+            if snapshot is None:
+                snapshot = GraphSnapshot.build(version)
+                if path:
+                    snapshot.save(path)
+                    snapshot = GraphSnapshot.open(path, version)
+            _snapshot = snapshot
+        return _snapshot
+
+
+def load_graph(item_nos, routing=False):
+    """
+    BOMGraph of the items reachable from item_nos: cut out of the shared
+    snapshot when BOM_GRAPH_SNAPSHOT is enabled, otherwise loaded from the
+    database with BOMGraph.load
+    """
+    if snapshot_settings()[0]:
+        return graph_snapshot().subgraph(item_nos, routing)
+    return BOMGraph.load(item_nos, routing=routing)
@@ -0,0 +1,131 @@
+import csv
+import io
+from bom_app.utils.bom_graph import expanded_sizes, work_center_rollup
+
+# --- Indented BOM ---------------------------------------------------------------------
+# The routing data of an item as flat rows, one per node of the expanded BOM tree in
+# depth-first order, instead of nested dicts:
+#
+#   node, parent       pre-order index of the row and of its parent row
+#   level, path        depth below the item and the item_nos from the root, "/"-joined
+#   quantity           BOM line quantity (1 for the root)
+#   extended_quantity  quantity per one root item (product of the line quantities)
+#   last_child         whether the row is the last line of its parent's BOM
+#   unit_cost          total_cost of the item
+#   extended_cost      unit_cost * extended_quantity
+#   total_time         routing minutes of the item, and per work center minutes
+#   extended_time      total_time * extended_quantity, the row's share of one root item
+#   cumulative_time    minutes to build one unit of the item including its components
+#
+# Rows are produced for a range (offset, limit) of the tree. Subtrees lying entirely
+# before the range are skipped using expanded_sizes, so late pages are cheap.
+# -------------------------------------------------------------------------------------
+
+COLUMNS = (
+    'node', 'parent', 'level', 'path', 'item_no', 'description', 'item_type', 'quantity',
+    'extended_quantity', 'last_child', 'unit_cost', 'extended_cost', 'total_time', 'extended_time',
+    'cumulative_time',
+)
+
+
+def indented_rows(graph, item_id, offset=0, limit=None, sizes=None, rollup=None):
+    """
+    Row dicts for the nodes offset <= node < offset + limit of the expanded
+    tree of item_id, from a BOMGraph loaded with routing=True. Work center
+    minutes are under 'work_centers' (only the work centers used).
+    """
+    end = float('inf') if limit is None else offset + limit
+    if offset and sizes is None:
+        sizes = expanded_sizes(graph, item_id)
+    if rollup is None:
+        rollup = work_center_rollup(graph, item_id)
+
+    def row(index, parent_index, node_id, quantity, extended_quantity, level, path, last_child):
+        item = graph.items[node_id]
+        steps = graph.routing.get(node_id, [])
+        # Later steps at the same work center overwrite earlier ones, as in assemble_routing
+        work_centers = dict(steps)
+        total_time = sum(run_time_min for _, run_time_min in steps)
+        return {
+            'node': index,
+            'parent': parent_index,
+            'level': level,
+            'path': path,
+            'item_no': item['item_no'],
+            'description': item['description'],
+            'item_type': item['item_type'],
+            'quantity': quantity,
+            'extended_quantity': extended_quantity,
+            'last_child': last_child,
+            'unit_cost': float(item['total_cost']),
+            'extended_cost': float(item['total_cost']) * extended_quantity,
+            'total_time': total_time,
+            'extended_time': total_time * extended_quantity,
+            'cumulative_time': int(rollup[node_id].sum()),
+            'work_centers': work_centers,
+        }
+
+    if end <= 0:
+        return
+    root_path = graph.items[item_id]['item_no']
+    if offset == 0:
+        yield row(0, None, item_id, 1, 1, 0, root_path, True)
+
+    index = 1
+    # (row index, BOM lines, next line position, extended quantity, level, path)
+    stack = [[0, graph.children.get(item_id, []), 0, 1, 0, root_path]]
+    while stack:
+        frame = stack[-1]
+        parent_index, lines, position, parent_quantity, level, path = frame
+        if position == len(lines):
+            stack.pop()
+            continue
+        frame[2] += 1
+        if index >= end:
+            return
+        component_id, quantity = lines[position]
+        if index < offset and index + sizes[component_id] <= offset:
+            index += sizes[component_id]
+            continue
+        extended_quantity = parent_quantity * quantity
+        child_path = f"{path}/{graph.items[component_id]['item_no']}"
+        if index >= offset:
+            yield row(index, parent_index, component_id, quantity, extended_quantity, level + 1, child_path,
+                      position == len(lines) - 1)
+        stack.append([index, graph.children.get(component_id, []), 0, extended_quantity, level + 1, child_path])
+        index += 1
+
+
+def _flat_values(row, work_centers):
+    return [row[column] for column in COLUMNS] + [row['work_centers'].get(wc_no, 0) for wc_no in work_centers]
+
+
+def columnar(rows, work_centers):
+    """
+    Column name -> list of values, one column per work center after COLUMNS
+    """
+    names = list(COLUMNS) + list(work_centers)
+    columns = {name: [] for name in names}
+    for row in rows:
+        for name, value in zip(names, _flat_values(row, work_centers)):
+            columns[name].append(value)
+    return columns
+
+
+def csv_lines(rows, work_centers):
+    """
+    CSV text, header first, one line per row
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    def take(values):
+        writer.writerow(values)
+        line = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return line
+
+    yield take(list(COLUMNS) + list(work_centers))
+    for row in rows:
+        yield take(_flat_values(row, work_centers))
@@ -0,0 +1,76 @@
+import re
+from django.db import connection
+from bom_app.models import Item
+from bom_app.utils.bom_graph import BOMGraph
+from bom_app.utils.where_used import load_where_used_graph
+
+# --- Query plans of the traversal queries -------------------------------------------
+# Captures the SQL the BOM explosion and where-used loaders run for an item and
+# returns the database's plan for each statement, to check that the composite
+# indexes are used (index-only scans on PostgreSQL, covering indexes on SQLite).
+# A statement counts as covered when no plan line reads table rows through a
+# secondary index or scans a BOM table; primary key lookups (item details) are fine.
+# -------------------------------------------------------------------------------------
+
+UNCOVERED_ACCESS = {
+    'postgresql': re.compile(
+        r"(?<!Only )Index Scan using (?!\w+_pkey)|Bitmap Heap Scan|Seq Scan on bom_app_(bom|bomline|routingstep)\b"
+    ),
+    # SQLite names tables by their alias; r / u are the recursive CTEs
+    'sqlite': re.compile(r"USING INDEX |^SCAN (?!(r|u|bom_app_workcenter)$)\w+$"),
+}
+
+
+class StatementRecorder:
+    """
+    execute_wrapper keeping the SQL and parameters of every statement
+    """
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many:
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def explain(sql, params):
+    """
+    Plan of one statement as a list of text lines
+    """
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("EXPLAIN (ANALYZE, BUFFERS) " + sql, params)
+            return [row[0] for row in cursor.fetchall()]
+        if connection.vendor == 'sqlite':
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+        cursor.execute("EXPLAIN " + sql, params)
+        return [" ".join(map(str, row)) for row in cursor.fetchall()]
+
+
+def traversal_plans(item_no):
+    """
+    {loader: [{"sql", "plan", "covered"}]} for the queries that explode
+    item_no (with routing) and load its where-used graph
+    """
+    item = Item.objects.get(item_no=item_no)
+    loaders = {
+        'explosion': lambda: BOMGraph.load([item_no], routing=True),
+        'where_used': lambda: load_where_used_graph(item.pk),
+    }
+    uncovered = UNCOVERED_ACCESS.get(connection.vendor)
+    plans = {}
+    for name, load in loaders.items():
+        recorder = StatementRecorder()
+        with connection.execute_wrapper(recorder):
+            load()
+        plans[name] = []
+        for sql, params in recorder.statements:
+            plan = explain(sql, params)
+            plans[name].append({
+                'sql': " ".join(sql.split()),
+                'plan': plan,
+                'covered': None if uncovered is None else not any(uncovered.search(line) for line in plan),
+            })
+    return plans
@@ -0,0 +1,27 @@
+import json
+from django.db import connection
+
+# --- Backend-aware IN lists --------------------------------------------------------
+# The recursive CTEs are seeded with lists of item ids or item_nos that can run to
+# tens of thousands of values (every top-level item, every item a bulk change
+# touches). Rather than one placeholder per value, which runs into SQLite's host
+# parameter limit and gives PostgreSQL a different statement text for every list
+# length, the list is bound as a single parameter:
+#
+#   postgresql  column = ANY(%s)                              list adapted to an array
+#   sqlite      column IN (SELECT value FROM json_each(%s))   list as JSON text
+#   others      column IN (%s, %s, ...)
+# -------------------------------------------------------------------------------------
+
+
+def in_values(column, values):
+    """
+    (sql, params) for the condition "column is one of values"
+    """
+    values = list(values)
+    if connection.vendor == 'postgresql':
+        return f"{column} = ANY(%s)", [values]
+    if connection.vendor == 'sqlite':
+        return f"{column} IN (SELECT value FROM json_each(%s))", [json.dumps(values)]
+    placeholders = ", ".join(["%s"] * len(values)) or "NULL"
+    return f"{column} IN ({placeholders})", values
@@ -0,0 +1,212 @@
+import math
+import random
+from collections import defaultdict
+from bom_app.models import Item, BOM, BOMLine, WorkCenter, RoutingStep
+
+# --- Synthetic catalogue profiles ---------------------------------------------------
+# Streams a catalogue of products with deep, wide and shared BOM structures as raw
+# row tuples, for benchmarking at production scale. Sub-assemblies are generated
+# bottom-up (components before the assemblies using them), so every total_cost can
+# be computed while streaming; only item id -> total_cost and a bounded pool of
+# shareable sub-assemblies are kept in memory.
+#
+#   products            number of top-level assemblies
+#   depth               (min, max) levels below each product
+#   fan_out             (min, max) BOM lines per assembly
+#   fan_out_dist        "uniform" or "geometric" (many small BOMs, a few wide ones)
+#   subassembly_ratio   chance that a BOM line beyond the first is a sub-assembly
+#   sharing             chance that a needed sub-assembly is reused from another product
+#   parts               number of purchased/manufactured parts
+#   work_centers        number of work centers
+# -------------------------------------------------------------------------------------
+
+PROFILES = {
+    "small": {
+        "products": 30, "depth": (1, 4), "fan_out": (2, 8), "fan_out_dist": "uniform",
+        "subassembly_ratio": 0.3, "sharing": 0.2, "parts": 500, "work_centers": 6,
+    },
+    "production": {
+        "products": 1000, "depth": (8, 12), "fan_out": (2, 12), "fan_out_dist": "geometric",
+        "subassembly_ratio": 0.25, "sharing": 0.2, "parts": 50000, "work_centers": 20,
+    },
+    "wide": {
+        "products": 200, "depth": (2, 3), "fan_out": (20, 200), "fan_out_dist": "geometric",
+        "subassembly_ratio": 0.02, "sharing": 0.3, "parts": 100000, "work_centers": 12,
+    },
+}
+
+FAN_OUT_DISTRIBUTIONS = ("uniform", "geometric")
+
+# Field order of the streamed tuples
+COLUMNS = {
+    WorkCenter: ("id", "wc_no", "name", "cost_per_min"),
+    Item: ("id", "item_no", "description", "item_type", "base_cost", "process_cost", "total_cost", "is_top_level"),
+    BOM: ("id", "bom_no", "parent_id", "depth", "complexity"),
+    BOMLine: ("id", "bom_id", "component_id", "quantity"),
+    RoutingStep: ("id", "routing_no", "bom_id", "wc_id", "step_no", "run_time_min"),
+}
+
+# Sub-assemblies remembered per height for reuse by later products
+SHARED_POOL_SIZE = 1000
+
+PART_CATEGORIES = [
+    ("Fastener", (0.05, 0.5)),
+    ("Electronic", (1.0, 8.0)),
+    ("Structural", (0.8, 4.0)),
+    ("Mechanical", (1.2, 6.0)),
+]
+
+
+def parse_range(value):
+    """
+    "8-12" -> (8, 12), "10" -> (10, 10)
+    """
+    low, _, high = str(value).partition('-')
+    low, high = int(low), int(high or low)
+    if low < 0 or high < low:
+        raise ValueError(f"Invalid range '{value}'")
+    return low, high
+
+
+def complexity_for_depth(depth):
+    """
+    Complexity label of a product BOM, matching the generate_data classes
+    """
+    return {1: 'simple', 2: 'moderate'}.get(depth, 'complex')
+
+
+class CatalogueGenerator:
+    """
+    Yields (model, row tuple) pairs for the catalogue described by profile;
+    tuples follow COLUMNS
+    """
+    def __init__(self, profile, seed=None):
+        self.profile = profile
+        self.rng = random.Random(seed)
+        self.next_ids = defaultdict(lambda: 1)
+        self.totals = {}
+        self.shared = defaultdict(list)
+        self.work_centers = []
+
+    def _new_id(self, model):
+        new_id = self.next_ids[model]
+        self.next_ids[model] += 1
+        return new_id
+
+    def _fan_out(self):
+        low, high = self.profile["fan_out"]
+        if self.profile["fan_out_dist"] == "uniform" or low == high:
+            return self.rng.randint(low, high)
+        # Geometric tail above the minimum, mean at the middle of the range
+        p = 1 / ((high - low) / 2 + 1)
+        extra = int(math.log(1 - self.rng.random()) / math.log(1 - p))
+        return min(low + extra, high)
+
+    def _routing(self, bom_id, bom_no, n_steps, run_time):
+        """
+        Routing steps at distinct work centers; returns (rows, process_cost)
+        """
+        rows = []
+        process_cost = 0.0
+        for step_no, (wc_id, cost_per_min) in enumerate(self.rng.sample(self.work_centers, n_steps), start=1):
+            run_time_min = self.rng.randint(*run_time)
+            rows.append((RoutingStep, (self._new_id(RoutingStep), f"RT_{bom_no}", bom_id, wc_id, step_no, run_time_min)))
+            process_cost += run_time_min * cost_per_min
+        return rows, process_cost
+
+    def rows(self):
+        yield from self._work_centers()
+        yield from self._parts()
+        low, high = self.profile["depth"]
+        for _ in range(self.profile["products"]):
+            depth = self.rng.randint(max(low, 1), max(high, 1))
+            yield from self._assembly(depth, level=0, complexity=complexity_for_depth(depth))
+
+    def _work_centers(self):
+        for n in range(1, self.profile["work_centers"] + 1):
+            wc_id = self._new_id(WorkCenter)
+            cost_per_min = round(self.rng.uniform(0.1, 0.5), 2)
+            self.work_centers.append((wc_id, cost_per_min))
+            yield WorkCenter, (wc_id, f"WC{n:03d}", f"Work center {n}", cost_per_min)
+
+    def _parts(self):
+        for n in range(1, self.profile["parts"] + 1):
+            item_id = self._new_id(Item)
+            name, cost_range = self.rng.choice(PART_CATEGORIES)
+            base_cost = self.rng.uniform(*cost_range)
+            process_cost = 0.0
+            # 80% of parts are manufactured and get a routing
+            if self.rng.random() < 0.8:
+                bom_id = self._new_id(BOM)
+                bom_no = f"MFG_P{n:07d}"
+                yield BOM, (bom_id, bom_no, item_id, 0, 'part')
+                steps, process_cost = self._routing(
+                    bom_id, bom_no, self.rng.randint(1, min(3, len(self.work_centers))), (3, 15)
+                )
+                yield from steps
+            self.totals[item_id] = base_cost + process_cost
+            yield Item, (item_id, f"P{n:07d}", f"{name} {n:07d}", 'P', base_cost, process_cost,
+                         self.totals[item_id], False)
+
+    def _component_assembly(self, height, level, complexity, used):
+        """
+        A sub-assembly of the given height: shared from an earlier product
+        when possible, otherwise generated (yielding its rows). Returns its id.
+        """
+        pool = self.shared[height]
+        if pool and self.rng.random() < self.profile["sharing"]:
+            item_id = self.rng.choice(pool)
+            if item_id not in used:
+                return item_id
+
+        item_id = yield from self._assembly(height, level, complexity)
+        if len(pool) < SHARED_POOL_SIZE:
+            pool.append(item_id)
+        else:
+            pool[self.rng.randrange(SHARED_POOL_SIZE)] = item_id
+        return item_id
+
+    def _assembly(self, height, level, complexity):
+        """
+        Generate an assembly whose BOM reaches `height` levels down, components
+        first. BOMs are labelled with the complexity of the product they were
+        generated for. Returns the new item id.
+        """
+        item_id = self._new_id(Item)
+        bom_id = self._new_id(BOM)
+        item_no = f"A{item_id:07d}"
+        bom_no = f"BOM_{item_no}"
+
+        # One line always continues down to the full height
+        n_lines = max(self._fan_out(), 1)
+        heights = [height - 1] + [
+            self.rng.randint(1, height - 1) if height > 1 and self.rng.random() < self.profile["subassembly_ratio"] else 0
+            for _ in range(n_lines - 1)
+        ]
+        components = []
+        used = set()
+        for component_height in heights:
+            if component_height > 0:
+                component_id = yield from self._component_assembly(component_height, level + 1, complexity, used)
+                quantity = self.rng.randint(1, 5)
+            else:
+                component_id = self.rng.randint(1, self.profile["parts"])
+                quantity = self.rng.randint(1, 10)
+            if component_id not in used:
+                used.add(component_id)
+                components.append((component_id, quantity))
+
+        yield BOM, (bom_id, bom_no, item_id, level, complexity)
+        component_cost = 0.0
+        for component_id, quantity in components:
+            yield BOMLine, (self._new_id(BOMLine), bom_id, component_id, quantity)
+            component_cost += self.totals[component_id] * quantity
+
+        steps, process_cost = self._routing(bom_id, bom_no, self.rng.randint(1, min(4, len(self.work_centers))), (5, 40))
+        yield from steps
+
+        base_cost = self.rng.uniform(2, 10)
+        self.totals[item_id] = base_cost + process_cost + component_cost
+        yield Item, (item_id, item_no, f"Assembly {item_no}", 'A', base_cost, process_cost,
+                     self.totals[item_id], level == 0)
+        return item_id
@@ -0,0 +1,49 @@
+from django.db.models import Case, When, Value, Exists, OuterRef, Q
+from bom_app.models import Item, BOM, BOMLine
+
+# --- Top-level assembly index -------------------------------------------------
+# An item is top-level when it is an assembly with a BOM that is not used as
+# a component in any BOM line. The flag is stored on Item.is_top_level so
+# picking a top-level item is an indexed lookup instead of a set difference.
+# -------------------------------------------------------------------------------
+
+
+def _top_level_flag():
+    """
+    Conditional expression evaluating the top-level rule for each Item row
+    """
+    has_bom = Exists(BOM.objects.filter(parent=OuterRef('pk')))
+    is_component = Exists(BOMLine.objects.filter(component=OuterRef('pk')))
+    return Case(
+        When(Q(item_type='A') & has_bom & ~is_component, then=Value(True)),
+        default=Value(False),
+    )
+
+
+def refresh_top_level(item_ids):
+    """
+    Recompute the top-level flag for the given item ids
+    """
+    item_ids = [item_id for item_id in set(item_ids) if item_id is not None]
+    if item_ids:
+        Item.objects.filter(id__in=item_ids).update(is_top_level=_top_level_flag())
+
+
+def rebuild_top_level_index():
+    """
+    Recompute the top-level flag for every item. Returns the number of
+    top-level items.
+    """
+    Item.objects.update(is_top_level=_top_level_flag())
+    return Item.objects.filter(is_top_level=True).count()
+
+
+def top_level_items(complexity=None):
+    """
+    Queryset of top-level assemblies, optionally limited to those whose BOM
+    has the given complexity
+    """
+    items = Item.objects.filter(is_top_level=True)
+    if complexity is not None:
+        items = items.filter(booms__complexity=complexity).distinct()
+    return items
@@ -0,0 +1,111 @@
+from collections import defaultdict
+from django.db import connection
+from bom_app.models import Item, BOM, BOMLine
+from bom_app.utils.bom_graph import where_used_cte
+
+# --- Where-used (reverse) explosion ---------------------------------------------
+# Walks BOMLine.component upwards from one item to every top-level assembly
+# that contains it. The upward subgraph is loaded with one recursive CTE.
+# ---------------------------------------------------------------------------------
+
+
+def load_where_used_graph(item_id):
+    """
+    Load the upward subgraph of item_id in two queries. Lines are read
+    per component through bomline_where_used_idx, in BOM line order.
+    Returns (items, users) where items maps item id -> (item_no, description)
+    and users maps component id -> list of (parent id, quantity).
+    """
+    cte, params = where_used_cte([item_id])
+    with connection.cursor() as cursor:
+        cursor.execute(cte + f"""
+            SELECT i.id, i.item_no, i.description
+            FROM up u JOIN {Item._meta.db_table} i ON i.id = u.item_id
+        """, params)
+        items = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+
+        cursor.execute(cte + f"""
+            SELECT l.component_id, b.parent_id, l.quantity
+            FROM up u
+            JOIN {BOMLine._meta.db_table} l ON l.component_id = u.item_id
+            JOIN {BOM._meta.db_table} b ON b.id = l.bom_id
+            ORDER BY u.item_id, l.id
+        """, params)
+        users = defaultdict(list)
+        for component_id, parent_id, quantity in cursor.fetchall():
+            users[component_id].append((parent_id, quantity))
+    return items, users
+
+
+def where_used(item, max_paths=100):
+    """
+    Find every top-level assembly that uses item, directly or through
+    sub-assemblies. For each one the total extended quantity (units of item
+    per unit of the assembly) is returned together with up to max_paths
+    individual paths, listed from the assembly down to item. Raises
+    ValueError when the BOM above item contains a cycle.
+    """
+    items, users = load_where_used_graph(item.pk)
+
+    # Ancestors ordered children-first (reversed DFS post-order), so each
+    # extended quantity is final before it is pushed further up. Shared
+    # sub-assemblies are therefore only expanded once.
+    order = []
+    seen = set()
+    on_path = set()
+
+    def visit(item_id):
+        seen.add(item_id)
+        on_path.add(item_id)
+        for parent_id, _ in users.get(item_id, []):
+            if parent_id in on_path:
+                raise ValueError("BOM structure contains a cycle")
+            if parent_id not in seen:
+                visit(parent_id)
+        on_path.discard(item_id)
+        order.append(item_id)
+
+    visit(item.pk)
+    order.reverse()
+
+    quantities = defaultdict(int)
+    quantities[item.pk] = 1
+    for item_id in order:
+        for parent_id, quantity in users.get(item_id, []):
+            quantities[parent_id] += quantities[item_id] * quantity
+
+    top_level_ids = [item_id for item_id in order if item_id != item.pk and not users.get(item_id)]
+
+    # Enumerate individual paths depth-first, stopping at max_paths
+    paths = defaultdict(list)
+    path_count = 0
+    truncated = False
+    stack = [(item.pk, [item.pk], 1)]
+    while stack:
+        item_id, path, quantity = stack.pop()
+        if not users.get(item_id):
+            if item_id == item.pk:
+                continue
+            if path_count >= max_paths:
+                truncated = True
+                break
+            paths[item_id].append({
+                'path': [items[path_id][0] for path_id in reversed(path)],
+                'quantity': quantity,
+            })
+            path_count += 1
+            continue
+        for parent_id, line_quantity in reversed(users[item_id]):
+            stack.append((parent_id, path + [parent_id], quantity * line_quantity))
+
+    return {
+        'item_no': item.item_no,
+        'description': item.description,
+        'top_level': [{
+            'item_no': items[top_id][0],
+            'description': items[top_id][1],
+            'total_quantity': quantities[top_id],
+            'paths': paths.get(top_id, []),
+        } for top_id in sorted(top_level_ids, key=lambda top_id: items[top_id][0])],
+        'truncated': truncated,
+    }
@@ -1,53 +1,97 @@
 # views.py
+from django.views.decorators.cache import cache_control
+from django.http import StreamingHttpResponse, JsonResponse
+from django.views.decorators.http import condition, require_GET
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from .models import Item, BOM, BOMLine, WorkCenter, RoutingStep
-from .serializers import BOMTreeSerializer
+from .models import Item, BOM, WorkCenter
+from .serializers import BOMTreeSerializer, CostBreakdownRequestSerializer, BOMBatchRequestSerializer
+from .utils.bom_graph import (
+    assemble_tree, assemble_routing, expanded_sizes, work_center_rollup, normalized_explosion,
+)
+from .utils.bom_stream import stream_tree_json, stream_ndjson
+from .utils.indented_bom import indented_rows, columnar, csv_lines
+from .utils.cost_breakdown import cost_breakdowns
+from .utils.top_level_index import top_level_items
+from .utils.where_used import where_used
+from .utils.explosion_cache import cached_explosion, explosion_etag, subtree_memo
+from .utils.graph_snapshot import load_graph, graph_version
 from django.shortcuts import render
 import random
 
-def build_tree(item_no, level=0, max_nodes=200):
-    data = {
-        'item_no': item_no,
-        'description': Item.objects.get(item_no=item_no).description,
-        'cost': float(Item.objects.get(item_no=item_no).total_cost),
-        'level': level,
-        'children': []
-    }
-    try:
-        bom = BOM.objects.get(parent__item_no=item_no)
-    except BOM.DoesNotExist:
-        return data
-    for line in bom.lines.all():
-        if len(data['children'])<max_nodes:
-            data['children'].append(
-                build_tree(line.component.item_no, level+1, max_nodes)
-            )
-    return data
-
-def retrieve_top_level_item(complexity):
+def build_tree(item_no, level=0, limit=None):
     """
-    Retrieves a random top-level BOM of the specified complexity
+    Build the nested BOM tree for item_no.
+    The whole reachable subgraph is loaded up front, so the query count
+    does not grow with the depth or size of the BOM. With limit only the
+    first `limit` nodes in depth-first order are returned (see
+    bom_tree_stream for paging). Results are cached until something in
+    the subtree changes and must not be modified; shared sub-assemblies
+    are built once (see subtree_memo).
     """
-    # Find all assemblies that are parents in BOMs of the specified complexity
-    parent_assemblies = BOM.objects.filter(
-        complexity=complexity, 
-        parent__item_type='A'
-    ).values_list('parent__item_no', flat=True)
-    
-    # Find assemblies that appear as components in other BOMs
-    sub_assemblies = BOMLine.objects.filter(
-        component__item_type='A'
-    ).values_list('component__item_no', flat=True)
-    
-    # Get only top-level assemblies (those that aren't components in other BOMs)
-    top_level_item_nos = set(parent_assemblies) - set(sub_assemblies)
-    
+    def load():
+        graph = load_graph([item_no])
+        if item_no not in graph.ids:
+            raise Item.DoesNotExist(f"Item {item_no} does not exist")
+        return assemble_tree(graph, graph.ids[item_no], level, limit, subtree_memo('tree', graph))
+    return cached_explosion('tree', item_no, f"{level}-{limit}", load)
+
+def build_trees(item_nos):
+    """
+    build_tree for several items. Trees that are not cached are built from
+    one shared load of the BOMs of all the items, sharing the subtrees of
+    the sub-assemblies they have in common.
+    Returns ({item_no: tree}, list of item_nos that do not exist).
+    """
+    item_nos = list(dict.fromkeys(str(item_no) for item_no in item_nos))
+    graph = None
+    memo = None
+
+    def load(item_no):
+        nonlocal graph, memo
+        if graph is None:
+            graph = load_graph(item_nos)
+            memo = subtree_memo('tree', graph)
+        if item_no not in graph.ids:
+            raise Item.DoesNotExist(f"Item {item_no} does not exist")
+        return assemble_tree(graph, graph.ids[item_no], memo=memo)
+
+    trees = {}
+    missing = []
+    current = graph_version()
+    for item_no in item_nos:
+        try:
+            trees[item_no] = cached_explosion('tree', item_no, "0-None", lambda: load(item_no), current)
+        except Item.DoesNotExist:
+            missing.append(item_no)
+    return trees, missing
+
+def normalized_trees(item_nos):
+    """
+    The BOM trees of several items as one node table and one edge table
+    (see normalized_explosion), from one shared load of their BOMs.
+    Returns (explosion with the existing item_nos as "roots", missing item_nos).
+    """
+    item_nos = list(dict.fromkeys(str(item_no) for item_no in item_nos))
+    graph = load_graph(item_nos)
+    roots = [item_no for item_no in item_nos if item_no in graph.ids]
+    explosion = normalized_explosion(graph, [graph.ids[item_no] for item_no in roots])
+    return {'roots': roots, **explosion}, [item_no for item_no in item_nos if item_no not in graph.ids]
+
+def retrieve_top_level_item(complexity, rng=None):
+    """
+    Retrieves a random top-level BOM of the specified complexity.
+    Pass a numpy Generator as rng to make the pick reproducible.
+    """
+    top_level_item_nos = list(top_level_items(complexity).order_by('item_no').values_list('item_no', flat=True))
+
     if not top_level_item_nos:
         return None
     
     # Pick a random top-level assembly
-    chosen_item_no = random.choice(list(top_level_item_nos))
+    if rng is not None:
+        return top_level_item_nos[rng.integers(len(top_level_item_nos))]
+    chosen_item_no = random.choice(top_level_item_nos)
     return chosen_item_no
 
 @api_view(['GET'])
@@ -63,6 +107,156 @@ def bom_tree(request, complexity):
     tree = build_tree(bom.parent.item_no)
     return Response(tree)
 
+@cache_control(no_cache=True)
+@condition(etag_func=lambda request, item_no: explosion_etag('tree', item_no))
+@api_view(['GET'])
+def bom_tree_for_item(request, item_no):
+    """
+    BOM tree of the given item. The ETag changes whenever anything in the
+    item's BOM does, so clients can revalidate with If-None-Match.
+    """
+    try:
+        return Response(build_tree(item_no))
+    except Item.DoesNotExist:
+        return Response({"error": f"Item '{item_no}' not found"}, status=404)
+
+STREAM_FORMATS = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+}
+
+def _range_params(request, default_limit=None, max_limit=None):
+    """
+    (offset, limit) row range of a request; raises ValueError
+    """
+    try:
+        offset = int(request.GET.get('offset', 0))
+        limit = request.GET.get('limit')
+        limit = default_limit if limit in (None, '') else int(limit)
+    except ValueError:
+        raise ValueError("offset and limit must be integers")
+    if offset < 0 or (limit is not None and limit < 0):
+        raise ValueError("offset and limit must not be negative")
+    if max_limit is not None and limit > max_limit:
+        raise ValueError(f"limit must not exceed {max_limit}")
+    return offset, limit
+
+def _stream_params(request):
+    """
+    (format, offset, limit) of a streaming request; raises ValueError
+    """
+    fmt = request.GET.get('format', 'json')
+    if fmt not in STREAM_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(STREAM_FORMATS)}")
+    offset, limit = _range_params(request)
+    if offset and fmt == 'json':
+        raise ValueError("offset needs format=ndjson; the nested document always starts at the root")
+    return fmt, offset, limit
+
+def _stream_etag(request, item_no):
+    try:
+        params = _stream_params(request)
+    except ValueError:
+        return None
+    return explosion_etag('tree-stream', item_no, *params)
+
+@cache_control(no_cache=True)
+@condition(etag_func=_stream_etag)
+@require_GET
+def bom_tree_stream(request, item_no):
+    """
+    Streams the BOM tree of the given item without building it in memory.
+    ?format=json (default) writes the nested build_tree document,
+    ?format=ndjson one row per node with parent references.
+    ?limit=N returns at most N nodes in depth-first order and, for ndjson,
+    ?offset=M starts at node M. X-Total-Nodes gives the size of the whole
+    tree and X-Next-Offset, when present, the offset of the next page.
+    """
+    try:
+        fmt, offset, limit = _stream_params(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    graph = load_graph([item_no])
+    if item_no not in graph.ids:
+        return JsonResponse({"error": f"Item '{item_no}' not found"}, status=404)
+    item_id = graph.ids[item_no]
+    sizes = expanded_sizes(graph, item_id)
+    total = sizes[item_id]
+
+    if fmt == 'ndjson':
+        content = stream_ndjson(graph, item_id, offset, limit, sizes)
+    else:
+        content = stream_tree_json(graph, item_id, limit)
+    response = StreamingHttpResponse(content, content_type=STREAM_FORMATS[fmt])
+    response['X-Total-Nodes'] = total
+    if limit is not None and offset + limit < total:
+        response['X-Next-Offset'] = offset + limit
+    return response
+
+@cache_control(no_cache=True)
+@condition(etag_func=lambda request, item_no: explosion_etag('cost-breakdown', item_no))
+@api_view(['GET'])
+def item_cost_breakdown(request, item_no):
+    """
+    Cost of one unit of the given item split into material cost, process
+    cost per work center and cost per BOM level
+    """
+    def load():
+        found, missing = cost_breakdowns([item_no])
+        if missing:
+            raise Item.DoesNotExist(f"Item {item_no} does not exist")
+        return found[item_no]
+    try:
+        return Response(cached_explosion('cost-breakdown', item_no, '', load))
+    except Item.DoesNotExist:
+        return Response({"error": f"Item '{item_no}' not found"}, status=404)
+
+@api_view(['POST'])
+def cost_breakdown_batch(request):
+    """
+    Cost breakdowns of up to 500 items ({"item_nos": [...]}), computed
+    from one shared load of their BOMs
+    """
+    serializer = CostBreakdownRequestSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    found, missing = cost_breakdowns(serializer.validated_data['item_nos'])
+    return Response({'breakdowns': found, 'missing': missing})
+
+@api_view(['POST'])
+def bom_tree_batch(request):
+    """
+    BOM trees of up to 500 items ({"item_nos": [...]}) in one request.
+    "format": "nested" (default) returns {"trees": {item_no: tree}},
+    "normalized" returns each distinct item once in "nodes" and each BOM
+    line once in "edges", so shared sub-assemblies are not repeated.
+    """
+    serializer = BOMBatchRequestSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    item_nos = serializer.validated_data['item_nos']
+    if serializer.validated_data['format'] == 'normalized':
+        explosion, missing = normalized_trees(item_nos)
+        return Response({**explosion, 'missing': missing})
+    trees, missing = build_trees(item_nos)
+    return Response({'trees': trees, 'missing': missing})
+
+@api_view(['GET'])
+def item_where_used(request, item_no):
+    """
+    Lists every top-level assembly that uses the given item, with the paths
+    through the BOM and the extended quantities
+    """
+    try:
+        item = Item.objects.get(item_no=item_no)
+    except Item.DoesNotExist:
+        return Response({"error": f"Item '{item_no}' not found"}, status=404)
+    try:
+        max_paths = int(request.GET.get('max_paths', 100))
+    except ValueError:
+        return Response({"error": "max_paths must be an integer"}, status=400)
+
+    return Response(where_used(item, max_paths=max_paths))
+
 def tree_view(request):
     template = "bom_app/index.html"
     context = {
@@ -71,141 +265,170 @@ def tree_view(request):
     }
     return render(request, template, context)
 
-def collect_routing_data_alternative(item_no, level=0, max_nodes=200):
+def _load_routing(item_no, level, limit, wrap_children):
+    item_no = str(item_no)
+    def load():
+        graph = load_graph([item_no], routing=True)
+        if item_no not in graph.ids:
+            raise Item.DoesNotExist(f"Item {item_no} does not exist")
+        return assemble_routing(graph, graph.ids[item_no], level, limit, wrap_children, subtree_memo(kind, graph))
+    kind = 'routing-wrapped' if wrap_children else 'routing'
+    return cached_explosion(kind, item_no, f"{level}-{limit}", load)
+
+def collect_routing_data_alternative(item_no, level=0, limit=None):
     """
-    Recursively collect routing data for a BOM and its components
+    Collect routing data for a BOM and its components, wrapping each child
+    as {'quantity': ..., 'component': ...}
     """
-    item = Item.objects.get(item_no=item_no)
-    
-    # Initialize data structure
-    data = {
-        'item_no': item_no,
-        'description': item.description,
-        'item_type': item.item_type,
-        'level': level,
-        'work_centers': {},
-        'total_time': 0,
-        'children': []
-    }
-    
-    try:
-        bom = BOM.objects.get(parent__item_no=item_no)
-        # Get all work centers
-        work_centers = WorkCenter.objects.all()
-        
-        # Initialize work center times to 0
-        for wc in work_centers:
-            data['work_centers'][wc.wc_no] = 0
-        
-        # Get routing steps for this BOM
-        routing_steps = RoutingStep.objects.filter(bom=bom)
-        
-        # Populate work center times
-        for step in routing_steps:
-            data['work_centers'][step.wc.wc_no] = step.run_time_min
-            data['total_time'] += step.run_time_min
-        
-        # Recursively process children
-        for line in bom.lines.all():
-            
-            if len(data['children']) < max_nodes:
-                data['children'].append({'quantity': line.quantity,
-                    'component': collect_routing_data_alternative(
-                        line.component.item_no, level+1, max_nodes
-                    )})
-    except BOM.DoesNotExist:
-        # For parts without BOMs, just return the basic data
-        pass
-    
-    return data
+    return _load_routing(item_no, level, limit, wrap_children=True)
 
 
-def collect_routing_data(item_no, level=0, max_nodes=200):
+def collect_routing_data(item_no, level=0, limit=None):
     """
-    Recursively collect routing data for a BOM and its components
+    Collect routing data for a BOM and its components.
+    Routing steps for the whole subtree are loaded in one pass.
     """
-    item = Item.objects.get(item_no=item_no)
-    
-    # Initialize data structure
-    data = {
-        'item_no': item_no,
-        'description': item.description,
-        'item_type': item.item_type,
-        'level': level,
-        'work_centers': {},
-        'total_time': 0,
-        'children': []
-    }
-    
-    try:
-        bom = BOM.objects.get(parent__item_no=item_no)
-        # Get all work centers
-        work_centers = WorkCenter.objects.all()
-        
-        # Initialize work center times to 0
-        for wc in work_centers:
-            data['work_centers'][wc.wc_no] = 0
-        
-        # Get routing steps for this BOM
-        routing_steps = RoutingStep.objects.filter(bom=bom)
-        
-        # Populate work center times
-        for step in routing_steps:
-            data['work_centers'][step.wc.wc_no] = step.run_time_min
-            data['total_time'] += step.run_time_min
-        
-        # Recursively process children
-        for line in bom.lines.all():
-
-            if len(data['children']) < max_nodes:
-                data['children'].append(
-                    collect_routing_data(line.component.item_no, level+1, max_nodes)
-                )
-    except BOM.DoesNotExist:
-        # For parts without BOMs, just return the basic data
-        pass
-    
-    return data
+    return _load_routing(item_no, level, limit, wrap_children=False)
 
 @api_view(['GET'])
 def bom_routing_table(request, complexity):
     """
     API endpoint to get routing data for a top-level BOM of the specified complexity
     """
-    # Find all assemblies that are parents in BOMs of the specified complexity
-    parent_assemblies = BOM.objects.filter(
-        complexity=complexity, 
-        parent__item_type='A'
-    ).values_list('parent__item_no', flat=True)
-    
-    # Find assemblies that appear as components in other BOMs
-    sub_assemblies = BOMLine.objects.filter(
-        component__item_type='A'
-    ).values_list('component__item_no', flat=True)
-    
-    # Get only top-level assemblies (those that aren't components in other BOMs)
-    top_level_item_nos = set(parent_assemblies) - set(sub_assemblies)
-    
-    if not top_level_item_nos:
+    chosen_item_no = retrieve_top_level_item(complexity)
+    if not chosen_item_no:
         return Response({"error": f"No top-level assemblies found with complexity '{complexity}'"}, status=404)
     
-    # Pick a random top-level assembly
-    chosen_item_no = random.choice(list(top_level_item_nos))
     bom = BOM.objects.get(parent__item_no=chosen_item_no)
-    
+    return Response(routing_table(bom.parent.item_no))
+
+@cache_control(no_cache=True)
+@condition(etag_func=lambda request, item_no: explosion_etag('routing', item_no))
+@api_view(['GET'])
+def bom_routing_table_for_item(request, item_no):
+    """
+    Routing data of the given item, with ETag / If-None-Match support
+    """
+    try:
+        return Response(routing_table(item_no))
+    except Item.DoesNotExist:
+        return Response({"error": f"Item '{item_no}' not found"}, status=404)
+
+def routing_table(item_no):
+    """
+    Work center column headers and routing data of item_no
+    """
+    routing_data = collect_routing_data(item_no)
+
     # Get all work centers for column headers
     work_centers = WorkCenter.objects.all().order_by('wc_no')
-    
-    # Get routing data
-    routing_data = collect_routing_data(bom.parent.item_no)
-    
-    # Prepare response
-    response = {
+
+    return {
         'work_centers': [{'wc_no': wc.wc_no, 'name': wc.name} for wc in work_centers],
         'routing_data': routing_data
     }
-    
-    return Response(response)
+
+INDENTED_FORMATS = ('json', 'columns', 'csv')
+INDENTED_PAGE_SIZE = 1000
+INDENTED_MAX_PAGE_SIZE = 100000
+
+def _indented_params(request):
+    """
+    (format, offset, limit) of an indented BOM request; raises ValueError
+    """
+    fmt = request.GET.get('format', 'json')
+    if fmt not in INDENTED_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(INDENTED_FORMATS)}")
+    return (fmt, *_range_params(request, INDENTED_PAGE_SIZE, INDENTED_MAX_PAGE_SIZE))
+
+def _load_indented(item_no):
+    graph = load_graph([item_no], routing=True)
+    if item_no not in graph.ids:
+        raise Item.DoesNotExist(f"Item {item_no} does not exist")
+    item_id = graph.ids[item_no]
+    work_centers = list(WorkCenter.objects.order_by('wc_no').values_list('wc_no', 'name'))
+    return graph, item_id, work_centers, expanded_sizes(graph, item_id), work_center_rollup(graph, item_id)
+
+def indented_bom(item_no, offset=0, limit=INDENTED_PAGE_SIZE, columns=False):
+    """
+    One page of the indented BOM of item_no: the rows offset <= node <
+    offset + limit, as row dicts or (columns=True) as column lists
+    """
+    item_no = str(item_no)
+    def load():
+        graph, item_id, work_centers, sizes, rollup = _load_indented(item_no)
+        rows = indented_rows(graph, item_id, offset, limit, sizes, rollup)
+        total = sizes[item_id]
+        item = graph.items[item_id]
+        # Workload of one finished item, over the whole tree rather than the page
+        minutes = dict(zip(graph.work_centers, rollup[item_id].tolist()))
+        page = {
+            'item_no': item_no,
+            'description': item['description'],
+            'work_centers': [{'wc_no': wc_no, 'name': name} for wc_no, name in work_centers],
+            'cumulative_work_centers': {wc_no: minutes.get(wc_no, 0) for wc_no, _ in work_centers},
+            'total_rows': total,
+            'offset': offset,
+            'limit': limit,
+            'next_offset': offset + limit if offset + limit < total else None,
+        }
+        if columns:
+            page['columns'] = columnar(rows, [wc_no for wc_no, _ in work_centers])
+        else:
+            page['rows'] = list(rows)
+        return page
+    kind = 'indented-columns' if columns else 'indented'
+    return cached_explosion(kind, item_no, f"{offset}-{limit}", load)
+
+def _indented_response(request, item_no):
+    try:
+        fmt, offset, limit = _indented_params(request)
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    try:
+        if fmt != 'csv':
+            return JsonResponse(indented_bom(item_no, offset, limit, columns=fmt == 'columns'))
+        graph, item_id, work_centers, sizes, rollup = _load_indented(item_no)
+    except Item.DoesNotExist:
+        return JsonResponse({"error": f"Item '{item_no}' not found"}, status=404)
+
+    rows = indented_rows(graph, item_id, offset, limit, sizes, rollup)
+    response = StreamingHttpResponse(csv_lines(rows, [wc_no for wc_no, _ in work_centers]), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{item_no}_indented_bom.csv"'
+    response['X-Total-Rows'] = sizes[item_id]
+    if offset + limit < sizes[item_id]:
+        response['X-Next-Offset'] = offset + limit
+    return response
+
+def _indented_etag(request, item_no):
+    try:
+        params = _indented_params(request)
+    except ValueError:
+        return None
+    return explosion_etag('indented', item_no, *params)
+
+@cache_control(no_cache=True)
+@condition(etag_func=_indented_etag)
+@require_GET
+def bom_routing_indented_for_item(request, item_no):
+    """
+    Routing data of the given item as an indented BOM: one row per node
+    with level, path, extended quantity, cost and work center minutes.
+    ?format=json (default, row objects), columns (column lists) or csv;
+    ?offset / ?limit select the row range (default INDENTED_PAGE_SIZE rows).
+    """
+    return _indented_response(request, item_no)
+
+@require_GET
+def bom_routing_indented(request, complexity):
+    """
+    Indented BOM of a random top-level assembly of the specified complexity
+    """
+    chosen_item_no = retrieve_top_level_item(complexity)
+    if not chosen_item_no:
+        return JsonResponse({"error": f"No top-level assemblies found with complexity '{complexity}'"}, status=404)
+    return _indented_response(request, chosen_item_no)
 
 def routing_table_view(request):
     """
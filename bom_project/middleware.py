@@ -0,0 +1,202 @@
+import random
+import threading
+import time
+from contextlib import ExitStack
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse
+
+# --- Request instrumentation --------------------------------------------------------
+# For a sample of requests, records per view (URL route):
+#   db             time spent executing SQL, and the number of queries
+#   serialization  time spent rendering template / DRF responses (excluding SQL)
+#   python         the rest of the request
+# The numbers are returned in a Server-Timing header and aggregated in-process for
+# the Prometheus text endpoint served by metrics_view. Configured with
+#
+#   REQUEST_INSTRUMENTATION = {
+#       "SAMPLE_RATE": 0.01,     # fraction of requests instrumented
+#       "SERVER_TIMING": True,   # add the Server-Timing header
+#   }
+#
+# Metrics are per process; with several workers each one reports its own.
+# -------------------------------------------------------------------------------------
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class RequestStats:
+    """
+    Timings of one request; also the execute_wrapper counting its queries
+    """
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db_time = 0.0
+        self.render_start = None
+        self.render_db_time = 0.0
+        self.serialization_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_time += time.perf_counter() - start
+            self.queries += 1
+
+    def start_render(self):
+        self.render_start = time.perf_counter()
+        self.render_db_time = self.db_time
+
+    def end_render(self, response):
+        if self.render_start is not None:
+            render_time = time.perf_counter() - self.render_start
+            self.serialization_time += render_time - (self.db_time - self.render_db_time)
+            self.render_start = None
+
+    def finish(self):
+        self.total_time = time.perf_counter() - self.start
+        self.python_time = max(self.total_time - self.db_time - self.serialization_time, 0.0)
+
+    def server_timing(self):
+        return ", ".join([
+            f'db;dur={self.db_time * 1000:.2f};desc="{self.queries} queries"',
+            f"serialization;dur={self.serialization_time * 1000:.2f}",
+            f"python;dur={self.python_time * 1000:.2f}",
+            f"total;dur={self.total_time * 1000:.2f}",
+        ])
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class RequestMetrics:
+    """
+    Thread-safe in-process aggregate of RequestStats per view and method
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+            self.statuses = {}
+
+    def observe(self, view, method, status, stats):
+        with self.lock:
+            key = (view, method)
+            totals = self.views.get(key)
+            if totals is None:
+                totals = self.views[key] = {
+                    "count": 0, "duration": 0.0, "db": 0.0, "queries": 0, "python": 0.0,
+                    "serialization": 0.0, "buckets": [0] * len(DURATION_BUCKETS),
+                }
+            totals["count"] += 1
+            totals["duration"] += stats.total_time
+            totals["db"] += stats.db_time
+            totals["queries"] += stats.queries
+            totals["python"] += stats.python_time
+            totals["serialization"] += stats.serialization_time
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if stats.total_time <= bound:
+                    totals["buckets"][i] += 1
+            status_key = (view, method, status)
+            self.statuses[status_key] = self.statuses.get(status_key, 0) + 1
+
+    def render(self, sample_rate):
+        """
+        Prometheus text exposition format
+        """
+        with self.lock:
+            views = {key: dict(totals, buckets=list(totals["buckets"])) for key, totals in self.views.items()}
+            statuses = dict(self.statuses)
+
+        lines = [
+            "# HELP http_request_sample_rate Fraction of requests that are instrumented.",
+            "# TYPE http_request_sample_rate gauge",
+            f"http_request_sample_rate {sample_rate}",
+            "# HELP http_requests_sampled_total Instrumented requests by view, method and status.",
+            "# TYPE http_requests_sampled_total counter",
+        ]
+        for (view, method, status), count in sorted(statuses.items()):
+            lines.append(f'http_requests_sampled_total{{view="{_escape(view)}",method="{method}",status="{status}"}} {count}')
+
+        lines += [
+            "# HELP http_request_duration_seconds Wall time of instrumented requests.",
+            "# TYPE http_request_duration_seconds histogram",
+        ]
+        for (view, method), totals in sorted(views.items()):
+            labels = f'view="{_escape(view)}",method="{method}"'
+            for bound, count in zip(DURATION_BUCKETS, totals["buckets"]):
+                lines.append(f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {totals["count"]}')
+            lines.append(f'http_request_duration_seconds_sum{{{labels}}} {totals["duration"]:.6f}')
+            lines.append(f'http_request_duration_seconds_count{{{labels}}} {totals["count"]}')
+
+        for name, key, help_text in (
+            ("http_request_db_queries_total", "queries", "SQL queries executed by instrumented requests."),
+            ("http_request_db_seconds_total", "db", "Time spent executing SQL."),
+            ("http_request_serialization_seconds_total", "serialization", "Time spent rendering responses."),
+            ("http_request_python_seconds_total", "python", "Remaining Python time of instrumented requests."),
+        ):
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+            for (view, method), totals in sorted(views.items()):
+                value = totals[key] if key == "queries" else f"{totals[key]:.6f}"
+                lines.append(f'{name}{{view="{_escape(view)}",method="{method}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+
+METRICS = RequestMetrics()
+
+
+def instrumentation_settings():
+    config = getattr(settings, "REQUEST_INSTRUMENTATION", {})
+    return config.get("SAMPLE_RATE", 0.01), config.get("SERVER_TIMING", True)
+
+
+class RequestInstrumentationMiddleware:
+    """
+    Collects RequestStats for a sample of requests. Should be first in
+    MIDDLEWARE so the timings cover the whole stack.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate, self.server_timing = instrumentation_settings()
+
+    def __call__(self, request):
+        if self.sample_rate <= 0 or (self.sample_rate < 1 and random.random() >= self.sample_rate):
+            return self.get_response(request)
+
+        stats = request.instrumentation = RequestStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        stats.finish()
+
+        match = request.resolver_match
+        view = match.route if match else "unresolved"
+        METRICS.observe(view, request.method, response.status_code, stats)
+        if self.server_timing:
+            response["Server-Timing"] = stats.server_timing()
+        return response
+
+    def process_template_response(self, request, response):
+        # Runs right before TemplateResponse / DRF Response rendering
+        stats = getattr(request, "instrumentation", None)
+        if stats is not None:
+            stats.start_render()
+            response.add_post_render_callback(stats.end_render)
+        return response
+
+
+def metrics_view(request):
+    """
+    Aggregated request metrics of this process, in Prometheus text format
+    """
+    sample_rate, _ = instrumentation_settings()
+    return HttpResponse(METRICS.render(sample_rate), content_type="text/plain; version=0.0.4; charset=utf-8")
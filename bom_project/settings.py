@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,6 +44,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bom_project.middleware.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -76,14 +78,36 @@ WSGI_APPLICATION = 'bom_project.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-# settings.py
-
-DATABASES = {
-    'default': {
-        'ENGINE':   'django.db.backends.sqlite3',
-        'NAME':     BASE_DIR / 'db.sqlite3',
+# DB_ENGINE=postgresql selects PostgreSQL, the production profile (the "db" service
+# of docker-compose.yml); otherwise SQLite in BASE_DIR is used. Connections are kept
+# open for DB_CONN_MAX_AGE seconds (0 closes them after every request, "none" keeps
+# them indefinitely) and checked before reuse, so short requests do not pay for
+# connection setup and a dropped connection is replaced instead of failing a request.
+DB_CONN_MAX_AGE = os.environ.get('DB_CONN_MAX_AGE', '60')
+
+if os.environ.get('DB_ENGINE', 'sqlite') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE':   'django.db.backends.postgresql',
+            'NAME':     os.environ.get('DB_NAME', 'bomdb'),
+            'USER':     os.environ.get('DB_USER', 'bomuser'),
+            'PASSWORD': os.environ.get('DB_PASSWORD', ''),
+            'HOST':     os.environ.get('DB_HOST', 'localhost'),
+            'PORT':     os.environ.get('DB_PORT', '5432'),
+        }
     }
-}
+else:
+    DATABASES = {
+        'default': {
+            'ENGINE':   'django.db.backends.sqlite3',
+            'NAME':     os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+
+DATABASES['default'].update({
+    'CONN_MAX_AGE':       None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE),
+    'CONN_HEALTH_CHECKS': True,
+})
 
 
 # Password validation
@@ -154,4 +178,76 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',
     ],
     # optionally add pagination, throttling, etc.
-}
\ No newline at end of file
+}
+
+# Executor for the "simulate all top-level" endpoints (MODE) and the simulation job
+# worker (JOB_MODE), see simulation/utils/executor.py. Each is 'serial', 'threads' or
+# 'processes'; process pools are forked, which only suits the single-threaded worker.
+# MAX_WORKERS defaults to the CPU count
+SIMULATION_EXECUTOR = {
+    'MODE': 'serial',
+    'JOB_MODE': 'processes',
+    'MAX_WORKERS': None,
+}
+
+# Simulation job queue (simulation/utils/jobs.py): workers report progress as items
+# finish, at most every HEARTBEAT_INTERVAL seconds; a running job whose worker has not
+# reported for STALE_AFTER seconds is requeued, or failed once it has been claimed
+# MAX_ATTEMPTS times
+SIMULATION_JOBS = {
+    'HEARTBEAT_INTERVAL': 10,
+    'STALE_AFTER': 300,
+    'MAX_ATTEMPTS': 3,
+}
+
+# Per-request query / timing instrumentation (bom_project/middleware.py),
+# reported in Server-Timing headers and at /metrics. SAMPLE_RATE is the fraction
+# of requests instrumented; each one pays for recording its queries, so production
+# samples 1 %. Set REQUEST_SAMPLE_RATE=1 to instrument every request while debugging
+REQUEST_INSTRUMENTATION = {
+    'SAMPLE_RATE': float(os.environ.get('REQUEST_SAMPLE_RATE', '0.01')),
+    'SERVER_TIMING': True,
+}
+
+# Caches. "bom" holds exploded BOM trees and routing data (bom_app/utils/explosion_cache.py);
+# entries are versioned rather than deleted, so it relies on the backend culling entries
+# once MAX_ENTRIES is reached (the local-memory backend evicts the least recently used
+# ones first). The local-memory cache is per process: with several workers use a
+# shared backend, e.g.
+#   'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+#   'LOCATION': '/var/tmp/bom_cache',
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'bom': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'bom-explosions',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': 5000,
+            'CULL_FREQUENCY': 10,
+        },
+    },
+}
+
+# Explosion cache: the CACHES alias to use, a switch to bypass it, how many
+# results each process also keeps unpickled in memory, and how many shared
+# sub-assembly subtrees of snapshot graphs it keeps across requests
+BOM_EXPLOSION_CACHE = {
+    'ALIAS': 'bom',
+    'ENABLED': True,
+    'LOCAL_ENTRIES': 256,
+    'SUBTREE_ENTRIES': 10000,
+}
+
+# Shared BOM graph snapshot (bom_app/utils/graph_snapshot.py). When ENABLED, explosions,
+# routing data, cost breakdowns and simulations read one array-backed copy of the whole
+# BOM graph instead of querying their subgraph. The first request after any BOM change
+# rebuilds it from every item, line and routing step, so it suits read-mostly
+# deployments. PATH is a directory to save it to and memory-map it from, so that all
+# worker processes share one copy; None keeps a private copy in each process.
+BOM_GRAPH_SNAPSHOT = {
+    'ENABLED': False,
+    'PATH': None,
+}
@@ -1,3 +1,13 @@
 from django.contrib import admin
+from .models import SimulationJob
 
 # Register your models here.
+class SimulationJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'complexity', 'status', 'items_done', 'items_total', 'created_at', 'finished_at')
+    list_filter = ('status', 'kind')
+    ordering = ('-created_at',)
+    list_per_page = 20
+    readonly_fields = ('summary', 'per_item', 'error', 'worker', 'attempts', 'started_at', 'heartbeat_at',
+                       'finished_at')
+
+admin.site.register(SimulationJob, SimulationJobAdmin)
@@ -0,0 +1,49 @@
+# simulation/management/commands/run_simulation_worker.py
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from simulation.utils.jobs import (
+    claim_next_job, run_job, recover_stale_jobs, default_worker_name, JobLost, CHUNK_SIZE,
+)
+
+
+class Command(BaseCommand):
+    help = "Execute queued simulation jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling')
+        parser.add_argument('--poll-interval', type=float, default=2.0,
+                            help='Seconds to wait between polls of an empty queue')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Items whose routing is loaded together')
+        parser.add_argument('--worker-name', default=None,
+                            help='Name recorded on claimed jobs (default host:pid)')
+
+    def handle(self, *args, **options):
+        worker_name = options['worker_name'] or default_worker_name()
+        self.stdout.write(f"Simulation worker {worker_name} started")
+        while True:
+            # Drop connections past CONN_MAX_AGE or broken, as a request would
+            close_old_connections()
+            requeued, failed = recover_stale_jobs()
+            if requeued or failed:
+                self.stdout.write(f"Recovered stale jobs: {requeued} requeued, {failed} failed")
+            job = claim_next_job(worker_name)
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+                continue
+
+            self.stdout.write(f"Running {job}")
+            try:
+                job = run_job(job, chunk_size=options['chunk_size'])
+            except JobLost as exc:
+                self.stdout.write(self.style.WARNING(str(exc)))
+                continue
+            if job.status == 'done':
+                self.stdout.write(self.style.SUCCESS(f"Finished {job}"))
+            else:
+                self.stdout.write(self.style.ERROR(f"Job {job.pk} failed: {job.error}"))
@@ -0,0 +1,34 @@
+# Generated by Django 4.2.20 on 2025-05-13 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimulationJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('base_case', 'Base case'), ('costing_sw', 'Costing software')], max_length=20)),
+                ('complexity', models.CharField(blank=True, max_length=10)),
+                ('trials', models.IntegerField(default=50)),
+                ('seed', models.CharField(max_length=64)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='queued', max_length=10)),
+                ('items_total', models.IntegerField(default=0)),
+                ('items_done', models.IntegerField(default=0)),
+                ('summary', models.JSONField(blank=True, null=True)),
+                ('per_item', models.JSONField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
@@ -1 +1,34 @@
 from django.db import models
+
+# simulation/models.py
+
+class SimulationJob(models.Model):
+    KINDS = [('base_case', 'Base case'), ('costing_sw', 'Costing software')]
+    STATUSES = [('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
+    kind         = models.CharField(choices=KINDS, max_length=20)
+    complexity   = models.CharField(max_length=10, blank=True)   # blank = all top-level assemblies
+    trials       = models.IntegerField(default=50)
+    seed         = models.CharField(max_length=64)               # SeedSequence entropy, as text
+    status       = models.CharField(choices=STATUSES, max_length=10, default='queued', db_index=True)
+    items_total  = models.IntegerField(default=0)
+    items_done   = models.IntegerField(default=0)
+    summary      = models.JSONField(null=True, blank=True)
+    per_item     = models.JSONField(null=True, blank=True)
+    error        = models.TextField(blank=True)
+    worker       = models.CharField(max_length=100, blank=True)
+    attempts     = models.IntegerField(default=0)                 # times claimed by a worker
+    created_at   = models.DateTimeField(auto_now_add=True)
+    started_at   = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(null=True, blank=True)    # last progress report of the worker
+    finished_at  = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
+
+    @property
+    def progress(self):
+        """Fraction of items simulated so far"""
+        if self.status == 'done':
+            return 1.0
+        return self.items_done / self.items_total if self.items_total else 0.0
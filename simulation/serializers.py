@@ -0,0 +1,20 @@
+# serializers.py
+from rest_framework import serializers
+from .models import SimulationJob
+
+
+class SimulationJobRequestSerializer(serializers.Serializer):
+    kind       = serializers.ChoiceField(choices=SimulationJob.KINDS, default='base_case')
+    complexity = serializers.CharField(max_length=10, required=False, allow_blank=True, default='')
+    trials     = serializers.IntegerField(min_value=1, max_value=10000, default=50)
+    seed       = serializers.IntegerField(min_value=0, required=False)
+
+
+class SimulationJobSerializer(serializers.ModelSerializer):
+    progress = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = SimulationJob
+        fields = ('id', 'kind', 'complexity', 'trials', 'seed', 'status', 'progress', 'items_total',
+                  'items_done', 'error', 'worker', 'attempts', 'created_at', 'started_at', 'heartbeat_at',
+                  'finished_at')
@@ -1,3 +1,287 @@
-from django.test import TestCase
+import numpy as np
+from datetime import timedelta
+from io import StringIO
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
 
-# Create your tests here.
+from bom_app.models import Item, WorkCenter, RoutingStep
+from bom_app.tests import make_item, make_bom
+
+from simulation.utils.base_case_simulation import (
+    simulate_quote_for_routing, simulate_quote_for_routing_scalar, simulate_manual_steps,
+)
+from simulation.utils.costing_sw_simulation import simulate_quote_for_routing_sw, simulate_quote_for_routing_sw_scalar
+from simulation.utils.flat_routing import flatten_routing, flatten_graph
+from bom_app.utils.bom_graph import BOMGraph, assemble_routing
+from simulation.utils.random_streams import seed_sequence, item_rng
+from simulation.utils.executor import simulate_items, iter_simulations, executor_settings
+from simulation.utils.jobs import claim_next_job, recover_stale_jobs, run_job, JobLost
+from simulation.models import SimulationJob
+
+
+def routing_node(item_no, work_centers=None, children=()):
+    return {
+        'item_no': item_no,
+        'description': f"Item {item_no}",
+        'item_type': 'A' if children else 'P',
+        'level': 0,
+        'work_centers': work_centers or {},
+        'total_time': sum((work_centers or {}).values()),
+        'children': list(children),
+    }
+
+
+def sample_routing():
+    sub = routing_node('A2', {'WC01': 0, 'WC02': 6, 'WC03': 0}, [routing_node('P3'), routing_node('P4')])
+    return routing_node('A1', {'WC01': 5, 'WC02': 0, 'WC03': 7}, [routing_node('P1'), routing_node('P2'), sub])
+
+
+class VectorizedSimulationTests(SimpleTestCase):
+
+    def test_flattens_every_level(self):
+        nodes = flatten_routing(sample_routing())
+        self.assertEqual(nodes.depth.tolist(), [0, 1, 1, 1, 2, 2])
+        self.assertEqual(nodes.work_centers, ('WC01', 'WC02', 'WC03'))
+        self.assertEqual(nodes.wc_time[0].tolist(), [5, 0, 7])
+        self.assertEqual(nodes.wc_time[3].tolist(), [0, 6, 0])
+        self.assertEqual(nodes.work_center_counts().tolist(), [2, 0, 0, 1, 0, 0])
+
+        deep = routing_node('D6')
+        for level in range(5, -1, -1):
+            deep = routing_node(f"D{level}", children=[deep])
+        # Nothing below the grandchildren is dropped any more
+        self.assertEqual(flatten_routing(deep).depth.tolist(), list(range(7)))
+
+    def test_manual_steps_without_planned_steps(self):
+        performed, errors = simulate_manual_steps(np.array([0.0, -0.5]))
+        self.assertEqual(performed.tolist(), [0.0, -0.5])
+        self.assertEqual(errors.tolist(), [0, 0])
+
+    def test_matches_scalar_reference_statistically(self):
+        trials = 2000
+        rng = np.random.default_rng(1234)
+        scalar = simulate_quote_for_routing_scalar(sample_routing(), trials, rng)
+        vectorized = simulate_quote_for_routing(sample_routing(), trials, rng)
+        self.assertEqual(len(vectorized), trials)
+
+        for key in ('total_time_sec', 'manual_entries', 'error_count'):
+            expected = np.array([r[key] for r in scalar], dtype=float)
+            actual = np.array([r[key] for r in vectorized], dtype=float)
+            # Means agree within four standard errors, spreads within 10%
+            standard_error = np.sqrt(expected.var() / trials + actual.var() / trials)
+            self.assertLess(abs(expected.mean() - actual.mean()), 4 * standard_error, key)
+            self.assertAlmostEqual(actual.std() / expected.std(), 1, delta=0.1, msg=key)
+
+    def test_costing_sw_matches_scalar_reference_statistically(self):
+        trials = 2000
+        rng = np.random.default_rng(4321)
+        scalar = simulate_quote_for_routing_sw_scalar(sample_routing(), trials, rng)
+        vectorized = simulate_quote_for_routing_sw(sample_routing(), trials, rng)
+
+        for key in ('total_time_sec', 'manual_entries', 'error_count'):
+            expected = np.array([r[key] for r in scalar], dtype=float)
+            actual = np.array([r[key] for r in vectorized], dtype=float)
+            standard_error = np.sqrt(expected.var() / trials + actual.var() / trials)
+            self.assertLess(abs(expected.mean() - actual.mean()), 4 * standard_error + 1e-9, key)
+
+
+class SeededSimulationTests(TestCase):
+
+    def setUp(self):
+        wc = WorkCenter.objects.create(wc_no='WC01', name='Assembly', cost_per_min=0.4)
+        for n in range(1, 4):
+            part = make_item(f"P{n}")
+            top = make_item(f"A{n}", item_type='A')
+            bom = make_bom(top, [(part, 2)], complexity='simple')
+            RoutingStep.objects.create(routing_no=f"RT_A{n}", bom=bom, wc=wc, step_no=1, run_time_min=5)
+
+    def test_same_seed_reproduces_results(self):
+        first = self.client.get('/simulation/base-case/simple/?seed=42').json()
+        second = self.client.get('/simulation/base-case/simple/?seed=42').json()
+        self.assertEqual(first, second)
+        self.assertEqual(first['seed'], 42)
+        other = self.client.get('/simulation/base-case/simple/?seed=43').json()
+        self.assertNotEqual(first['samples'], other['samples'])
+
+    def test_item_endpoint_matches_random_pick_and_supports_etag(self):
+        picked = self.client.get('/simulation/base-case/simple/?seed=42').json()
+        response = self.client.get(f"/simulation/base-case/item/{picked['item']}/?seed=42")
+        self.assertEqual(response.json(), picked)
+        etag = response['ETag']
+        cached = self.client.get(f"/simulation/base-case/item/{picked['item']}/?seed=42", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        # Unseeded runs are random, so they are not conditional
+        self.assertFalse(self.client.get('/simulation/base-case/item/A1/').has_header('ETag'))
+        part = self.client.get('/simulation/base-case/item/P1/?seed=1')
+        self.assertEqual(part.status_code, 404)
+        self.assertFalse(part.has_header('ETag'))
+
+    def test_item_streams_do_not_depend_on_other_items(self):
+        response = self.client.get('/simulation/base-case/top-level-by-complexity/simple/?seed=7').json()
+        self.assertEqual([row['item_no'] for row in response['per_item']], ['A1', 'A2', 'A3'])
+        # Streams are keyed by item, not by position in the run
+        self.assertEqual(item_rng(seed_sequence(7), 2).normal(size=3).tolist(),
+                         item_rng(seed_sequence(7), 2).normal(size=3).tolist())
+        self.assertNotEqual(item_rng(seed_sequence(7), 2).normal(size=3).tolist(),
+                            item_rng(seed_sequence(7), 3).normal(size=3).tolist())
+
+    def test_invalid_seed(self):
+        self.assertEqual(self.client.get('/simulation/base-case/simple/?seed=abc').status_code, 400)
+        self.assertEqual(self.client.get('/simulation/base-case/top-level-by-complexity/simple/?seed=-1').status_code, 400)
+
+
+class SimulationExecutorTests(TestCase):
+
+    def setUp(self):
+        wc = WorkCenter.objects.create(wc_no='WC01', name='Assembly', cost_per_min=0.4)
+        for n in range(1, 5):
+            part = make_item(f"P{n}")
+            top = make_item(f"A{n}", item_type='A')
+            bom = make_bom(top, [(part, n)], complexity='simple')
+            RoutingStep.objects.create(routing_no=f"RT_A{n}", bom=bom, wc=wc, step_no=1, run_time_min=5)
+        # An assembly without a BOM is skipped, as by simulate_quote_for_item
+        make_item('A9', item_type='A')
+
+    def test_modes_produce_identical_results(self):
+        items = list(Item.objects.filter(item_type='A').order_by('item_no'))
+        runs = {
+            mode: simulate_items(items, simulate_quote_for_routing, trials=5, seed_seq=seed_sequence(11),
+                                 mode=mode, max_workers=2)
+            for mode in ('serial', 'threads', 'processes')
+        }
+        serial = runs['serial']
+        self.assertEqual([item.item_no for item, _ in serial], ['A1', 'A2', 'A3', 'A4', 'A9'])
+        self.assertEqual([len(simulations) for _, simulations in serial], [5, 5, 5, 5, 0])
+        self.assertEqual(runs['threads'], serial)
+        self.assertEqual(runs['processes'], serial)
+
+    def test_chunks_stream_through_one_executor(self):
+        items = list(Item.objects.filter(item_type='A').order_by('item_no'))
+        expected = simulate_items(items, simulate_quote_for_routing, trials=5, seed_seq=seed_sequence(11))
+        chunks = [items[:2], items[2:3], items[3:]]
+        for mode in ('serial', 'threads', 'processes'):
+            results = iter_simulations(chunks, simulate_quote_for_routing, trials=5, seed_seq=seed_sequence(11),
+                                       mode=mode, max_workers=2)
+            self.assertEqual(list(results), expected)
+
+    def test_requests_and_jobs_have_separate_modes(self):
+        with self.settings(SIMULATION_EXECUTOR={}):
+            self.assertEqual((executor_settings()[0], executor_settings(jobs=True)[0]), ('serial', 'serial'))
+        with self.settings(SIMULATION_EXECUTOR={'JOB_MODE': 'processes', 'MAX_WORKERS': 3}):
+            self.assertEqual(executor_settings(), ('serial', 3))
+            self.assertEqual(executor_settings(jobs=True), ('processes', 3))
+        with self.settings(SIMULATION_EXECUTOR={'JOB_MODE': 'fork'}), self.assertRaises(ValueError):
+            executor_settings(jobs=True)
+
+    def test_graph_and_nested_routing_flatten_alike(self):
+        make_bom(Item.objects.get(item_no='P1'), [(make_item('P10'), 3)])
+        graph = BOMGraph.load(['A1'], routing=True)
+        from_graph = flatten_graph(graph, graph.ids['A1'])
+        nested = flatten_routing(assemble_routing(graph, graph.ids['A1'], wrap_children=True))
+        self.assertEqual(from_graph.depth.tolist(), [0, 1, 2])
+        self.assertEqual(from_graph.quantity.tolist(), [1, 1, 3])
+        for field in ('depth', 'quantity', 'wc_time'):
+            self.assertEqual(getattr(from_graph, field).tolist(), getattr(nested, field).tolist())
+
+    def test_routing_is_loaded_once(self):
+        items = list(Item.objects.filter(item_type='A'))
+        # Three subgraph queries plus the work-center list, however many items
+        with self.assertNumQueries(4):
+            simulate_items(items, simulate_quote_for_routing, trials=2, seed_seq=seed_sequence(1), mode='serial')
+
+    def test_snapshot_gives_identical_results(self):
+        items = list(Item.objects.filter(item_type='A').order_by('item_no'))
+        run = lambda: simulate_items(items, simulate_quote_for_routing, trials=5, seed_seq=seed_sequence(11),
+                                     mode='serial')
+        expected = run()
+        with override_settings(BOM_GRAPH_SNAPSHOT={'ENABLED': True}):
+            self.assertEqual(run(), expected)
+            # Only the version token is read once the snapshot is built
+            with self.assertNumQueries(1):
+                self.assertEqual(run(), expected)
+
+
+# The worker closes obsolete connections between polls, which must not happen
+# inside the transaction a TestCase wraps around each test
+class SimulationJobTests(TransactionTestCase):
+
+    def setUp(self):
+        wc = WorkCenter.objects.create(wc_no='WC01', name='Assembly', cost_per_min=0.4)
+        for n in range(1, 4):
+            part = make_item(f"P{n}")
+            top = make_item(f"A{n}", item_type='A')
+            bom = make_bom(top, [(part, 2)], complexity='simple')
+            RoutingStep.objects.create(routing_no=f"RT_A{n}", bom=bom, wc=wc, step_no=1, run_time_min=5)
+
+    def test_job_lifecycle(self):
+        response = self.client.post('/simulation/jobs/', {'kind': 'base_case', 'trials': 5, 'seed': 3})
+        self.assertEqual(response.status_code, 201)
+        job_id = response.json()['id']
+        self.assertEqual(response.json()['status'], 'queued')
+        self.assertEqual(self.client.get(f'/simulation/jobs/{job_id}/results/').status_code, 409)
+
+        call_command('run_simulation_worker', once=True, chunk_size=2, stdout=StringIO())
+
+        status = self.client.get(f'/simulation/jobs/{job_id}/').json()
+        self.assertEqual(status['status'], 'done')
+        self.assertEqual((status['items_done'], status['items_total'], status['progress']), (3, 3, 1.0))
+        results = self.client.get(f'/simulation/jobs/{job_id}/results/').json()
+        self.assertEqual(results['summary']['seed'], 3)
+        self.assertEqual(results['summary']['total_items_simulated'], 3)
+        self.assertEqual([row['item_no'] for row in results['per_item']], ['A1', 'A2', 'A3'])
+
+        # Same seed, same results as the synchronous endpoint
+        direct = self.client.get('/simulation/base-case/top-level-by-complexity/simple/?seed=3').json()
+        rerun = self.client.post('/simulation/jobs/', {'complexity': 'simple', 'trials': 50, 'seed': 3}).json()
+        call_command('run_simulation_worker', once=True, stdout=StringIO())
+        rerun = self.client.get(f"/simulation/jobs/{rerun['id']}/results/").json()
+        self.assertEqual(rerun['per_item'], direct['per_item'])
+
+    def test_claim_is_exclusive(self):
+        job = SimulationJob.objects.create(kind='base_case', seed='1')
+        self.assertEqual(claim_next_job('worker-1').pk, job.pk)
+        self.assertIsNone(claim_next_job('worker-2'))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker), ('running', 'worker-1'))
+
+    def test_stale_jobs_are_requeued_then_failed(self):
+        job = SimulationJob.objects.create(kind='base_case', seed='1')
+        stale = timezone.now() - timedelta(seconds=301)
+        lost = claim_next_job('worker-1')
+        self.assertEqual(recover_stale_jobs(), (0, 0))
+        SimulationJob.objects.filter(pk=job.pk).update(heartbeat_at=stale)
+        self.assertEqual(recover_stale_jobs(), (1, 0))
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.worker, job.attempts), ('queued', '', 1))
+        # The first worker turns out to be alive but may no longer save anything
+        with self.assertRaises(JobLost):
+            run_job(lost)
+
+        for worker_name, recovered in (('worker-2', (1, 0)), ('worker-3', (0, 1))):
+            claim_next_job(worker_name)
+            SimulationJob.objects.filter(pk=job.pk).update(heartbeat_at=stale)
+            self.assertEqual(recover_stale_jobs(), recovered)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 3))
+        self.assertIn('Worker stopped responding', job.error)
+
+    def test_progress_is_saved_per_item_throttled_by_time(self):
+        def progress_updates(interval):
+            job = SimulationJob.objects.create(kind='base_case', trials=2, seed='1')
+            with self.settings(SIMULATION_JOBS={'HEARTBEAT_INTERVAL': interval}), \
+                    CaptureQueriesContext(connection) as queries:
+                run_job(claim_next_job('worker-1'), chunk_size=50)
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.items_done), ('done', 3))
+            return sum('"items_done"' in query['sql'] and 'UPDATE' in query['sql'] for query in queries)
+
+        self.assertEqual(progress_updates(0), 3)
+        self.assertEqual(progress_updates(3600), 1)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.client.post('/simulation/jobs/', {'kind': 'other'}).status_code, 400)
+        self.assertEqual(self.client.post('/simulation/jobs/', {'trials': 0}).status_code, 400)
+        self.assertEqual(self.client.get('/simulation/jobs/999/').status_code, 404)
@@ -1,6 +1,7 @@
 import numpy as np
 from bom_app.models import Item, BOM, BOMLine, RoutingStep
 from bom_app.views import collect_routing_data
+from .flat_routing import flatten_routing
 
 # --- Monte-Carlo driver: representative task times & error likelihoods -----------
 # Units: seconds for time, dimensionless probability for errors
@@ -15,7 +16,7 @@ PROCESS_STEPS = {
 }
 
 
-def simulate_quote_for_item(item: Item, trials=100):
+def simulate_quote_for_item(item: Item, trials=100, rng=None):
     results = []
 
     # Only simulate for assemblies
@@ -28,107 +29,160 @@ def simulate_quote_for_item(item: Item, trials=100):
         return results
     
     data = collect_routing_data(bom.parent)
+    return simulate_quote_for_routing(data, trials, rng)
 
+
+# --- Vectorized engine ---------------------------------------------------------------
+# Draws every trial x node x interaction at once. The scalar "retry on detected
+# error" loop is replaced by its closed form: each manual step errs with the mean
+# error probability, half of the errors are detected and add one more step. The
+# number of retries before the planned steps are done is negative binomial, and
+# the undetected errors among the planned steps are binomial.
+# -------------------------------------------------------------------------------------
+
+ERROR_PROBABILITY = sum(PROCESS_STEPS["error_probability_per_manual_step"]["range"]) / 2
+DETECTION_PROBABILITY = 0.5
+
+
+def simulate_manual_steps(planned, error_probability=ERROR_PROBABILITY, rng=None):
+    """
+    Vectorized equivalent of the `while counter < step_interactions` loops.
+    planned: array of planned (possibly fractional) step counts.
+    Returns (performed, errors) arrays of the same shape, where performed is
+    planned plus one retry per detected error.
+    """
+    rng = rng or np.random.default_rng()
+    planned = np.asarray(planned, dtype=float)
+    steps = np.maximum(np.ceil(planned), 0)
+    retry_probability = error_probability * DETECTION_PROBABILITY
+    retries = rng.negative_binomial(np.maximum(steps, 1), 1 - retry_probability)
+    retries = np.where(steps > 0, retries, 0)
+    undetected = rng.binomial(
+        steps.astype(np.int64),
+        error_probability * (1 - DETECTION_PROBABILITY) / (1 - retry_probability)
+    )
+    return planned + retries, retries + undetected
+
+
+def simulate_cad_step(n_nodes, trials, rng):
+    """
+    CAD interpretation of every node: (time, entries, errors) per trial
+    """
+    cad = PROCESS_STEPS["cad_interpretation_time_per_component"]
+    interactions = PROCESS_STEPS["manual_interactions_per_item"]
+    entry_time = PROCESS_STEPS["manual_data_entry_time_per_item"]
+
+    cad_time = rng.normal(cad["mean"], cad["std"], (trials, n_nodes)) * 60
+    cad_entries, cad_errors = simulate_manual_steps(
+        rng.normal(interactions["mean"], interactions["std"], (trials, n_nodes)), rng=rng
+    )
+    return (
+        (cad_time + cad_entries * entry_time["mean"]).sum(axis=1),
+        cad_entries.sum(axis=1),
+        cad_errors.sum(axis=1),
+    )
+
+
+def last_work_center_columns(wc_counts):
+    """
+    Column of each node's last work-center calculation when the calculations
+    of all nodes are laid out side by side; nodes without any are skipped
+    """
+    return np.cumsum(wc_counts)[wc_counts > 0] - 1
+
+
+def simulate_quote_for_routing(data, trials=100, rng=None):
+    """
+    Simulate `trials` quotes for the routing data of one item, at any depth.
+    data is nested routing data or a FlatRouting.
+    """
+    rng = rng or np.random.default_rng()
+    nodes = flatten_routing(data)
+    n_nodes = nodes.size
+    wc_counts = nodes.work_center_counts()
+    n_calculations = int(wc_counts.sum())
+
+    interactions = PROCESS_STEPS["manual_interactions_per_item"]
+    entry_time = PROCESS_STEPS["manual_data_entry_time_per_item"]
+
+    # --- Step 1: CAD interpretation for every node ---
+    total_time, total_entries, error_count = simulate_cad_step(n_nodes, trials, rng)
+
+    # --- Step 2: Enter into costing sheets, one calculation per work center of each node ---
+    wc_entries, wc_errors = simulate_manual_steps(
+        rng.normal(interactions["mean"], interactions["std"], (trials, n_calculations)), rng=rng
+    )
+    wc_time = wc_entries * rng.normal(entry_time["mean"], entry_time["std"], (trials, n_calculations))
+    total_time += wc_time.sum(axis=1)
+    # Only the last work center's interactions are counted per node (+2 sheet entries)
+    total_entries += wc_entries[:, last_work_center_columns(wc_counts)].sum(axis=1) + 2 * n_nodes
+    error_count += wc_errors.sum(axis=1)
+
+    # --- Step 3: Internal software entry, two entries per node ---
+    software_entries, software_errors = simulate_manual_steps(np.full(trials, 2 * n_nodes), rng=rng)
+    total_time += software_entries * entry_time["std"]
+    error_count += software_errors
+
+    quote = PROCESS_STEPS["quote_compilation_time"]
+    total_time += rng.normal(quote["mean"], quote["std"], trials) * 60
+
+    return [
+        {
+            "total_time_sec": time_sec,
+            "manual_entries": entries,
+            "error_count": errors,
+        }
+        for time_sec, entries, errors in zip(
+            np.round(total_time, 2).tolist(), total_entries.tolist(), error_count.astype(int).tolist()
+        )
+    ]
+
+
+def simulate_quote_for_routing_scalar(data, trials=100, rng=None):
+    """
+    Reference implementation drawing one random number at a time. Kept to
+    check the vectorized engine against; not used by the views.
+    """
+    rng = rng or np.random.default_rng()
+    nodes = flatten_routing(data)
+    results = []
     for _ in range(trials):
         total_time = 0
         total_entries = 0
         errors = []
 
-        # --- Step 1: CAD interpretation (for the part) ---
-
-        # Simulate CAD interpretation for each part and assembly in data
-        
-        overall_simulation = simulate_cad_interpretation()
-        total_time += overall_simulation["step_time"]
-        total_entries += overall_simulation["interactions"]
-        errors.extend(overall_simulation["errors"])
-
-        for line in data["children"]:
-            # Simulate CAD interpretation for each component
-            component_simulation = simulate_cad_interpretation()
-            total_time += component_simulation["step_time"]
-            total_entries += component_simulation["interactions"]
-            errors.extend(component_simulation["errors"])
-
-            if len(line["children"]) > 0:
-                # Recursively process children
-                for child in line["children"]:
-                    child_simulation = simulate_cad_interpretation()
-                    total_time += child_simulation["step_time"]
-                    total_entries += child_simulation["interactions"]
-                    errors.extend(child_simulation["errors"])
-
-                    if len(child["children"]) > 0:
-                        # Recursively process grandchildren
-                        for grandchild in child["children"]:
-                            grandchild_simulation = simulate_cad_interpretation()
-                            total_time += grandchild_simulation["step_time"]
-                            total_entries += grandchild_simulation["interactions"]
-                            errors.extend(grandchild_simulation["errors"])
+        # --- Step 1: CAD interpretation (for every part and assembly) ---
+        for _ in range(nodes.size):
+            cad_simulation = simulate_cad_interpretation(rng)
+            total_time += cad_simulation["step_time"]
+            total_entries += cad_simulation["interactions"]
+            errors.extend(cad_simulation["errors"])
 
         # --- Step 2: Enter into costing sheets (simulate routing steps) ---
-
-        overall_simulation = simulate_wc_calculations(data["work_centers"])
-        total_time += overall_simulation["step_time"]
-        total_entries += overall_simulation["interactions"] + 2  # +2 for the two manual entries in the costing sheet
-        errors.extend(overall_simulation["errors"])
-
-        for line in data["children"]:
-            # Simulate CAD interpretation for each component
-            component_simulation = simulate_wc_calculations(data["work_centers"])
-            total_time += component_simulation["step_time"]
-            total_entries += component_simulation["interactions"] + 2  # +2 for the two manual entries in the costing sheet
-            errors.extend(component_simulation["errors"])
-
-            if len(line["children"]) > 0:
-                # Recursively process children
-                for child in line["children"]:
-                    child_simulation = simulate_wc_calculations(data["work_centers"])
-                    total_time += child_simulation["step_time"]
-                    total_entries += child_simulation["interactions"] + 2  # +2 for the two manual entries in the costing sheet
-                    errors.extend(child_simulation["errors"])
-
-                    if len(child["children"]) > 0:
-                        # Recursively process grandchildren
-                        for grandchild in child["children"]:
-                            grandchild_simulation = simulate_wc_calculations(data["work_centers"])
-                            total_time += grandchild_simulation["step_time"]
-                            total_entries += grandchild_simulation["interactions"] + 2  # +2 for the two manual entries in the costing sheet
-                            errors.extend(grandchild_simulation["errors"])
+        for wc_time in nodes.wc_time:
+            wc_simulation = simulate_wc_calculations(dict(zip(nodes.work_centers, wc_time)), rng)
+            total_time += wc_simulation["step_time"]
+            total_entries += wc_simulation["interactions"] + 2  # +2 for the two manual entries in the costing sheet
+            errors.extend(wc_simulation["errors"])
 
         # --- Step 3: Internal software entry ---
-        # Simulate quote compilation time
-        step_entries = 0
-        step_entries += 2
-        
-        for line in data["children"]:
-            # Simulate CAD interpretation for each component
-            step_entries +=  2  # +2 for the two manual entries in the costing sheet
-
-            if len(line["children"]) > 0:
-                # Recursively process children
-                for child in line["children"]:
-                    step_entries +=  2  
-
-                    if len(child["children"]) > 0:
-                        # Recursively process grandchildren
-                        for grandchild in child["children"]:
-                            step_entries += 2
+        # Two manual entries per node
+        step_entries = 2 * nodes.size
 
         counter = 0
         while counter < step_entries:
-            if np.random.uniform(0, 1) < np.random.uniform(
+            if rng.uniform(0, 1) < rng.uniform(
                 PROCESS_STEPS["error_probability_per_manual_step"]["range"][0],
                 PROCESS_STEPS["error_probability_per_manual_step"]["range"][1]
             ):
                 errors.append(f"Error in manual entry {counter} for item")
                 # 50/50 if error is detected or not
-                if np.random.uniform(0, 1) < 0.5:
+                if rng.uniform(0, 1) < 0.5:
                     step_entries += 1
             counter += 1
         total_time += step_entries * PROCESS_STEPS["manual_data_entry_time_per_item"]["std"]
 
-        quote_time = np.random.normal(
+        quote_time = rng.normal(
             PROCESS_STEPS["quote_compilation_time"]["mean"],
             PROCESS_STEPS["quote_compilation_time"]["std"]
         ) * 60
@@ -143,54 +197,56 @@ def simulate_quote_for_item(item: Item, trials=100):
     return results
 
 
-def simulate_cad_interpretation():
+def simulate_cad_interpretation(rng=None):
+    rng = rng or np.random.default_rng()
     errors = []
-    step_time = np.random.normal(
+    step_time = rng.normal(
         PROCESS_STEPS["cad_interpretation_time_per_component"]["mean"],
         PROCESS_STEPS["cad_interpretation_time_per_component"]["std"]
     ) * 60
-    step_interactions = np.random.normal(
+    step_interactions = rng.normal(
         PROCESS_STEPS["manual_interactions_per_item"]["mean"],
         PROCESS_STEPS["manual_interactions_per_item"]["std"]
     )
     counter = 0
     while  counter < step_interactions:
-        if np.random.uniform(0, 1) < np.random.uniform(
+        if rng.uniform(0, 1) < rng.uniform(
             PROCESS_STEPS["error_probability_per_manual_step"]["range"][0],
             PROCESS_STEPS["error_probability_per_manual_step"]["range"][1]
         ):
             errors.append(f"Error in manual entry {counter} for item")
             # 50/50 if error is detected or not
-            if np.random.uniform(0, 1) < 0.5:
+            if rng.uniform(0, 1) < 0.5:
                 step_interactions += 1
         counter += 1
     step_time += step_interactions * PROCESS_STEPS["manual_data_entry_time_per_item"]["mean"]
     return {"step_time": step_time, "errors": errors, "interactions": step_interactions}
 
 
-def simulate_wc_calculations(routing_steps):
+def simulate_wc_calculations(routing_steps, rng=None):
+    rng = rng or np.random.default_rng()
     step_time = 0
     step_interactions = 0
     errors = []
     for key, value in routing_steps.items():
         if value == 0:
             continue
-        step_interactions = np.random.normal(
+        step_interactions = rng.normal(
             PROCESS_STEPS["manual_interactions_per_item"]["mean"],
             PROCESS_STEPS["manual_interactions_per_item"]["std"]
         )
         counter = 0
         while counter < step_interactions:
-            if np.random.uniform(0, 1) < np.random.uniform(
+            if rng.uniform(0, 1) < rng.uniform(
                 PROCESS_STEPS["error_probability_per_manual_step"]["range"][0],
                 PROCESS_STEPS["error_probability_per_manual_step"]["range"][1]
             ):
                 errors.append(f"Error in manual entry {counter} for item")
                 # 50/50 if error is detected or not
-                if np.random.uniform(0, 1) < 0.5:
+                if rng.uniform(0, 1) < 0.5:
                     step_interactions += 1
             counter += 1
-        step_time += step_interactions * np.random.normal(
+        step_time += step_interactions * rng.normal(
             PROCESS_STEPS["manual_data_entry_time_per_item"]["mean"],
             PROCESS_STEPS["manual_data_entry_time_per_item"]["std"]
         )
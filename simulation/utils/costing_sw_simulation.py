@@ -1,10 +1,13 @@
 import numpy as np
 from bom_app.models import Item, BOM, BOMLine, RoutingStep
 from bom_app.views import collect_routing_data
-from .base_case_simulation import PROCESS_STEPS, simulate_cad_interpretation
+from .base_case_simulation import (
+    PROCESS_STEPS, simulate_cad_interpretation, simulate_cad_step, simulate_manual_steps, last_work_center_columns,
+)
+from .flat_routing import flatten_routing
 
 
-def simulate_quote_for_item_sw(item: Item, trials=100):
+def simulate_quote_for_item_sw(item: Item, trials=100, rng=None):
     results = []
 
     # Only simulate for assemblies
@@ -17,72 +20,76 @@ def simulate_quote_for_item_sw(item: Item, trials=100):
         return results
     
     data = collect_routing_data(bom.parent)
+    return simulate_quote_for_routing_sw(data, trials, rng)
+
+
+# Costing software: the work-center errors use the low end of the error range
+# and every entry takes the spread of the manual entry time
+SW_ERROR_PROBABILITY = PROCESS_STEPS["error_probability_per_manual_step"]["range"][0]
+
+
+def simulate_quote_for_routing_sw(data, trials=100, rng=None):
+    """
+    Simulate `trials` costing-software quotes for the routing data of one
+    item, at any depth. data is nested routing data or a FlatRouting.
+    """
+    rng = rng or np.random.default_rng()
+    nodes = flatten_routing(data)
+    wc_counts = nodes.work_center_counts()
+    n_calculations = int(wc_counts.sum())
+    interactions = PROCESS_STEPS["manual_interactions_per_item"]
+
+    # --- Step 1: CAD interpretation for every node ---
+    total_time, total_entries, error_count = simulate_cad_step(nodes.size, trials, rng)
+
+    # --- Step 2: Enter into costing software, one calculation per work center of each node ---
+    wc_entries, wc_errors = simulate_manual_steps(
+        rng.normal(interactions["mean"], interactions["std"], (trials, n_calculations)),
+        error_probability=SW_ERROR_PROBABILITY, rng=rng
+    )
+    total_time += wc_entries.sum(axis=1) * PROCESS_STEPS["manual_data_entry_time_per_item"]["std"]
+    # Only the last work center's interactions are counted per node
+    total_entries += wc_entries[:, last_work_center_columns(wc_counts)].sum(axis=1)
+    error_count += wc_errors.sum(axis=1)
+
+    return [
+        {
+            "total_time_sec": time_sec,
+            "manual_entries": entries,
+            "error_count": errors,
+        }
+        for time_sec, entries, errors in zip(
+            np.round(total_time, 2).tolist(), total_entries.tolist(), error_count.astype(int).tolist()
+        )
+    ]
+
 
+def simulate_quote_for_routing_sw_scalar(data, trials=100, rng=None):
+    """
+    Reference implementation drawing one random number at a time. Kept to
+    check the vectorized engine against; not used by the views.
+    """
+    rng = rng or np.random.default_rng()
+    nodes = flatten_routing(data)
+    results = []
     for _ in range(trials):
         total_time = 0
         total_entries = 0
         errors = []
-        # --- Step 1: CAD interpretation (for the part) ---
-
-        # Simulate CAD interpretation for each part and assembly in data
-        
-        overall_simulation = simulate_cad_interpretation()
-        total_time += overall_simulation["step_time"]
-        total_entries += overall_simulation["interactions"]
-        errors.extend(overall_simulation["errors"])
-
-        for line in data["children"]:
-            # Simulate CAD interpretation for each component
-            component_simulation = simulate_cad_interpretation()
-            total_time += component_simulation["step_time"]
-            total_entries += component_simulation["interactions"]
-            errors.extend(component_simulation["errors"])
-
-            if len(line["children"]) > 0:
-                # Recursively process children
-                for child in line["children"]:
-                    child_simulation = simulate_cad_interpretation()
-                    total_time += child_simulation["step_time"]
-                    total_entries += child_simulation["interactions"]
-                    errors.extend(child_simulation["errors"])
-
-                    if len(child["children"]) > 0:
-                        # Recursively process grandchildren
-                        for grandchild in child["children"]:
-                            grandchild_simulation = simulate_cad_interpretation()
-                            total_time += grandchild_simulation["step_time"]
-                            total_entries += grandchild_simulation["interactions"]
-                            errors.extend(grandchild_simulation["errors"])
 
-        # --- Step 2: Enter into costing software (simulate routing steps) ---
+        # --- Step 1: CAD interpretation (for every part and assembly) ---
+        for _ in range(nodes.size):
+            cad_simulation = simulate_cad_interpretation(rng)
+            total_time += cad_simulation["step_time"]
+            total_entries += cad_simulation["interactions"]
+            errors.extend(cad_simulation["errors"])
 
-        overall_simulation = simulate_wc_calculations(data["work_centers"])
-        total_time += overall_simulation["step_time"]
-        total_entries += overall_simulation["interactions"] 
-        errors.extend(overall_simulation["errors"])
-
-        for line in data["children"]:
-            # Simulate CAD interpretation for each component
-            component_simulation = simulate_wc_calculations(data["work_centers"])
-            total_time += component_simulation["step_time"]
-            total_entries += component_simulation["interactions"]
-            errors.extend(component_simulation["errors"])
-
-            if len(line["children"]) > 0:
-                # Recursively process children
-                for child in line["children"]:
-                    child_simulation = simulate_wc_calculations(data["work_centers"])
-                    total_time += child_simulation["step_time"]
-                    total_entries += child_simulation["interactions"] 
-                    errors.extend(child_simulation["errors"])
-
-                    if len(child["children"]) > 0:
-                        # Recursively process grandchildren
-                        for grandchild in child["children"]:
-                            grandchild_simulation = simulate_wc_calculations(data["work_centers"])
-                            total_time += grandchild_simulation["step_time"]
-                            total_entries += grandchild_simulation["interactions"]
-                            errors.extend(grandchild_simulation["errors"])
+        # --- Step 2: Enter into costing software (simulate routing steps) ---
+        for wc_time in nodes.wc_time:
+            wc_simulation = simulate_wc_calculations(dict(zip(nodes.work_centers, wc_time)), rng)
+            total_time += wc_simulation["step_time"]
+            total_entries += wc_simulation["interactions"]
+            errors.extend(wc_simulation["errors"])
 
         results.append({
             "total_time_sec": round(total_time, 2),
@@ -92,23 +99,24 @@ def simulate_quote_for_item_sw(item: Item, trials=100):
         })
     return results
 
-def simulate_wc_calculations(routing_steps):
+def simulate_wc_calculations(routing_steps, rng=None):
+    rng = rng or np.random.default_rng()
     step_time = 0
     step_interactions = 0
     errors = []
     for key, value in routing_steps.items():
         if value == 0:
             continue
-        step_interactions = np.random.normal(
+        step_interactions = rng.normal(
             PROCESS_STEPS["manual_interactions_per_item"]["mean"],
             PROCESS_STEPS["manual_interactions_per_item"]["std"]
         )
         counter = 0
         while counter < step_interactions:
-            if np.random.uniform(0, 1) < PROCESS_STEPS["error_probability_per_manual_step"]["range"][0]:
+            if rng.uniform(0, 1) < PROCESS_STEPS["error_probability_per_manual_step"]["range"][0]:
                 errors.append(f"Error in manual entry {counter} for item")
                 # 50/50 if error is detected or not
-                if np.random.uniform(0, 1) < 0.5:
+                if rng.uniform(0, 1) < 0.5:
                     step_interactions += 1
             counter += 1
         step_time += step_interactions * PROCESS_STEPS["manual_data_entry_time_per_item"]["std"]
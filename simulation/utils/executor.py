@@ -0,0 +1,107 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from django.conf import settings
+from bom_app.utils.graph_snapshot import load_graph
+from .flat_routing import flatten_graph
+from .random_streams import item_rng
+
+# --- Parallel simulation executor ------------------------------------------------
+# Flat routing arrays for all items are built up front in the request process,
+# then the per-item simulations (pure NumPy, no database access) are fanned out
+# according to settings.SIMULATION_EXECUTOR:
+#
+#   SIMULATION_EXECUTOR = {
+#       "MODE": "serial" | "threads" | "processes",       # web requests
+#       "JOB_MODE": "serial" | "threads" | "processes",   # run_simulation_worker
+#       "MAX_WORKERS": None,   # defaults to the number of CPUs
+#   }
+#
+# Forking a process pool inside a multi-threaded web worker that holds open
+# database connections is unsafe, so requests default to "serial" and process
+# pools are meant for the single-threaded job worker. iter_simulations streams
+# results of many chunks through one pool, so a job starts its pool only once.
+# -------------------------------------------------------------------------------------
+
+EXECUTOR_MODES = ("serial", "threads", "processes")
+
+
+def executor_settings(jobs=False):
+    """
+    (mode, max_workers) for web requests, or for the job worker with jobs=True
+    """
+    config = getattr(settings, "SIMULATION_EXECUTOR", {})
+    key = "JOB_MODE" if jobs else "MODE"
+    mode = config.get(key, "serial")
+    if mode not in EXECUTOR_MODES:
+        raise ValueError(f"SIMULATION_EXECUTOR {key} must be one of {EXECUTOR_MODES}, not '{mode}'")
+    return mode, config.get("MAX_WORKERS") or os.cpu_count() or 1
+
+
+def load_flat_routings(item_nos):
+    """
+    FlatRouting for every item_no that has a BOM, from one graph
+    load for all of them
+    """
+    graph = load_graph(item_nos, routing=True)
+    return {
+        item_no: flatten_graph(graph, graph.ids[item_no])
+        for item_no in item_nos if item_no in graph.ids and graph.has_bom(graph.ids[item_no])
+    }
+
+
+def _simulate_item(task):
+    simulate, data, trials, seed_seq, item_id = task
+    return simulate(data, trials, item_rng(seed_seq, item_id))
+
+
+def _pool(mode, max_workers):
+    if mode == "threads":
+        return ThreadPoolExecutor(max_workers=max_workers)
+    # Fork so workers inherit the configured Django app registry; they
+    # never touch the database, only the preloaded routing data.
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("fork"))
+
+
+def iter_simulations(item_chunks, simulate, trials, seed_seq, mode=None, max_workers=None):
+    """
+    Run simulate(flat_routing, trials, rng) for every assembly in a sequence
+    of item chunks, yielding (item, simulations) in order as the results
+    arrive. The routing of each chunk is loaded when the chunk is reached,
+    and all chunks share one executor, started when first needed and shut
+    down when the generator finishes or is closed. Items without a BOM get
+    an empty list, as in simulate_quote_for_item.
+    """
+    default_mode, default_workers = executor_settings()
+    mode = mode or default_mode
+    max_workers = max_workers or default_workers
+
+    pool = None
+    try:
+        for items in item_chunks:
+            items = list(items)
+            routing = load_flat_routings([item.item_no for item in items if item.item_type == 'A'])
+            tasks = [(simulate, routing[item.item_no], trials, seed_seq, item.pk)
+                     for item in items if item.item_no in routing]
+
+            if mode == "serial" or max_workers == 1 or (pool is None and len(tasks) <= 1):
+                results = map(_simulate_item, tasks)
+            else:
+                pool = pool or _pool(mode, max_workers)
+                chunksize = max(1, len(tasks) // (max_workers * 4)) if mode == "processes" else 1
+                results = pool.map(_simulate_item, tasks, chunksize=chunksize)
+
+            for item in items:
+                yield item, next(results) if item.item_no in routing else []
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+
+def simulate_items(items, simulate, trials, seed_seq, mode=None, max_workers=None):
+    """
+    Run simulate(flat_routing, trials, rng) for every assembly in items.
+    Returns a list of (item, simulations) in the order of items; items
+    without a BOM get an empty list, as in simulate_quote_for_item.
+    """
+    return list(iter_simulations([items], simulate, trials, seed_seq, mode, max_workers))
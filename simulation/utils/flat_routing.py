@@ -0,0 +1,94 @@
+from typing import NamedTuple
+import numpy as np
+from bom_app.utils.bom_graph import check_acyclic
+
+# --- Flat routing nodes --------------------------------------------------------------
+# The simulation kernels do the same work for every node of a routing tree, at any
+# depth, so the tree is flattened once per item into pre-order arrays:
+#
+#   depth     (n,)       level below the root item, root = 0
+#   quantity  (n,)       BOM line quantity of the node (1 for the root)
+#   wc_time   (n, n_wc)  run_time_min per work center, columns as in work_centers
+#
+# A node's routing is the row of wc_time; its children follow it directly with
+# depth + 1.
+# -------------------------------------------------------------------------------------
+
+
+class FlatRouting(NamedTuple):
+    item_no: str
+    work_centers: tuple
+    depth: np.ndarray
+    quantity: np.ndarray
+    wc_time: np.ndarray
+
+    @property
+    def size(self):
+        return len(self.depth)
+
+    def work_center_counts(self):
+        """Number of work centers with routing time, per node"""
+        return np.count_nonzero(self.wc_time, axis=1)
+
+
+def _build(item_no, work_centers, nodes):
+    """
+    nodes: pre-order list of (depth, quantity, {wc_no: run_time_min})
+    """
+    columns = {wc_no: index for index, wc_no in enumerate(work_centers)}
+    wc_time = np.zeros((len(nodes), len(columns)))
+    for row, (_, _, routing) in enumerate(nodes):
+        for wc_no, run_time_min in routing.items():
+            wc_time[row, columns[wc_no]] = run_time_min
+    return FlatRouting(
+        item_no=item_no,
+        work_centers=tuple(work_centers),
+        depth=np.array([depth for depth, _, _ in nodes], dtype=np.int32),
+        quantity=np.array([quantity for _, quantity, _ in nodes], dtype=float),
+        wc_time=wc_time,
+    )
+
+
+def flatten_routing(data):
+    """
+    FlatRouting from nested routing data (collect_routing_data or
+    collect_routing_data_alternative output). Children without a
+    'quantity' wrapper count as quantity 1.
+    """
+    if isinstance(data, FlatRouting):
+        return data
+
+    work_centers = {}
+    nodes = []
+    stack = [(data, 0, 1.0)]
+    while stack:
+        node, depth, quantity = stack.pop()
+        if 'component' in node:
+            node, quantity = node['component'], node['quantity']
+        for wc_no in node['work_centers']:
+            work_centers.setdefault(wc_no, None)
+        nodes.append((depth, quantity, node['work_centers']))
+        stack.extend((child, depth + 1, 1.0) for child in reversed(node['children']))
+
+    return _build(data['item_no'], list(work_centers), nodes)
+
+
+def flatten_graph(graph, item_id):
+    """
+    FlatRouting for item_id straight from a BOMGraph loaded with
+    routing=True, without building the nested dicts first. Raises
+    ValueError when the BOM contains a cycle.
+    """
+    check_acyclic(graph, item_id)
+    nodes = []
+    stack = [(item_id, 0, 1.0)]
+    while stack:
+        node_id, depth, quantity = stack.pop()
+        # Later steps at the same work center overwrite earlier ones, as in assemble_routing
+        nodes.append((depth, quantity, dict(graph.routing.get(node_id, []))))
+        stack.extend(
+            (component_id, depth + 1, component_quantity)
+            for component_id, component_quantity in reversed(graph.children.get(node_id, []))
+        )
+
+    return _build(graph.items[item_id]['item_no'], graph.work_centers, nodes)
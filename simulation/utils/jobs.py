@@ -0,0 +1,159 @@
+import socket
+import os
+import time
+from contextlib import closing
+from datetime import timedelta
+import numpy as np
+from django.conf import settings
+from django.db.models import F
+from django.utils import timezone
+from bom_app.utils.top_level_index import top_level_items
+from simulation.models import SimulationJob
+from .base_case_simulation import simulate_quote_for_routing
+from .costing_sw_simulation import simulate_quote_for_routing_sw
+from .executor import iter_simulations, executor_settings
+from .random_streams import seed_sequence
+
+# --- Simulation jobs --------------------------------------------------------------
+# Jobs are queued as SimulationJob rows by the API and executed by
+# `manage.py run_simulation_worker`. Any number of workers can poll the same
+# table; a job is claimed with a conditional UPDATE so only one worker wins.
+#
+# A worker records a heartbeat with its progress as items finish, at most every
+# SIMULATION_JOBS["HEARTBEAT_INTERVAL"] seconds. A running job without one for
+# SIMULATION_JOBS["STALE_AFTER"] seconds belongs to a worker that died
+# (OOM, deploy, SIGKILL) and is requeued by recover_stale_jobs, or failed after
+# MAX_ATTEMPTS claims. Progress is only saved while the worker still owns the job,
+# so a worker that was merely slow stops with JobLost instead of overwriting it.
+# -------------------------------------------------------------------------------------
+
+SIMULATORS = {
+    'base_case': simulate_quote_for_routing,
+    'costing_sw': simulate_quote_for_routing_sw,
+}
+
+# Items whose routing is loaded together
+CHUNK_SIZE = 50
+
+
+class JobLost(Exception):
+    """
+    The job was requeued or failed by recover_stale_jobs while this worker ran it
+    """
+
+
+def job_settings():
+    config = getattr(settings, 'SIMULATION_JOBS', {})
+    return config.get('STALE_AFTER', 300), config.get('MAX_ATTEMPTS', 3), config.get('HEARTBEAT_INTERVAL', 10)
+
+
+def default_worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def claim_next_job(worker_name):
+    """
+    Mark the oldest queued job as running for this worker and return it,
+    or None when the queue is empty
+    """
+    queued = SimulationJob.objects.filter(status='queued').order_by('created_at', 'id')
+    for job_id in queued.values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = SimulationJob.objects.filter(id=job_id, status='queued').update(
+            status='running', worker=worker_name, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1
+        )
+        if claimed:
+            return SimulationJob.objects.get(id=job_id)
+    return None
+
+
+def recover_stale_jobs():
+    """
+    Requeue running jobs whose worker stopped reporting progress, failing those
+    already claimed MAX_ATTEMPTS times. Returns (requeued, failed) counts.
+    """
+    stale_after, max_attempts, _ = job_settings()
+    now = timezone.now()
+    stale = SimulationJob.objects.filter(status='running', heartbeat_at__lt=now - timedelta(seconds=stale_after))
+    failed = stale.filter(attempts__gte=max_attempts).update(
+        status='failed', finished_at=now,
+        error=f"Worker stopped responding (no progress for {stale_after} s, {max_attempts} attempts)",
+    )
+    requeued = stale.filter(attempts__lt=max_attempts).update(
+        status='queued', worker='', started_at=None, heartbeat_at=None, items_done=0,
+    )
+    return requeued, failed
+
+
+def save_progress(job, *fields):
+    """
+    Save the given fields of a running job with a new heartbeat, or raise
+    JobLost when this worker no longer owns it
+    """
+    job.heartbeat_at = timezone.now()
+    values = {field: getattr(job, field) for field in (*fields, 'heartbeat_at')}
+    if not SimulationJob.objects.filter(pk=job.pk, status='running', worker=job.worker).update(**values):
+        raise JobLost(f"Job {job.pk} was taken away from worker {job.worker}")
+
+
+def run_job(job, chunk_size=CHUNK_SIZE):
+    """
+    Simulate every top-level item of the job, saving progress as items
+    finish (throttled to the heartbeat interval), and store the per-item
+    and overall summaries on the job.
+    Raises JobLost, saving nothing more, if the job stops being this worker's.
+    """
+    try:
+        simulate = SIMULATORS[job.kind]
+        mode, _ = executor_settings(jobs=True)
+        _, _, heartbeat_interval = job_settings()
+        seed_seq = seed_sequence(int(job.seed))
+        items = list(top_level_items(job.complexity or None).order_by('item_no'))
+        job.items_total = len(items)
+        save_progress(job, 'items_total')
+
+        per_item_summary = []
+        totals = np.zeros(3)
+        trial_count = 0
+        # One executor for the whole job, fed chunk by chunk
+        chunks = (items[start:start + chunk_size] for start in range(0, len(items), chunk_size))
+        results = iter_simulations(chunks, simulate, trials=job.trials, seed_seq=seed_seq, mode=mode)
+        saved_at = time.monotonic()
+        with closing(results):
+            for done, (item, simulations) in enumerate(results, 1):
+                if simulations:
+                    values = np.array([[r["total_time_sec"], r["manual_entries"], r["error_count"]]
+                                       for r in simulations])
+                    totals += values.sum(axis=0)
+                    trial_count += len(simulations)
+                    per_item_summary.append({
+                        "item_no": item.item_no,
+                        "description": item.description,
+                        "avg_time_sec": round(float(values[:, 0].mean()), 2),
+                        "avg_entries": round(float(values[:, 1].mean()), 2),
+                        "avg_errors": round(float(values[:, 2].mean()), 2),
+                    })
+                job.items_done = done
+                if done == len(items) or time.monotonic() - saved_at >= heartbeat_interval:
+                    save_progress(job, 'items_done')
+                    saved_at = time.monotonic()
+
+        averages = [round(float(total / trial_count), 2) if trial_count else None for total in totals]
+        job.summary = {
+            "seed": int(job.seed),
+            "complexity": job.complexity or None,
+            "total_items_simulated": len(per_item_summary),
+            "overall_avg_time_sec": averages[0],
+            "overall_avg_entries": averages[1],
+            "overall_avg_errors": averages[2],
+        }
+        job.per_item = per_item_summary
+        job.status = 'done'
+    except JobLost:
+        raise
+    except Exception as exc:
+        job.status = 'failed'
+        job.error = f"{type(exc).__name__}: {exc}"
+    job.finished_at = timezone.now()
+    save_progress(job, 'status', 'summary', 'per_item', 'error', 'finished_at')
+    return job
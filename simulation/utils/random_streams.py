@@ -0,0 +1,30 @@
+import numpy as np
+
+# --- Random number streams ---------------------------------------------------------
+# Every simulation run is driven by one SeedSequence. Item selection draws from
+# the root stream; each simulated item gets its own stream spawned from the seed
+# and keyed by the item's primary key, so an item's results do not depend on
+# which other items are simulated in the same run or in which order.
+# -------------------------------------------------------------------------------------
+
+
+def seed_sequence(seed=None):
+    """
+    SeedSequence for a run. With seed=None fresh entropy is used; its value
+    is available as .entropy so the run can be repeated.
+    """
+    return np.random.SeedSequence(seed)
+
+
+def selection_rng(seed_seq):
+    """
+    Generator used to pick items for a run
+    """
+    return np.random.default_rng(seed_seq)
+
+
+def item_rng(seed_seq, item_id):
+    """
+    Independent Generator for simulating one item
+    """
+    return np.random.default_rng(np.random.SeedSequence(seed_seq.entropy, spawn_key=(item_id,)))
@@ -1,38 +1,47 @@
 import json
 import time
+from django.http import HttpResponseBadRequest
 from django.shortcuts import render
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
-from bom_app.models import Item, BOM, BOMLine, WorkCenter, RoutingStep
-from simulation.utils.base_case_simulation import simulate_quote_for_item
-from simulation.utils.costing_sw_simulation import simulate_quote_for_item_sw
+from bom_app.models import Item, BOM, WorkCenter
+from simulation.utils.base_case_simulation import simulate_quote_for_item, simulate_quote_for_routing
+from simulation.utils.costing_sw_simulation import simulate_quote_for_routing_sw
+from simulation.utils.executor import simulate_items
+from simulation.utils.random_streams import seed_sequence, selection_rng, item_rng
+from simulation.models import SimulationJob
+from simulation.serializers import SimulationJobRequestSerializer, SimulationJobSerializer
 import numpy as np
-import random
-from django.db.models import Q
 from bom_app.views import collect_routing_data, retrieve_top_level_item, build_tree, collect_routing_data_alternative
+from bom_app.utils.top_level_index import top_level_items
+from bom_app.utils.explosion_cache import explosion_etag
 
-BATCH_SIZE = 100  # safe limit for SQLite; adjust if using Postgres
 
-def chunked_item_query(item_nos):
+def get_seed_sequence(request):
     """
-    Returns a queryset union for a large IN query
+    SeedSequence from the optional `seed` query parameter.
+    Raises ValueError for anything but a non-negative integer.
     """
-    item_nos = list(item_nos)
-    queries = [Q(item_no__in=item_nos[i:i+BATCH_SIZE]) for i in range(0, len(item_nos), BATCH_SIZE)]
-    if not queries:
-        return Item.objects.none()
-    
-    q_total = queries[0]
-    for q in queries[1:]:
-        q_total |= q
-    
-    return Item.objects.filter(q_total)
+    seed = request.GET.get('seed')
+    if seed in (None, ''):
+        return seed_sequence()
+    return seed_sequence(int(seed))
+
+
+INVALID_SEED = {"error": "seed must be a non-negative integer"}
 
 
 @api_view(['GET'])
 def simulate_base_case_test(request):
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return Response(INVALID_SEED, status=400)
+
     # Get a random top-level assembly
-    chosen_item_no = retrieve_top_level_item(complexity='complex')
+    chosen_item_no = retrieve_top_level_item(complexity='complex', rng=selection_rng(seed_seq))
     if not chosen_item_no:
         return Response({"error": "No top-level assemblies found."}, status=404)
     
@@ -56,20 +65,13 @@ def simulate_all_top_level_base_case(request):
     """
     Simulate quoting process for all top-level assemblies in the system
     """
-    # Step 1: Get all assemblies that are parents in BOMs
-    parent_assemblies = BOM.objects.filter(
-        parent__item_type='A'
-    ).values_list('parent__item_no', flat=True)
-
-    # Step 2: Exclude any assembly that appears as a component
-    sub_assemblies = BOMLine.objects.filter(
-        component__item_type='A'
-    ).values_list('component__item_no', flat=True)
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return Response(INVALID_SEED, status=400)
 
-    top_level_item_nos = set(parent_assemblies) - set(sub_assemblies)
-    # Safer filtering in Python to avoid hitting SQL variable limits
-    all_assemblies = Item.objects.filter(item_type='A').select_related()
-    top_items = [item for item in all_assemblies if item.item_no in top_level_item_nos]
+    # Top-level assemblies come straight from the persisted index
+    top_items = list(top_level_items().order_by('item_no'))
 
 
     if not top_items:
@@ -78,8 +80,7 @@ def simulate_all_top_level_base_case(request):
     overall_results = []
     per_item_summary = []
 
-    for item in top_items:
-        simulations = simulate_quote_for_item(item, trials=50)
+    for item, simulations in simulate_items(top_items, simulate_quote_for_routing, trials=50, seed_seq=seed_seq):
         if simulations:
             overall_results.extend(simulations)
             per_item_summary.append({
@@ -91,6 +92,7 @@ def simulate_all_top_level_base_case(request):
             })
 
     overall_stats = {
+        "seed": seed_seq.entropy,
         "total_items_simulated": len(per_item_summary),
         "overall_avg_time_sec": round(np.mean([r["total_time_sec"] for r in overall_results]), 2),
         "overall_avg_entries": round(np.mean([r["manual_entries"] for r in overall_results]), 2),
@@ -115,33 +117,33 @@ def simulate_base_case_from_complexity(request, complexity):
     """
     Simulate quote process for one random top-level assembly of the given complexity
     """
-    # STEP 1: Find all parent assemblies for given complexity
-    parent_assemblies = BOM.objects.filter(
-        complexity=complexity, 
-        parent__item_type='A'
-    ).values_list('parent__item_no', flat=True)
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return Response(INVALID_SEED, status=400)
 
-    # STEP 2: Exclude assemblies used as components (only top-level)
-    sub_assemblies = BOMLine.objects.filter(
-        component__item_type='A'
-    ).values_list('component__item_no', flat=True)
-
-    top_level_item_nos = set(parent_assemblies) - set(sub_assemblies)
-
-    if not top_level_item_nos:
+    # STEP 1: Pick a random top-level assembly of the given complexity
+    chosen_item_no = retrieve_top_level_item(complexity, rng=selection_rng(seed_seq))
+    if not chosen_item_no:
         return Response({"error": f"No top-level assemblies found with complexity '{complexity}'"}, status=404)
 
-    # STEP 3: Pick a random top-level assembly and simulate
-    chosen_item_no = random.choice(list(top_level_item_nos))
+    # STEP 2: Simulate
     item = Item.objects.get(item_no=chosen_item_no)
-    simulations = simulate_quote_for_item(item, trials=50)
+    return Response(base_case_summary(item, seed_seq, complexity))
+
+
+def base_case_summary(item, seed_seq, complexity):
+    """
+    Run the base case simulation for item and summarize the trials
+    """
+    simulations = simulate_quote_for_item(item, trials=50, rng=item_rng(seed_seq, item.pk))
 
-    # STEP 4: Summarize results
     avg_time = round(sum(r["total_time_sec"] for r in simulations) / len(simulations), 2)
     avg_errors = round(sum(r["error_count"] for r in simulations) / len(simulations), 2)
     avg_entries = round(sum(r["manual_entries"] for r in simulations) / len(simulations), 2)
 
-    return Response({
+    return {
+        "seed": seed_seq.entropy,
         "item": item.item_no,
         "description": item.description,
         "complexity": complexity,
@@ -149,29 +151,57 @@ def simulate_base_case_from_complexity(request, complexity):
         "avg_manual_entries": avg_entries,
         "avg_error_count": avg_errors,
         "samples": simulations[:5],  # show just a few sample simulations
-    })
+    }
+
+
+def base_case_item_etag(request, item_no):
+    # Only seeded results are reproducible
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return None
+    if request.GET.get('seed') in (None, ''):
+        return None
+    assemblies = Item.objects.filter(item_type='A', booms__isnull=False)
+    return explosion_etag('base-case', item_no, seed_seq.entropy, items=assemblies)
+
+
+@cache_control(no_cache=True)
+@condition(etag_func=base_case_item_etag)
+@api_view(['GET'])
+def simulate_base_case_for_item(request, item_no):
+    """
+    Simulate quote process for the given assembly. With a seed the result
+    is reproducible and gets an ETag for conditional requests.
+    """
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return Response(INVALID_SEED, status=400)
+
+    item = Item.objects.filter(item_no=item_no, item_type='A').first()
+    bom = item.booms.first() if item else None
+    if bom is None:
+        return Response({"error": f"Assembly '{item_no}' not found"}, status=404)
+    return Response(base_case_summary(item, seed_seq, bom.complexity))
 
 
 def simulate_base_case_template_view(request, complexity):
     # Same logic as above, but rendered via template
-    parent_assemblies = BOM.objects.filter(
-        complexity=complexity, 
-        parent__item_type='A'
-    ).values_list('parent__item_no', flat=True)
-
-    sub_assemblies = BOMLine.objects.filter(
-        component__item_type='A'
-    ).values_list('component__item_no', flat=True)
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return HttpResponseBadRequest(INVALID_SEED["error"])
 
-    top_level_item_nos = set(parent_assemblies) - set(sub_assemblies)
-    if not top_level_item_nos:
+    chosen_item_no = retrieve_top_level_item(complexity, rng=selection_rng(seed_seq))
+    if not chosen_item_no:
         return render(request, "simulation/no_results.html", {"complexity": complexity})
 
-    chosen_item_no = random.choice(list(top_level_item_nos))
     item = Item.objects.get(item_no=chosen_item_no)
-    simulations = simulate_quote_for_item(item, trials=50)
+    simulations = simulate_quote_for_item(item, trials=50, rng=item_rng(seed_seq, item.pk))
 
     context = {
+        "seed": seed_seq.entropy,
         "item": item,
         "complexity": complexity,
         "avg_time": round(sum(r["total_time_sec"] for r in simulations) / len(simulations), 2),
@@ -186,23 +216,13 @@ def simulate_top_level_by_complexity(request, complexity):
     """
     Simulate quoting process for all top-level assemblies with given complexity
     """
-    # STEP 1: Get item_nos for assemblies used as BOM parents (with matching complexity)
-    parent_assemblies = BOM.objects.filter(
-        complexity=complexity,
-        parent__item_type='A'
-    ).values_list('parent__item_no', flat=True)
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return Response(INVALID_SEED, status=400)
 
-    # STEP 2: Get item_nos of assemblies used as components in BOMLines
-    sub_assemblies = BOMLine.objects.filter(
-        component__item_type='A'
-    ).values_list('component__item_no', flat=True)
-
-    # STEP 3: Find top-level item_nos (parent but not sub-assembly)
-    top_level_item_nos = set(parent_assemblies) - set(sub_assemblies)
-
-    # STEP 4: Retrieve Items in Python to avoid SQL variable limit
-    all_assemblies = Item.objects.filter(item_type='A')
-    top_items = [item for item in all_assemblies if item.item_no in top_level_item_nos]
+    # Top-level assemblies with matching complexity, from the persisted index
+    top_items = list(top_level_items(complexity).order_by('item_no'))
 
     if not top_items:
         return Response({"error": f"No top-level assemblies found for complexity '{complexity}'."}, status=404)
@@ -210,8 +230,7 @@ def simulate_top_level_by_complexity(request, complexity):
     overall_results = []
     per_item_summary = []
 
-    for item in top_items:
-        simulations = simulate_quote_for_item(item, trials=50)
+    for item, simulations in simulate_items(top_items, simulate_quote_for_routing, trials=50, seed_seq=seed_seq):
         if simulations:
             overall_results.extend(simulations)
             per_item_summary.append({
@@ -223,6 +242,7 @@ def simulate_top_level_by_complexity(request, complexity):
             })
 
     overall_stats = {
+        "seed": seed_seq.entropy,
         "complexity": complexity,
         "total_items_simulated": len(per_item_summary),
         "overall_avg_time_sec": round(np.mean([r["total_time_sec"] for r in overall_results]), 2),
@@ -240,20 +260,13 @@ def simulate_all_top_level_costing_sw_case(request):
     """
     Simulate quoting process for all top-level assemblies in the system
     """
-    # Step 1: Get all assemblies that are parents in BOMs
-    parent_assemblies = BOM.objects.filter(
-        parent__item_type='A'
-    ).values_list('parent__item_no', flat=True)
-
-    # Step 2: Exclude any assembly that appears as a component
-    sub_assemblies = BOMLine.objects.filter(
-        component__item_type='A'
-    ).values_list('component__item_no', flat=True)
+    try:
+        seed_seq = get_seed_sequence(request)
+    except ValueError:
+        return Response(INVALID_SEED, status=400)
 
-    top_level_item_nos = set(parent_assemblies) - set(sub_assemblies)
-    # Safer filtering in Python to avoid hitting SQL variable limits
-    all_assemblies = Item.objects.filter(item_type='A').select_related()
-    top_items = [item for item in all_assemblies if item.item_no in top_level_item_nos]
+    # Top-level assemblies come straight from the persisted index
+    top_items = list(top_level_items().order_by('item_no'))
 
 
     if not top_items:
@@ -262,8 +275,7 @@ def simulate_all_top_level_costing_sw_case(request):
     overall_results = []
     per_item_summary = []
 
-    for item in top_items:
-        simulations = simulate_quote_for_item_sw(item, trials=50)
+    for item, simulations in simulate_items(top_items, simulate_quote_for_routing_sw, trials=50, seed_seq=seed_seq):
         if simulations:
             overall_results.extend(simulations)
             per_item_summary.append({
@@ -275,6 +287,7 @@ def simulate_all_top_level_costing_sw_case(request):
             })
 
     overall_stats = {
+        "seed": seed_seq.entropy,
         "total_items_simulated": len(per_item_summary),
         "overall_avg_time_sec": round(np.mean([r["total_time_sec"] for r in overall_results]), 2),
         "overall_avg_entries": round(np.mean([r["manual_entries"] for r in overall_results]), 2),
@@ -291,4 +304,59 @@ def simulate_all_top_level_costing_sw_case(request):
         }, f, indent=4)
 
     return Response({
-        "summary": overall_stats,})
\ No newline at end of file
+        "summary": overall_stats,})
+
+@api_view(['GET', 'POST'])
+def simulation_jobs(request):
+    """
+    GET lists the most recent simulation jobs; POST queues a new job for
+    `manage.py run_simulation_worker`
+    """
+    if request.method == 'POST':
+        serializer = SimulationJobRequestSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=400)
+        params = serializer.validated_data
+        seed_seq = seed_sequence(params.get('seed'))
+        job = SimulationJob.objects.create(
+            kind=params['kind'],
+            complexity=params['complexity'],
+            trials=params['trials'],
+            seed=str(seed_seq.entropy),
+        )
+        return Response(SimulationJobSerializer(job).data, status=201)
+
+    jobs = SimulationJob.objects.order_by('-created_at')[:50]
+    return Response(SimulationJobSerializer(jobs, many=True).data)
+
+
+@api_view(['GET'])
+def simulation_job_detail(request, job_id):
+    """
+    Status and progress of one simulation job
+    """
+    job = SimulationJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return Response({"error": f"Simulation job {job_id} not found"}, status=404)
+    return Response(SimulationJobSerializer(job).data)
+
+
+@api_view(['GET'])
+def simulation_job_results(request, job_id):
+    """
+    Summary and per-item results of a finished simulation job
+    """
+    job = SimulationJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return Response({"error": f"Simulation job {job_id} not found"}, status=404)
+    if job.status != 'done':
+        return Response({
+            "error": f"Simulation job {job_id} is {job.status}",
+            "job": SimulationJobSerializer(job).data,
+        }, status=409)
+
+    return Response({
+        "job": SimulationJobSerializer(job).data,
+        "summary": job.summary,
+        "per_item": job.per_item,
+    })